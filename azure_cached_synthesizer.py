@@ -0,0 +1,130 @@
+import asyncio
+import logging
+from typing import Iterable, Optional
+
+import azure.cognitiveservices.speech as speechsdk
+
+from vocode.streaming.agent.bot_sentiment_analyser import BotSentiment
+from vocode.streaming.models.message import BaseMessage, SSMLMessage
+from vocode.streaming.models.synthesizer import AzureSynthesizerConfig
+from vocode.streaming.synthesizer.azure_synthesizer import AzureSynthesizer
+from vocode.streaming.synthesizer.base_synthesizer import SynthesisResult, encode_as_wav
+
+from src.metrics import span
+from src.tts_cache import TTSAudioCache, make_cache_key
+
+
+class CachedAzureSynthesizer(AzureSynthesizer):
+    """
+    AzureSynthesizer that serves fixed and frequent phrases from a TTSAudioCache.
+    Phrases requested at least `min_hits_to_cache` times, or pre-warmed at startup,
+    are synthesized once and then played back without calling the speech service.
+    """
+
+    def __init__(
+        self,
+        synthesizer_config: AzureSynthesizerConfig,
+        audio_cache: TTSAudioCache,
+        logger: Optional[logging.Logger] = None,
+        min_hits_to_cache: int = 2,
+        max_cached_text_length: int = 300,
+        **kwargs,
+    ):
+        super().__init__(synthesizer_config, logger=logger, **kwargs)
+        self.audio_cache = audio_cache
+        self.min_hits_to_cache = min_hits_to_cache
+        self.max_cached_text_length = max_cached_text_length
+
+    def cache_key(self, text: str) -> str:
+        audio_config = (
+            self.synthesizer_config.audio_encoding,
+            self.synthesizer_config.sampling_rate,
+            self.pitch,
+            self.rate,
+        )
+        return make_cache_key(self.voice_name, audio_config, text)
+
+    def reset_for_reuse(self) -> None:
+        """Clear per-conversation state so the synthesizer can be pooled again."""
+        self.synthesizer.synthesis_word_boundary.disconnect_all()
+        self.synthesizer_config.should_encode_as_wav = False
+
+    def synthesize_to_bytes(self, text: str) -> bytes:
+        """Synthesize the whole phrase, blocking, and return the raw audio."""
+        result = self.synthesizer.speak_ssml(self.create_ssml(text))
+        # never cache the empty audio of a failed synthesis
+        if result.reason != speechsdk.ResultReason.SynthesizingAudioCompleted:
+            raise RuntimeError(f"Speech synthesis failed with reason {result.reason}")
+        return result.audio_data
+
+    async def prewarm(self, texts: Iterable[str]) -> None:
+        """Synthesize fixed phrases ahead of the first call and pin them on disk."""
+        for text in texts:
+            if not text.strip():
+                continue
+            key = self.cache_key(text)
+            if self.audio_cache.get(key) is not None:
+                continue
+            audio = await asyncio.get_event_loop().run_in_executor(
+                self.thread_pool_executor, self.synthesize_to_bytes, text
+            )
+            self.audio_cache.put(key, audio)
+            self.logger.debug(f"Pre-warmed TTS cache for: {text.strip()[:50]}")
+
+    def create_synthesis_result_from_audio(
+        self, audio: bytes, message: BaseMessage, chunk_size: int
+    ) -> SynthesisResult:
+        if self.synthesizer_config.should_encode_as_wav:
+            chunk_transform = lambda chunk: encode_as_wav(
+                chunk, self.synthesizer_config
+            )
+        else:
+            chunk_transform = lambda chunk: chunk
+
+        async def chunk_generator():
+            for i in range(0, len(audio), chunk_size):
+                yield SynthesisResult.ChunkResult(
+                    chunk_transform(audio[i : i + chunk_size]),
+                    i + chunk_size >= len(audio),
+                )
+
+        return SynthesisResult(
+            chunk_generator(),
+            lambda seconds: self.get_message_cutoff_from_total_response_length(
+                message, seconds, len(audio)
+            ),
+        )
+
+    async def create_speech(
+        self,
+        message: BaseMessage,
+        chunk_size: int,
+        bot_sentiment: Optional[BotSentiment] = None,
+    ) -> SynthesisResult:
+        # SSML, styled and long messages are always synthesized live
+        if (
+            isinstance(message, SSMLMessage)
+            or (bot_sentiment and bot_sentiment.emotion)
+            or len(message.text) > self.max_cached_text_length
+        ):
+            with span("tts_start"):
+                return await super().create_speech(message, chunk_size, bot_sentiment)
+
+        key = self.cache_key(message.text)
+        audio = self.audio_cache.get(key)
+        if audio is not None:
+            self.logger.debug(f"TTS cache hit for: {message.text.strip()[:50]}")
+            return self.create_synthesis_result_from_audio(audio, message, chunk_size)
+
+        # frequent phrase: synthesize once in full and keep it for the next calls
+        if self.audio_cache.count_request(key) >= self.min_hits_to_cache:
+            with span("tts_synthesize"):
+                audio = await asyncio.get_event_loop().run_in_executor(
+                    self.thread_pool_executor, self.synthesize_to_bytes, message.text
+                )
+            self.audio_cache.put(key, audio, persist=False)
+            return self.create_synthesis_result_from_audio(audio, message, chunk_size)
+
+        # audio is streamed from here, the span covers the time to start synthesis
+        with span("tts_start"):
+            return await super().create_speech(message, chunk_size, bot_sentiment)
@@ -1,23 +1,109 @@
 import os
-import re
+import time
+import asyncio
+import contextvars
 import logging
-from typing import AsyncGenerator, Optional, Tuple
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+from uuid import UUID
 from vocode.streaming.agent.base_agent import RespondAgent
 from vocode.streaming.models.agent import ChatGPTAgentConfig
 from langchain.chat_models import AzureChatOpenAI
-from langchain.agents import initialize_agent, AgentType
-from langchain.memory import ConversationBufferWindowMemory
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.agents import AgentExecutor
+from langchain.tools import Tool
+from langchain.schema import BaseMessage, HumanMessage, SystemMessage
 
-from customized_tools import hsbc_knowledge_tool, reject_tool
+from customized_tools import (
+    KNOWLEDGE_NOT_FOUND_MESSAGE,
+    REJECT_MESSAGE,
+    conversation_budget,
+    hsbc_knowledge_tool_pgvector as hsbc_knowledge_tool,
+    reject_tool,
+)
+from src.agent_prompt import PrefixCachedChatAgent
+from src.knowledge_search import query_similarity
+from src.intent_router import (
+    AGENT_ROUTE,
+    GREETING_ROUTE,
+    KNOWLEDGE_ROUTE,
+    REJECT_ROUTE,
+    IntentRouter,
+    greeting_response,
+)
+from src.llm_gateway import GatewayChatModel, create_gateway, deadline
+from src.metrics import record_span, span, trace_turn
+from src.conversation_memory import ConversationMemoryStore, TokenBudgetMemory
+from src.session_store import InMemorySessionStore
+from src.tts_chunker import SpeechChunker
+from src.usage import usage_feature, usage_owner
 
-# prompt prefix append before the chat conversation
-PROMPT_PREFIX = """
+# system prompt shared by the agent and the intent router fast path
+SYSTEM_PROMPT = """
 You are a customer service AI for HSBC Hongkong, your primary focus would be to assist customers with questions and issues related to HSBC Hongkong products and services. 
 If a customer asks a question that is not related to HSBC Hongkong, politely inform them that I am only able to assist with HSBC Hongkong related questions.
+"""
+
+# prompt used by the knowledge fast path, answers in a single LLM call
+KNOWLEDGE_PROMPT = """
+You are a customer service AI for HSBC Hongkong. Answer the customer's question using only the HSBC knowledge below.
+Keep the answer short and conversational because it will be read out to the customer.
+
+HSBC knowledge: ```{context}```
+
+Question: {question}
+"""
+
+# prompt used to fold earlier turns into the running conversation summary
+SUMMARY_PROMPT = """
+Update the summary of a customer service call with HSBC Hongkong with the new lines of the conversation.
+Keep the customer's questions, the products discussed and any facts the customer gave. Answer with the new summary only.
+
+Current summary: {summary}
 
-You have access to the following tools:
+New lines of the conversation:
+{new_lines}
 """
 
+# response when the agent fails to answer
+FALLBACK_MESSAGE = "Sorry, I am not able to answer your question at the moment."
+
+class SpanCallbackHandler(BaseCallbackHandler):
+    """
+    Records a span for every LLM call and tool run of the agent
+    """
+
+    def __init__(self):
+        self.started: Dict[UUID, Tuple[str, float]] = {}
+
+    def _start(self, name: str, run_id: UUID) -> None:
+        self.started[run_id] = (name, time.perf_counter())
+
+    def _end(self, run_id: UUID) -> None:
+        name, started = self.started.pop(run_id, (None, None))
+        if name is not None:
+            record_span(name, started, time.perf_counter() - started)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts, *, run_id: UUID, **kwargs) -> None:
+        self._start("llm", run_id)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs) -> None:
+        self._end(run_id)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs) -> None:
+        self._end(run_id)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs) -> None:
+        self._start(f"tool:{serialized.get('name')}", run_id)
+
+    def on_tool_end(self, output: str, *, run_id: UUID, **kwargs) -> None:
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id: UUID, **kwargs) -> None:
+        self._end(run_id)
+
+
 class AzureChatGPTAgent(RespondAgent[ChatGPTAgentConfig]):
     
     def __init__(
@@ -25,6 +111,13 @@ class AzureChatGPTAgent(RespondAgent[ChatGPTAgentConfig]):
         agent_config: ChatGPTAgentConfig,
         logger: Optional[logging.Logger] = None,
         openai_api_key: Optional[str] = None,
+        use_intent_router: bool = True,
+        speculative_retrieval: bool = False,
+        speculative_retrieval_timeout: float = 10.0,
+        speculative_match_threshold: float = 0.6,
+        session_store=None,
+        memory_token_budget: int = 1000,
+        turn_deadline: Optional[float] = 15.0,
     ):
         # init base agent
         super().__init__(agent_config=agent_config, logger=logger)
@@ -33,34 +126,217 @@ class AzureChatGPTAgent(RespondAgent[ChatGPTAgentConfig]):
         if not agent_config.azure_params:
             raise ValueError("AzureOpenAIConfig must be set in agent config")
         
-        # set up azure openai api
-        os.environ['OPENAI_API_KEY'] = os.getenv('AZURE_OPENAI_API_KEY')
-        os.environ["OPENAI_API_BASE"] = os.getenv('AZURE_OPENAI_API_BASE')
-        os.environ["OPENAI_API_TYPE"] = os.getenv('AZURE_OPENAI_API_TYPE')
-        os.environ["OPENAI_API_VERSION"] = os.getenv('AZURE_OPENAI_API_VERSION')
-
-        # create llm model
-        self.llm = AzureChatOpenAI(deployment_name=os.getenv('AZURE_OPENAI_API_ENGINE'), model=os.getenv('AZURE_OPENAI_API_MODEL'))
-
-        # create tools
-        self.tools = [hsbc_knowledge_tool, reject_tool]
-
-        # create memory, window size = 10
-        self.memory = ConversationBufferWindowMemory(memory_key='chat_history',k=10, return_messages=True)
-
-        # create agent
-        self.agent_chain = initialize_agent(
-            tools=self.tools,
-            llm=self.llm,
-            agent=AgentType.CHAT_CONVERSATIONAL_REACT_DESCRIPTION,
-            verbose=True,
-            memory=self.memory,
-            agent_kwargs={
-                "system_message": PROMPT_PREFIX
-            }
+        # llm and agent chain are created on first use or by warmup() at startup
+        self.turn_deadline = turn_deadline
+        self._llm = None
+        self._agent_chain = None
+        self._init_lock = threading.Lock()
+
+        # speculative knowledge retrieval, started as soon as the transcript arrives
+        self.speculative_retrieval = speculative_retrieval
+        self.speculative_retrieval_timeout = speculative_retrieval_timeout
+        # share of content words the agent's query has to have in common with the transcript
+        self.speculative_match_threshold = speculative_match_threshold
+        self.speculation_executor = ThreadPoolExecutor(max_workers=4) if speculative_retrieval else None
+        # conversation_id -> (query, lookup) of the current turn
+        self.speculations: Dict[str, Tuple[str, Future]] = {}
+        self.turn_context = threading.local()
+
+        # create tools; knowledge tool picks up the speculative result when there is one
+        knowledge_tool = Tool(
+            name=hsbc_knowledge_tool.name,
+            description=hsbc_knowledge_tool.description,
+            func=self.knowledge_lookup,
         )
+        self.tools = [knowledge_tool, reject_tool]
 
-        print(self.agent_chain.agent.llm_chain)
+        # chat history per conversation, kept in a session store shared by all workers
+        # older turns are summarised in the background to keep the memory within the token budget
+        self.memory_store = ConversationMemoryStore(
+            session_store or InMemorySessionStore(),
+            summarise=self.summarise_history,
+            max_tokens=memory_token_budget,
+        )
+
+        # local intent router, sends simple turns to zero-call or single-call paths
+        self.intent_router = IntentRouter() if use_intent_router else None
+
+    @property
+    def llm(self) -> AzureChatOpenAI:
+        if self._llm is None:
+            with self._init_lock:
+                if self._llm is None:
+                    # set up azure openai api
+                    os.environ['OPENAI_API_KEY'] = os.getenv('AZURE_OPENAI_API_KEY')
+                    os.environ["OPENAI_API_BASE"] = os.getenv('AZURE_OPENAI_API_BASE')
+                    os.environ["OPENAI_API_TYPE"] = os.getenv('AZURE_OPENAI_API_TYPE')
+                    os.environ["OPENAI_API_VERSION"] = os.getenv('AZURE_OPENAI_API_VERSION')
+
+                    # create llm model per azure region behind a gateway; the gateway retries, not the client
+                    self._llm = GatewayChatModel(
+                        gateway=create_gateway(
+                            lambda region: AzureChatOpenAI(
+                                deployment_name=os.getenv('AZURE_OPENAI_API_ENGINE'),
+                                model=os.getenv('AZURE_OPENAI_API_MODEL'),
+                                openai_api_base=region["api_base"],
+                                openai_api_key=region["api_key"],
+                                openai_api_version=os.getenv('AZURE_OPENAI_API_VERSION'),
+                                openai_api_type=os.getenv('AZURE_OPENAI_API_TYPE', 'azure'),
+                                request_timeout=self.turn_deadline,
+                                max_retries=0,
+                            )
+                        )
+                    )
+        return self._llm
+
+    @property
+    def agent_chain(self):
+        if self._agent_chain is None:
+            llm = self.llm
+            with self._init_lock:
+                if self._agent_chain is None:
+                    # create agent; its prompt starts with a static prefix of system prompt,
+                    # tool descriptions and format instructions so provider prompt caching applies
+                    self._agent_chain = AgentExecutor.from_agent_and_tools(
+                        agent=PrefixCachedChatAgent.from_llm_and_tools(
+                            llm=llm, tools=self.tools, system_message=SYSTEM_PROMPT
+                        ),
+                        tools=self.tools,
+                        verbose=True,
+                    )
+                    self.logger.debug(f"Agent prompt: {self._agent_chain.agent.llm_chain.prompt}")
+        return self._agent_chain
+
+    def warmup(self) -> None:
+        """
+        Create the llm and agent chain ahead of the first conversation
+        """
+        self.agent_chain
+
+    def summarise_history(self, summary: str, messages: List[BaseMessage]) -> str:
+        """
+        Fold earlier turns into the conversation summary, called in the background
+        """
+        new_lines = "\n".join(
+            f"{'Customer' if isinstance(m, HumanMessage) else 'Assistant'}: {m.content}" for m in messages
+        )
+        prompt = SUMMARY_PROMPT.format(summary=summary or "(empty)", new_lines=new_lines)
+        with usage_feature("memory_summary"):
+            return self.llm.predict_messages([HumanMessage(content=prompt)]).content
+
+    def start_speculative_retrieval(self, human_input: str, conversation_id: str) -> None:
+        """
+        Start the hsbc knowledge lookup in the background, in parallel with the first LLM call.
+        """
+        if not self.speculative_retrieval:
+            return
+        # run in a copy of the context so the lookup spans belong to the current turn
+        self.speculations[conversation_id] = (
+            human_input,
+            self.speculation_executor.submit(contextvars.copy_context().run, hsbc_knowledge_tool.run, human_input),
+        )
+
+    def knowledge_lookup(self, query: str) -> str:
+        """
+        Knowledge tool function. Uses the speculative result of the current turn if the
+        agent's tool input is close to the transcript, e.g. the question without its
+        question words, otherwise queries the knowledge base with the tool input.
+        """
+        conversation_id = getattr(self.turn_context, "conversation_id", None)
+        speculation = self.speculations.pop(conversation_id, None)
+        if speculation is not None:
+            speculated_query, lookup = speculation
+            if query_similarity(speculated_query, query) >= self.speculative_match_threshold:
+                try:
+                    result = lookup.result(timeout=self.speculative_retrieval_timeout)
+                    self.logger.debug("Using speculative knowledge retrieval result")
+                    return result
+                except Exception as e:
+                    self.logger.warning(f"Speculative knowledge retrieval failed: {e}")
+            else:
+                self.logger.debug("Agent query differs from the speculative knowledge retrieval")
+                lookup.cancel()
+        return hsbc_knowledge_tool.run(query)
+
+    def answer_from_knowledge(self, human_input: str, memory: TokenBudgetMemory) -> Optional[str]:
+        """
+        Single LLM call path: look up hsbc knowledge and answer directly.
+        Returns None if no knowledge is found so the caller can fall back to the agent.
+        """
+        context = self.knowledge_lookup(human_input)
+        if context == KNOWLEDGE_NOT_FOUND_MESSAGE:
+            return None
+        messages = [SystemMessage(content=SYSTEM_PROMPT)]
+        messages += memory.load_memory_variables({})["chat_history"]
+        messages.append(
+            HumanMessage(content=KNOWLEDGE_PROMPT.format(context=context, question=human_input))
+        )
+        with span("llm"), usage_feature("knowledge_answer"):
+            return self.llm.predict_messages(messages).content
+
+    def route_and_run(self, human_input: str, conversation_id: Optional[str] = None) -> str:
+        """
+        Classify the input and answer it on the cheapest route available.
+        The ReAct agent is only used when the intent router cannot handle the turn.
+        All LLM calls of the turn share the turn deadline and are accounted to the conversation.
+        """
+        with deadline(self.turn_deadline), usage_owner(conversation_id):
+            return self._route_and_run(human_input, conversation_id)
+
+    def _route_and_run(self, human_input: str, conversation_id: Optional[str]) -> str:
+        route = self.intent_router.classify(human_input) if self.intent_router else AGENT_ROUTE
+        start = time.perf_counter()
+
+        # the knowledge tool is only needed on the knowledge and agent routes;
+        # the lookup runs while the conversation memory is loaded
+        self.turn_context.conversation_id = conversation_id
+        if route in (KNOWLEDGE_ROUTE, AGENT_ROUTE):
+            self.start_speculative_retrieval(human_input, conversation_id)
+        memory = self.memory_store.load(conversation_id)
+
+        response = None
+        if route == AGENT_ROUTE and conversation_budget.exceeded():
+            # over budget: a single knowledge answer instead of the ReAct loop
+            conversation_budget.limit("agent_downgraded")
+            route = KNOWLEDGE_ROUTE
+        if route == GREETING_ROUTE:
+            response = greeting_response(human_input)
+        elif route == REJECT_ROUTE:
+            response = REJECT_MESSAGE
+        elif route == KNOWLEDGE_ROUTE:
+            response = self.answer_from_knowledge(human_input, memory)
+            if response is None and conversation_budget.exceeded():
+                conversation_budget.limit("agent_skipped")
+                response = FALLBACK_MESSAGE
+            elif response is None:
+                route = AGENT_ROUTE
+
+        try:
+            if response is None:
+                # the agent is shared, each turn runs it with the memory of its conversation
+                agent_executor = AgentExecutor.from_agent_and_tools(
+                    agent=self.agent_chain.agent,
+                    tools=self.tools,
+                    memory=memory,
+                    verbose=True,
+                )
+                # agent memory is updated by the agent executor itself
+                with usage_feature("agent"):
+                    response = agent_executor.run(input=human_input, callbacks=[SpanCallbackHandler()])
+            else:
+                # keep fast path turns in memory so follow up questions have context
+                memory.save_context({"input": human_input}, {"output": response})
+            self.memory_store.save(conversation_id, memory)
+        finally:
+            # drop the speculative result if the agent did not call the knowledge tool
+            self.speculations.pop(conversation_id, None)
+
+        if self.intent_router:
+            elapsed = time.perf_counter() - start
+            self.intent_router.record_latency(route, elapsed)
+            record_span(f"route:{route}", start, elapsed)
+            self.logger.info(f"Intent route [{route}] answered in {elapsed:.3f}s")
+        return response
 
     async def generate_response(
         self,
@@ -78,16 +354,21 @@ class AzureChatGPTAgent(RespondAgent[ChatGPTAgentConfig]):
             return
         # check if transcript is set
         assert self.transcript is not None
-        try:
-            # get response from llm
-            response = self.agent_chain.run(input=human_input)
-            # TODO replace by streaming api later
-            messsages = re.split(r'[,.]', response)
-            for message in messsages:
-                yield message
-        except Exception as e:
-            self.logger.error(f"Error generating response: {e}")
-            yield "Sorry, I am not able to answer your question at the moment."
+        with trace_turn(conversation_id):
+            try:
+                # get response from intent router fast path or llm agent, off the event loop;
+                # the executor thread runs in a copy of the context to record spans of this turn
+                with span("generate_response"):
+                    response = await asyncio.get_running_loop().run_in_executor(
+                        None, contextvars.copy_context().run, self.route_and_run, human_input, conversation_id
+                    )
+            except Exception as e:
+                self.logger.error(f"Error generating response: {e}")
+                response = FALLBACK_MESSAGE
+        # TODO replace by streaming api later, the chunker already accepts a token stream
+        chunker = SpeechChunker()
+        for message in chunker.feed(response) + chunker.flush():
+            yield message
     
     async def respond(
         self,
@@ -0,0 +1,185 @@
+""" Input tokens and prompt cache reuse of the agent prompt, before and after the static prefix.
+
+Replays the recorded conversations through the ReAct agent with the fake chat
+model of the replay benchmark, once with the default conversational agent
+prompt and once with the prefix-cached prompt, and captures every LLM request.
+Reports the input tokens per request and the tokens at the start of a request
+that are identical to the previous request, which is what provider-side
+prompt caching can reuse.
+
+With --live the captured requests are also sent to the AZURE_OPENAI_* deployment
+with streaming, to measure the time to first token of both prompts.
+
+Usage:
+    python -m benchmarks.agent_prompt_benchmark
+    python -m benchmarks.agent_prompt_benchmark --live --repeat 3
+"""
+import argparse
+import contextlib
+import io
+import logging
+import os
+import statistics
+import time
+from typing import Any, List, Optional
+
+from benchmarks.fakes import FakeAgentChatModel, FakeLatencies, load_data
+from benchmarks.replay_benchmark import Replay, percentile
+from langchain.schema import BaseMessage
+
+from src.tokens import count_message_tokens
+
+# the agent prompt before the static prefix
+LEGACY_SYSTEM_MESSAGE = """
+You are a customer service AI for HSBC Hongkong, your primary focus would be to assist customers with questions and issues related to HSBC Hongkong products and services.
+If a customer asks a question that is not related to HSBC Hongkong, politely inform them that I am only able to assist with HSBC Hongkong related questions.
+
+You have access to the following tools:
+"""
+
+
+class RecordingChatModel(FakeAgentChatModel):
+    """Fake agent chat model that keeps every request it receives."""
+
+    requests: List[List[BaseMessage]] = []
+
+    def _call(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ):
+        self.requests.append(list(messages))
+        return super()._call(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+def shared_prefix_tokens(
+    previous: List[BaseMessage], request: List[BaseMessage]
+) -> int:
+    """Tokens of the leading messages of a request that are identical to the previous request."""
+    shared = []
+    for a, b in zip(previous, request):
+        if (a.type, a.content) != (b.type, b.content):
+            break
+        shared.append(b)
+    return count_message_tokens(shared)
+
+
+def capture_requests(legacy: bool) -> List[List[BaseMessage]]:
+    from langchain.agents import AgentType, initialize_agent
+    from vocode.streaming.models.agent import AzureOpenAIConfig, ChatGPTAgentConfig
+
+    from azure_gpt_agent import AzureChatGPTAgent
+
+    agent = AzureChatGPTAgent(
+        ChatGPTAgentConfig(
+            prompt_preamble="This is HSBC Hongkong customer service chatbot.",
+            azure_params=AzureOpenAIConfig(
+                api_type="azure", api_version="2023-05-15", engine="replay"
+            ),
+        ),
+        logger=logging.getLogger("agent_prompt_benchmark"),
+        # every turn goes through the agent
+        use_intent_router=False,
+    )
+    llm = RecordingChatModel(latency=FakeLatencies().make("llm", 0), requests=[])
+    agent._llm = llm
+    if legacy:
+        agent._agent_chain = initialize_agent(
+            tools=agent.tools,
+            llm=llm,
+            agent=AgentType.CHAT_CONVERSATIONAL_REACT_DESCRIPTION,
+            agent_kwargs={"system_message": LEGACY_SYSTEM_MESSAGE},
+        )
+    replay = Replay(FakeLatencies(), latency_scale=0, concurrency=1)
+    with replay.fake_resources(), contextlib.redirect_stdout(io.StringIO()):
+        for conversation in load_data("conversations.json"):
+            for turn in conversation["turns"]:
+                agent.route_and_run(turn, conversation["conversation_id"])
+    return llm.requests
+
+
+def time_to_first_token(messages: List[BaseMessage]) -> float:
+    """Send a request to the live deployment with streaming and return the seconds until the first token."""
+    import openai
+
+    role = {"system": "system", "human": "user", "ai": "assistant"}
+    start = time.perf_counter()
+    response = openai.ChatCompletion.create(
+        engine=os.environ["AZURE_OPENAI_API_ENGINE"],
+        api_base=os.environ["AZURE_OPENAI_API_BASE"],
+        api_key=os.environ["AZURE_OPENAI_API_KEY"],
+        api_type=os.getenv("AZURE_OPENAI_API_TYPE", "azure"),
+        api_version=os.environ["AZURE_OPENAI_API_VERSION"],
+        messages=[{"role": role[m.type], "content": m.content} for m in messages],
+        max_tokens=1,
+        stream=True,
+    )
+    for chunk in response:
+        if chunk["choices"] and chunk["choices"][0].get("delta", {}).get("content"):
+            break
+    return time.perf_counter() - start
+
+
+def report(
+    name: str, requests: List[List[BaseMessage]], live: bool, repeat: int
+) -> dict:
+    tokens = [count_message_tokens(r) for r in requests]
+    shared = [
+        shared_prefix_tokens(previous, r) for previous, r in zip(requests, requests[1:])
+    ]
+    result = {
+        "requests": len(requests),
+        "input_tokens_mean": statistics.mean(tokens),
+        "input_tokens_total": sum(tokens),
+        "shared_prefix_tokens_mean": statistics.mean(shared) if shared else 0,
+        # tokens the provider has to process even with a warm prompt cache
+        "uncached_tokens_mean": statistics.mean(
+            t - s for t, s in zip(tokens[1:], shared)
+        )
+        if shared
+        else 0,
+    }
+    if live:
+        samples = [time_to_first_token(r) for _ in range(repeat) for r in requests]
+        result["ttft_p50"] = percentile(samples, 50)
+        result["ttft_p99"] = percentile(samples, 99)
+    print(
+        f"{name:<8} requests={result['requests']} input tokens mean={result['input_tokens_mean']:.0f} "
+        f"total={result['input_tokens_total']} shared prefix tokens mean={result['shared_prefix_tokens_mean']:.0f} "
+        f"uncached tokens mean={result['uncached_tokens_mean']:.0f}"
+        + (
+            f" ttft p50={result['ttft_p50']:.3f}s p99={result['ttft_p99']:.3f}s"
+            if live
+            else ""
+        )
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--live",
+        action="store_true",
+        help="measure time to first token on the Azure deployment",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1, help="live requests per captured request"
+    )
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "replay")
+    logging.basicConfig(level=logging.WARNING)
+    before = report("before", capture_requests(legacy=True), args.live, args.repeat)
+    after = report("after", capture_requests(legacy=False), args.live, args.repeat)
+    for key in ("input_tokens_mean", "uncached_tokens_mean", "ttft_p50"):
+        if key in after:
+            print(f"{key} {after[key] / before[key] - 1:+.0%}")
+
+
+if __name__ == "__main__":
+    main()
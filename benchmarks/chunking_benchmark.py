@@ -0,0 +1,117 @@
+""" Chunk count, embedded tokens, prompt size and answer recall of page chunking vs layout-aware chunking.
+
+Indexes the recorded structured documents (benchmarks/data/structured_documents.json)
+through the fake Form Recognizer client, once with page documents and the
+3,000 character RecursiveCharacterTextSplitter and once with layout blocks and
+the StructuredChunker. Retrieval uses hashed bag of words embeddings, so that
+similar texts get similar vectors without calling Azure OpenAI. A question is
+recalled when its answer is in one of the retrieved chunks.
+
+Usage:
+    python -m benchmarks.chunking_benchmark --max-tokens 300
+"""
+import argparse
+import contextlib
+import io
+import os
+import re
+import tempfile
+from unittest import mock
+
+import faiss
+import numpy as np
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from benchmarks.fakes import (
+    BagOfWordsEmbeddings,
+    FakeDocumentAnalysisClient,
+    FakeLatencies,
+    load_data,
+)
+from src.docsearch.chunker import StructuredChunker
+from src.docsearch.docsearch import docsearch_create_indexes_from_files
+from src.docsearch.faiss_qa import retrieve_faiss_indexes_from_texts
+from src.tokens import count_tokens
+
+
+def normalise(text: str) -> str:
+    return re.sub(r"\s+", " ", text)
+
+
+def evaluate(
+    name: str, text_splitter, layout_aware: bool, data: dict, num_nns: list[int]
+) -> None:
+    embeddings = BagOfWordsEmbeddings()
+    client = FakeDocumentAnalysisClient(FakeLatencies().make("ocr", 0))
+    with tempfile.TemporaryDirectory() as directory, mock.patch(
+        "time.sleep"
+    ), contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(
+        io.StringIO()
+    ):
+        paths = []
+        for document in data["documents"]:
+            paths.append(os.path.join(directory, document["name"]))
+            with open(paths[-1], "w") as f:
+                f.write("\f".join(document["pages"]))
+        faiss_index, index_doc_store = docsearch_create_indexes_from_files(
+            1536, paths, client, embeddings, text_splitter, layout_aware=layout_aware
+        )
+
+    chunk_tokens = [count_tokens(doc.page_content) for doc in index_doc_store.values()]
+    print(
+        f"{name:<8} chunks={len(chunk_tokens)} embedded tokens={sum(chunk_tokens)} "
+        f"index bytes={faiss.serialize_index(faiss_index).nbytes}"
+    )
+    questions = [q["question"] for q in data["questions"]]
+    for num_nn in num_nns:
+        k = min(num_nn, faiss_index.ntotal)
+        idxs = retrieve_faiss_indexes_from_texts(
+            questions, faiss_index, embeddings, num_nn=k
+        )
+        recalled, prompt_tokens = 0, []
+        for question, row in zip(data["questions"], idxs):
+            retrieved = [index_doc_store[i].page_content for i in row if i != -1]
+            prompt_tokens.append(sum(count_tokens(text) for text in retrieved))
+            recalled += any(
+                normalise(question["answer"]) in normalise(text) for text in retrieved
+            )
+        print(
+            f"{'':<8} k={num_nn}: recall={recalled / len(questions):.0%} "
+            f"prompt tokens mean={np.mean(prompt_tokens):.0f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=300,
+        help="chunk size of the StructuredChunker",
+    )
+    parser.add_argument(
+        "--num-nn",
+        type=int,
+        nargs="*",
+        default=[1, 3, 5],
+        help="retrieved chunks per question",
+    )
+    args = parser.parse_args()
+
+    data = load_data("structured_documents.json")
+    evaluate(
+        "pages",
+        RecursiveCharacterTextSplitter(chunk_size=3_000, chunk_overlap=300),
+        False,
+        data,
+        args.num_nn,
+    )
+    evaluate(
+        "layout", StructuredChunker(max_tokens=args.max_tokens), True, data, args.num_nn
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+""" Throughput of batched docsearch queries against the single-query loop.
+
+Builds a Faiss index of the recorded documents with the fake embeddings model,
+then answers the same queries once with docsearch_query_indexes in a loop and
+once with docsearch_query_indexes_batch, against the fake embeddings and
+completion LLM of the replay benchmark.
+
+Usage:
+    python -m benchmarks.docsearch_batch_benchmark --queries 20
+"""
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+from unittest import mock
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from benchmarks.fakes import (
+    FakeCompletionLLM,
+    FakeDocumentAnalysisClient,
+    FakeEmbeddings,
+    FakeLatencies,
+    write_documents,
+)
+from benchmarks.replay_benchmark import DOCSEARCH_QUESTIONS
+from src.docsearch.docsearch import (
+    docsearch_create_indexes_from_files,
+    docsearch_query_indexes,
+    docsearch_query_indexes_batch,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=1.0,
+        help="multiplier for all fake latencies",
+    )
+    parser.add_argument(
+        "--max-workers", type=int, default=5, help="concurrent Q/A calls of the batch"
+    )
+    args = parser.parse_args()
+
+    latencies = FakeLatencies()
+    embeddings = FakeEmbeddings(latencies.make("embedding", 0))
+    client = FakeDocumentAnalysisClient(latencies.make("ocr", 0))
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=3_000, chunk_overlap=300)
+    with tempfile.TemporaryDirectory() as directory, mock.patch(
+        "time.sleep"
+    ), contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(
+        io.StringIO()
+    ):
+        faiss_index, index_doc_store = docsearch_create_indexes_from_files(
+            1536, write_documents(directory), client, embeddings, text_splitter
+        )
+    embeddings.latency = latencies.make("embedding", args.latency_scale, seed=1)
+    llm = FakeCompletionLLM(latency=latencies.make("llm", args.latency_scale, seed=2))
+    queries = [
+        f"{DOCSEARCH_QUESTIONS[i % len(DOCSEARCH_QUESTIONS)]} ({i})"
+        for i in range(args.queries)
+    ]
+
+    start = time.perf_counter()
+    single = [
+        docsearch_query_indexes(q, faiss_index, index_doc_store, embeddings, llm)
+        for q in queries
+    ]
+    single_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = docsearch_query_indexes_batch(
+        queries,
+        faiss_index,
+        index_doc_store,
+        embeddings,
+        llm,
+        max_workers=args.max_workers,
+    )
+    batch_seconds = time.perf_counter() - start
+
+    assert batch == single, "batched answers differ from the single-query answers"
+    print(
+        f"single-query loop: {len(queries) / single_seconds:7.2f} queries/s ({single_seconds:.2f}s)"
+    )
+    print(
+        f"batch:             {len(queries) / batch_seconds:7.2f} queries/s ({batch_seconds:.2f}s)"
+    )
+    print(f"speedup:           {single_seconds / batch_seconds:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
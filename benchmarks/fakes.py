@@ -0,0 +1,628 @@
+""" Local stand-ins for Azure OpenAI, Form Recognizer, Refinitiv RKD, Postgres and the HSBC website.
+
+Every fake sleeps for a configurable, seeded latency so that replays are
+reproducible, and answers from the recorded data in benchmarks/data.
+"""
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import types
+from dataclasses import dataclass
+from typing import Any, List, Mapping, Optional
+
+import numpy as np
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.chat_models.base import SimpleChatModel
+from langchain.embeddings.base import Embeddings
+from langchain.llms.base import LLM
+from langchain.schema import BaseMessage
+
+from dags.knowledge_chunks import chunk_knowledge
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+EMBEDDING_DIMENSIONS = 1536
+
+
+def load_data(name: str) -> Any:
+    with open(os.path.join(DATA_DIR, name)) as f:
+        return json.load(f)
+
+
+class Latency:
+    """Seeded gaussian latency around a mean, scaled for the whole replay."""
+
+    def __init__(
+        self, mean: float, jitter: float = 0.2, scale: float = 1.0, seed: int = 0
+    ):
+        """
+        :param mean: mean latency in seconds
+        :param jitter: standard deviation relative to the mean
+        :param scale: multiplier applied to every latency, 0 disables sleeping
+        :param seed: random seed
+        """
+        self.mean = mean
+        self.jitter = jitter
+        self.scale = scale
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def seconds(self) -> float:
+        if self.scale <= 0 or self.mean <= 0:
+            return 0.0
+        with self._lock:
+            seconds = self.random.gauss(self.mean, self.mean * self.jitter)
+        return max(seconds, 0) * self.scale
+
+    def sleep(self) -> None:
+        seconds = self.seconds()
+        if seconds:
+            time.sleep(seconds)
+
+    async def asleep(self) -> None:
+        seconds = self.seconds()
+        if seconds:
+            await asyncio.sleep(seconds)
+
+
+@dataclass
+class FakeLatencies:
+    """Latency of each fake service; the defaults are typical for the live services."""
+
+    llm: float = 0.4
+    embedding: float = 0.05
+    pgvector: float = 0.01
+    rkd: float = 0.15
+    ocr: float = 0.3
+    http: float = 0.05
+
+    def make(self, name: str, scale: float, seed: int = 0) -> Latency:
+        return Latency(getattr(self, name), scale=scale, seed=seed)
+
+
+def fake_embedding(text: str) -> list[float]:
+    """Deterministic unit vector for a text, similar texts do not get similar vectors."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:4], "little")
+    vector = (
+        np.random.default_rng(seed)
+        .standard_normal(EMBEDDING_DIMENSIONS)
+        .astype("float32")
+    )
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+class FakeEmbeddings(Embeddings):
+    """Stand-in for OpenAIEmbeddings."""
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.latency.sleep()
+        return [fake_embedding(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.latency.sleep()
+        return fake_embedding(text)
+
+
+class BagOfWordsEmbeddings(Embeddings):
+    """Hashed bag of words embeddings: texts sharing words get similar vectors, for recall measurements."""
+
+    STOPWORDS = {
+        "a",
+        "an",
+        "and",
+        "are",
+        "at",
+        "be",
+        "by",
+        "can",
+        "do",
+        "does",
+        "for",
+        "how",
+        "i",
+        "if",
+        "in",
+        "is",
+        "it",
+        "my",
+        "of",
+        "on",
+        "or",
+        "the",
+        "to",
+        "what",
+        "when",
+        "which",
+        "with",
+    }
+
+    def __init__(self, latency: Optional[Latency] = None):
+        self.latency = latency
+
+    def vector(self, text: str) -> list[float]:
+        vector = np.zeros(EMBEDDING_DIMENSIONS, dtype="float32")
+        for word in re.findall(r"[a-z0-9]+", text.lower()):
+            if word not in self.STOPWORDS:
+                vector[
+                    int.from_bytes(hashlib.md5(word.encode()).digest()[:4], "little")
+                    % EMBEDDING_DIMENSIONS
+                ] += 1
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.latency:
+            self.latency.sleep()
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class FakeOpenAI:
+    """Stand-in for the openai module functions used by the tools and the scraping DAG."""
+
+    def __init__(self, llm_latency: Latency, embedding_latency: Latency):
+        self.llm_latency = llm_latency
+        self.embedding_latency = embedding_latency
+
+    def embedding_create(self, input, engine=None, **kwargs) -> dict:
+        self.embedding_latency.sleep()
+        return self.embedding_response(input)
+
+    async def embedding_acreate(self, input, engine=None, **kwargs) -> dict:
+        await self.embedding_latency.asleep()
+        return self.embedding_response(input)
+
+    def embedding_response(self, input) -> dict:
+        texts = [input] if isinstance(input, str) else input
+        return {
+            "data": [
+                {"index": i, "embedding": fake_embedding(t)}
+                for i, t in enumerate(texts)
+            ],
+            "usage": {
+                "prompt_tokens": sum(len(t.split()) for t in texts),
+                "total_tokens": 0,
+            },
+        }
+
+    def chat_completion_create(self, messages, engine=None, **kwargs) -> dict:
+        self.llm_latency.sleep()
+        content = " ".join(re.findall(r"\w+", messages[-1]["content"])[:200])
+        return {
+            "id": "chatcmpl-replay",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": engine or "gpt-35-turbo",
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+            ],
+            "usage": {
+                "completion_tokens": 200,
+                "prompt_tokens": 1000,
+                "total_tokens": 1200,
+            },
+        }
+
+
+class FakeAgentChatModel(SimpleChatModel):
+    """
+    Stand-in for AzureChatOpenAI. Plays the ReAct agent: calls the knowledge tool
+    first, then answers with the tool response; knowledge prompts are answered directly.
+    """
+
+    latency: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-agent-chat-model"
+
+    def _call(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        self.latency.sleep()
+        last = messages[-1].content
+        if "HSBC knowledge:" in last:
+            return re.search(r"```(.*?)```", last, re.S).group(1)[:300]
+        if "TOOL RESPONSE" in last:
+            observation = last.split("TOOL RESPONSE:", 1)[-1].split("USER'S INPUT", 1)[
+                0
+            ]
+            answer = " ".join(observation.split())[:300].replace('"', "'")
+            return json.dumps({"action": "Final Answer", "action_input": answer})
+        question = last.split("USER'S INPUT", 1)[-1].strip(" -\n")[:200]
+        return json.dumps(
+            {"action": "hsbc knowledge search tool", "action_input": question}
+        )
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        return {}
+
+
+class FakeCompletionLLM(LLM):
+    """Stand-in for the AzureOpenAI completion model used for summarisation and Q/A."""
+
+    latency: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-completion-llm"
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        self.latency.sleep()
+        words = re.findall(r"[A-Za-z]\w+", prompt)
+        return " ".join(words[-60:])
+
+
+class FakeCursor:
+    def __init__(self, connection: "FakePgConnection"):
+        self.connection = connection
+        self.records = []
+
+    def execute(self, sql: str, params=None) -> None:
+        self.connection.latency.sleep()
+        statement = sql.strip().lower()
+        if "hsbc_homepage_fingerprint" in statement:
+            if statement.startswith("insert"):
+                self.connection.fingerprints[params[0]] = tuple(params[:5])
+            self.records = (
+                list(self.connection.fingerprints.values())
+                if statement.startswith("select")
+                else []
+            )
+            return
+        if "hsbc_homepage_chunk" in statement:
+            self.execute_chunk_statement(statement, sql, params)
+            return
+        if "insert into hsbc_homepage_content" in statement:
+            self.connection.saved.append(time.perf_counter())
+        match = re.search(r"embedding <-> '(\[.*?\])'", sql, re.S)
+        if match:
+            query = np.array(json.loads(match.group(1)), dtype="float32")
+            distances = np.linalg.norm(self.connection.embeddings - query, axis=1)
+            self.records = [(self.connection.contents[int(np.argmin(distances))],)]
+        else:
+            self.records = []
+
+    def execute_chunk_statement(self, statement: str, sql: str, params) -> None:
+        chunks = self.connection.chunks
+        self.records = []
+        if statement.startswith("delete"):
+            chunks[:] = [chunk for chunk in chunks if chunk[0] != params[0]]
+        elif statement.startswith("insert"):
+            url, chunk_index, content, embedding = params
+            chunks.append(
+                (
+                    url,
+                    chunk_index,
+                    content,
+                    np.array(json.loads(embedding), dtype="float32"),
+                )
+            )
+        elif statement.startswith("select") and chunks:
+            query = np.array(
+                json.loads(re.search(r"embedding <-> '(\[.*?\])'", sql, re.S).group(1)),
+                dtype="float32",
+            )
+            limit = int(re.search(r"limit (\d+)", statement).group(1))
+            distances = np.linalg.norm(
+                np.stack([chunk[3] for chunk in chunks]) - query, axis=1
+            )
+            self.records = [chunks[i][:3] for i in np.argsort(distances)[:limit]]
+
+    def fetchall(self) -> list:
+        return self.records
+
+    def close(self) -> None:
+        pass
+
+
+class FakePgConnection:
+    """Stand-in for the psycopg2 connection to the pgvector knowledge table."""
+
+    def __init__(self, latency: Latency, knowledge: Optional[list[dict]] = None):
+        self.latency = latency
+        knowledge = knowledge if knowledge is not None else load_data("knowledge.json")
+        self.contents = [row["content"] for row in knowledge]
+        self.embeddings = np.array(
+            [fake_embedding(c) for c in self.contents], dtype="float32"
+        )
+        # rows of the knowledge chunk table: (url, chunk index, content, embedding)
+        self.chunks = [
+            (row["url"], i, chunk, np.array(fake_embedding(chunk), dtype="float32"))
+            for row in knowledge
+            for i, chunk in enumerate(chunk_knowledge(row["content"]))
+        ]
+        # perf_counter of every knowledge insert, used to time the scraping DAG per page
+        self.saved: list[float] = []
+        # rows of the page fingerprint table of the scraping DAG
+        self.fingerprints: dict[str, tuple] = {}
+
+    closed = 0
+    autocommit = False
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def commit(self) -> None:
+        pass
+
+
+class FakePgPool:
+    """Stand-in for the psycopg2 connection pool of the knowledge queries; the fake
+    connection is thread safe, so every query gets the same one."""
+
+    def __init__(self, connection: FakePgConnection):
+        self.connection = connection
+
+    def getconn(self) -> FakePgConnection:
+        return self.connection
+
+    def putconn(self, connection: FakePgConnection, close: bool = False) -> None:
+        pass
+
+    def closeall(self) -> None:
+        pass
+
+
+# line markers of the recorded documents for the layout of the fake analysis result
+PARAGRAPH_ROLES = {
+    "# ": "sectionHeading",
+    "[header] ": "pageHeader",
+    "[footer] ": "pageFooter",
+}
+
+
+def strip_marker(text: str) -> tuple[Optional[str], str]:
+    """Paragraph role of a marked text and the text without its marker."""
+    for marker, role in PARAGRAPH_ROLES.items():
+        if text.startswith(marker):
+            return role, text[len(marker) :]
+    return None, text
+
+
+def layout_blocks(page: str) -> list[tuple[str, list[str]]]:
+    """Split a page into ("paragraph" | "table", lines) blocks. Marked lines are paragraphs
+    of their own, consecutive lines with " | " are a table, blank lines end a paragraph.
+    """
+    blocks: list[tuple[str, list[str]]] = []
+    for line in page.split("\n"):
+        if not line.strip():
+            blocks.append(("break", []))
+            continue
+        if strip_marker(line)[0]:
+            blocks.append(("paragraph", [line]))
+            blocks.append(("break", []))
+            continue
+        kind = "table" if " | " in line else "paragraph"
+        if blocks and blocks[-1][0] == kind:
+            blocks[-1][1].append(line)
+        else:
+            blocks.append((kind, [line]))
+    return [(kind, lines) for kind, lines in blocks if kind != "break"]
+
+
+def analyze_layout(pages: list[str]) -> types.SimpleNamespace:
+    """Form Recognizer style result of page texts: pages with lines, paragraphs with roles and tables.
+    Paragraphs are separated by blank lines, table rows are lines with cells separated by " | ".
+    """
+    result = types.SimpleNamespace(pages=[], paragraphs=[], tables=[])
+    offset = 0
+
+    def region(page_number: int, length: int) -> dict:
+        return {
+            "bounding_regions": [types.SimpleNamespace(page_number=page_number)],
+            "spans": [types.SimpleNamespace(offset=offset, length=length)],
+        }
+
+    for page_number, page in enumerate(pages, start=1):
+        result.pages.append(
+            types.SimpleNamespace(
+                page_number=page_number,
+                lines=[
+                    types.SimpleNamespace(content=strip_marker(line)[1])
+                    for line in page.split("\n")
+                ],
+            )
+        )
+        for kind, block in layout_blocks(page):
+            if kind == "table":
+                cells = [line.split(" | ") for line in block]
+                result.tables.append(
+                    types.SimpleNamespace(
+                        row_count=len(cells),
+                        column_count=max(len(row) for row in cells),
+                        cells=[
+                            types.SimpleNamespace(
+                                row_index=r, column_index=c, content=content
+                            )
+                            for r, row in enumerate(cells)
+                            for c, content in enumerate(row)
+                        ],
+                        **region(page_number, len("\n".join(block))),
+                    )
+                )
+            else:
+                role, content = strip_marker(" ".join(block))
+                result.paragraphs.append(
+                    types.SimpleNamespace(
+                        role=role, content=content, **region(page_number, len(content))
+                    )
+                )
+            offset += len("\n".join(block)) + 1
+    return result
+
+
+class FakeDocumentAnalysisClient:
+    """Stand-in for the Form Recognizer client; the 'image' files contain the page texts."""
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+
+    def begin_analyze_document(self, model_id: str, document) -> Any:
+        self.latency.sleep()
+        result = analyze_layout(bytes(document).decode("utf-8").split("\f"))
+        return types.SimpleNamespace(result=lambda: result)
+
+
+def write_documents(directory: str) -> list[str]:
+    """Write the recorded documents as files for the fake OCR client.
+    :returns: file paths
+    """
+    paths = []
+    for document in load_data("documents.json"):
+        path = os.path.join(directory, document["name"])
+        with open(path, "w") as f:
+            f.write("\f".join(document["pages"] * document["repeat"]))
+        paths.append(path)
+    return paths
+
+
+class FakeResponse:
+    def __init__(
+        self,
+        payload: Any = None,
+        text: Optional[str] = None,
+        status_code: int = 200,
+        headers: Optional[dict] = None,
+    ):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = text if text is not None else json.dumps(payload)
+        self.content = self.text.encode("utf-8")
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+    def iter_content(self, chunk_size: int = 1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start : start + chunk_size]
+
+    def close(self) -> None:
+        pass
+
+
+class FakeRKD:
+    """Stand-in for the Refinitiv RKD REST api, replaces send_post_request."""
+
+    def __init__(self, latency: Latency):
+        self.latency = latency
+        self.articles = load_data("rkd_articles.json")
+
+    def headline(self, article: dict) -> dict:
+        # created today, so that the articles are within the window of the news store
+        return {
+            "ID": article["id"],
+            "ST": "Usable",
+            "CT": f"{datetime.date.today().isoformat()}T08:00:00+00:00",
+            "HT": article["headline"],
+            "TO": "BACT FIN HK",
+            "CO": "0005.HK",
+            "LN": "en",
+        }
+
+    def send_post_request(
+        self, url: str, requestMsg: dict, headers: dict, *args, **kwargs
+    ) -> FakeResponse:
+        self.latency.sleep()
+        if "CreateServiceToken" in url:
+            return FakeResponse(
+                {"CreateServiceToken_Response_1": {"Token": "replay-token"}}
+            )
+        if "RetrieveHeadlineML" in url:
+            headlines = [self.headline(a) for a in self.articles]
+            return FakeResponse(
+                {
+                    "RetrieveHeadlineML_Response_1": {
+                        "HeadlineMLResponse": {"HEADLINEML": {"HL": headlines}}
+                    }
+                }
+            )
+        if "RetrieveStoryML" in url:
+            stories = [{**self.headline(a), "TE": a["story"]} for a in self.articles]
+            return FakeResponse(
+                {
+                    "RetrieveStoryML_Response_1": {
+                        "StoryMLResponse": {
+                            "Status": {"StatusMsg": "OK"},
+                            "STORYML": {"HL": stories},
+                        }
+                    }
+                }
+            )
+        return FakeResponse(status_code=404, text="")
+
+
+class FakeWebsite:
+    """Stand-in for the HSBC homepage and wealth insights feed, replaces requests.get."""
+
+    def __init__(self, latency: Latency, homepage_url: str, insights_url: str):
+        self.latency = latency
+        self.homepage_url = homepage_url
+        self.insights_url = insights_url
+        self.pages = {page["path"]: page for page in load_data("pages.json")}
+
+    def page_html(self, page: dict) -> str:
+        navigation = "".join(
+            f'<li><a href="{path}">{p["title"]}</a></li>'
+            for path, p in self.pages.items()
+        )
+        body = "".join(f"<p>{paragraph}</p>" for paragraph in page["paragraphs"])
+        return (
+            f"<html><head><title>{page['title']}</title><script>var tracking = 1;</script></head>"
+            f"<body><nav><ul>{navigation}</ul></nav><main><h1>{page['title']}</h1>{body}</main>"
+            "<footer>Issued by The Hongkong and Shanghai Banking Corporation Limited</footer></body></html>"
+        )
+
+    def get(self, url: str, timeout=None, **kwargs) -> FakeResponse:
+        self.latency.sleep()
+        if url == self.insights_url:
+            articles = [
+                {"title": page["title"], "href": self.homepage_url + path}
+                for path, page in list(self.pages.items())[:2]
+            ]
+            return FakeResponse(articles)
+        path = (
+            url[len(self.homepage_url) :] if url.startswith(self.homepage_url) else url
+        )
+        if path in ("", "/"):
+            # the homepage links to the first pages only, the others are linked from their navigation
+            links = "".join(
+                f'<a href="{p}">{page["title"]}</a>'
+                for p, page in list(self.pages.items())[:3]
+            )
+            return FakeResponse(
+                text=f'<html><body><a href="/">Home</a><a href="#main">Skip</a>{links}</body></html>'
+            )
+        if path in self.pages:
+            html = self.page_html(self.pages[path])
+            etag = '"%s"' % hashlib.sha1(html.encode("utf-8")).hexdigest()[:16]
+            return FakeResponse(
+                text=html,
+                headers={"Content-Type": "text/html; charset=utf-8", "ETag": etag},
+            )
+        return FakeResponse(status_code=404, text="")
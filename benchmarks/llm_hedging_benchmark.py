@@ -0,0 +1,102 @@
+""" Tail latency of the LLM gateway with and without hedged requests.
+
+Local stub deployments answer after a lognormal latency, and a small share of
+requests hits a slow tail (a throttled or overloaded region). The benchmark
+sends the same request stream through the gateway with hedging off and on and
+reports the latency percentiles and the share of extra requests hedging costs.
+
+Usage:
+    python -m benchmarks.llm_hedging_benchmark --requests 400
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.llm_gateway import Deployment, LLMGateway
+
+
+class StubDeployment:
+    def __init__(
+        self, median: float, tail_probability: float, tail_factor: float, seed: int
+    ):
+        self.median = median
+        self.tail_probability = tail_probability
+        self.tail_factor = tail_factor
+        self.random = random.Random(seed)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def complete(self) -> str:
+        with self._lock:
+            self.calls += 1
+            latency = self.random.lognormvariate(0, 0.3) * self.median
+            if self.random.random() < self.tail_probability:
+                latency *= self.tail_factor
+        time.sleep(latency)
+        return "ok"
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(q / 100 * len(ordered)), len(ordered) - 1)]
+
+
+def run(max_hedges: int, args) -> dict:
+    stubs = [
+        StubDeployment(args.median, args.tail_probability, args.tail_factor, seed=i)
+        for i in range(args.deployments)
+    ]
+    gateway = LLMGateway(
+        [Deployment(f"region-{i}", stub) for i, stub in enumerate(stubs)],
+        max_hedges=max_hedges,
+        initial_hedge_delay=args.median * 2,
+        min_samples=20,
+        max_workers=64,
+    )
+
+    def request(_) -> float:
+        start = time.perf_counter()
+        gateway.call(lambda stub: stub.complete())
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        samples = list(executor.map(request, range(args.requests)))
+    return {
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "mean": statistics.mean(samples),
+        "extra_requests": sum(s.calls for s in stubs) / args.requests - 1,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--deployments", type=int, default=2)
+    parser.add_argument(
+        "--median", type=float, default=0.05, help="median latency in seconds"
+    )
+    parser.add_argument("--tail-probability", type=float, default=0.05)
+    parser.add_argument("--tail-factor", type=float, default=10.0)
+    args = parser.parse_args()
+
+    print(
+        f"{'hedging':<8} {'p50 (s)':>9} {'p95 (s)':>9} {'p99 (s)':>9} {'extra requests':>15}"
+    )
+    for max_hedges in (0, 1):
+        result = run(max_hedges, args)
+        print(
+            f"{'on' if max_hedges else 'off':<8} {result['p50']:>9.3f} {result['p95']:>9.3f} "
+            f"{result['p99']:>9.3f} {result['extra_requests']:>14.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+""" Minimal app for the multi-worker load test.
+
+Each request runs the CPU bound part of a conversation turn (intent routing,
+response chunking, session store round trip) without calling external services.
+"""
+import os
+import uuid
+
+from fastapi import FastAPI
+
+from src.intent_router import classify_intent
+from src.session_store import create_session_store
+from src.tts_chunker import chunk_text
+
+app = FastAPI(docs_url=None)
+
+session_store = create_session_store(os.getenv("SESSION_STORE_URL"))
+
+TURNS = [
+    "Hello there",
+    "What is the interest rate of the HSBC time deposit?",
+    "How do I open an HSBC One account online?",
+    "Can you tell me a joke about football?",
+    "And what about the fees for that?",
+]
+
+RESPONSE = (
+    "The HSBC time deposit offers 4.2% p.a. for a 3 month term with a minimum deposit of HKD 10,000. "
+    "You can open it in the HSBC HK app, e.g. under Deposits, or at any branch. "
+    "Interest is paid at maturity and the deposit is renewed automatically unless you tell us otherwise."
+)
+
+# repetitions per request, sized to a few milliseconds of cpu work
+WORK_UNITS = int(os.getenv("LOAD_TEST_WORK_UNITS", "40"))
+
+
+@app.get("/turn")
+def turn():
+    conversation_id = uuid.uuid4().hex
+    messages = []
+    for _ in range(WORK_UNITS):
+        for text in TURNS:
+            classify_intent(text)
+            chunks = chunk_text(RESPONSE)
+            messages.append({"type": "human", "data": {"content": text}})
+            messages.append({"type": "ai", "data": {"content": " ".join(chunks)}})
+    session_store.save(conversation_id, messages[-20:])
+    session_store.delete(conversation_id)
+    return {"pid": os.getpid()}
@@ -0,0 +1,104 @@
+""" Local multi-worker load test.
+
+Starts benchmarks.load_app under uvicorn with 1, 2, 4 ... workers and sends
+concurrent requests to measure throughput per worker count. Scaling is only
+near linear up to the number of cpu cores of the machine.
+
+Usage:
+    python -m benchmarks.multiworker_load_test --workers 1 2 4 --requests 400
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=5).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Load test app did not start at {url}")
+
+
+def run_load(url: str, requests: int, concurrency: int) -> tuple[float, int]:
+    """Send requests and return the throughput in requests per second and the number of workers hit.
+    :param url: url of the load test endpoint
+    :param requests: total number of requests
+    :param concurrency: number of requests in flight
+    :returns: requests per second, number of distinct worker pids that answered
+    """
+
+    def request(_) -> bytes:
+        return urllib.request.urlopen(url, timeout=60).read()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        responses = list(executor.map(request, range(requests)))
+    elapsed = time.perf_counter() - start
+    return requests / elapsed, len(set(responses))
+
+
+def benchmark(workers: int, requests: int, concurrency: int) -> tuple[float, int]:
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "benchmarks.load_app:app",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        cwd=ROOT_DIR,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}/turn"
+        wait_until_ready(url)
+        # warm every worker before measuring
+        run_load(url, workers * 4, concurrency)
+        return run_load(url, requests, concurrency)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workers", type=int, nargs="*", default=[1, 2, 4])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+
+    print(f"cpu cores: {os.cpu_count()}")
+    print(f"{'workers':>8} {'req/s':>10} {'scaling':>8} {'pids':>5}")
+    baseline = None
+    for workers in args.workers:
+        throughput, pids = benchmark(workers, args.requests, args.concurrency)
+        baseline = baseline or throughput / workers
+        print(
+            f"{workers:>8} {throughput:>10.1f} {throughput / baseline:>7.2f}x {pids:>5}"
+        )
+
+
+if __name__ == "__main__":
+    main()
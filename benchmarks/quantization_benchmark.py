@@ -0,0 +1,74 @@
+""" Memory and recall of float32, fp16 and int8 storage of embeddings in faiss.
+
+Generates a corpus of unit vectors shaped like ada-002 embeddings (a large
+component shared by all texts plus topic clusters), indexes it with
+create_faiss_index for each quantization and compares the nearest neighbours
+of noisy queries with the exact float32 search.
+
+Usage:
+    python -m benchmarks.quantization_benchmark --vectors 20000
+"""
+import argparse
+import sys
+import time
+
+import faiss
+import numpy as np
+
+from src.docsearch.faiss_qa import create_faiss_index
+
+DIMENSIONS = 1536
+
+
+def corpus(num_vectors: int, num_topics: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    shared = rng.standard_normal(DIMENSIONS)
+    topics = rng.standard_normal((num_topics, DIMENSIONS))
+    vectors = (
+        2.0 * shared
+        + topics[rng.integers(num_topics, size=num_vectors)]
+        + 0.8 * rng.standard_normal((num_vectors, DIMENSIONS))
+    )
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype("float32")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--vectors", type=int, default=20_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    vectors = corpus(args.vectors, args.topics)
+    rng = np.random.default_rng(1)
+    queries = vectors[rng.integers(args.vectors, size=args.queries)]
+    queries = queries + 0.02 * rng.standard_normal(queries.shape).astype("float32")
+
+    # the embeddings as the python lists of floats returned by embed_query
+    as_list = vectors[0].astype("float64").tolist()
+    list_bytes = sys.getsizeof(as_list) + sum(sys.getsizeof(x) for x in as_list)
+    print(
+        f"{'storage':<14} {'bytes/vector':>12} {'vectors/GB':>12} {'recall@k':>9} {'top-1':>6} {'ms/query':>9}"
+    )
+    print(f"{'python list':<14} {list_bytes:>12} {2**30 // list_bytes:>12}")
+
+    _, exact = create_faiss_index(DIMENSIONS, vectors).search(queries, args.k)
+    for quantization in (None, "fp16", "int8"):
+        faiss_index = create_faiss_index(DIMENSIONS, vectors, quantization)
+        start = time.perf_counter()
+        _, found = faiss_index.search(queries, args.k)
+        elapsed = time.perf_counter() - start
+        bytes_per_vector = faiss.serialize_index(faiss_index).nbytes / args.vectors
+        recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(exact, found)])
+        top1 = np.mean(exact[:, 0] == found[:, 0])
+        print(
+            f"{quantization or 'float32':<14} {bytes_per_vector:>12.0f} {int(2**30 / bytes_per_vector):>12} "
+            f"{recall:>9.1%} {top1:>6.1%} {elapsed / args.queries * 1000:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
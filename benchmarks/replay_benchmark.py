@@ -0,0 +1,471 @@
+""" Offline replay benchmark.
+
+Replays recorded conversations, documents, news queries and web pages from
+benchmarks/data against the local fakes in benchmarks.fakes, so that no Azure,
+Refinitiv or Postgres access is needed and results are comparable between
+releases. Reports throughput, p50/p99 latency and peak python memory per scenario.
+
+Usage:
+    python -m benchmarks.replay_benchmark --output results.json
+    python -m benchmarks.replay_benchmark --baseline results.json
+    python -m benchmarks.replay_benchmark --scenarios agent --latency-scale 0
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from unittest import mock
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.fakes import (  # noqa: E402
+    FakeAgentChatModel,
+    FakeCompletionLLM,
+    FakeDocumentAnalysisClient,
+    FakeEmbeddings,
+    FakeLatencies,
+    FakeOpenAI,
+    FakePgConnection,
+    FakePgPool,
+    FakeRKD,
+    FakeWebsite,
+    load_data,
+    write_documents,
+)
+
+DOCSEARCH_QUESTIONS = [
+    "What was the profit before tax for the year?",
+    "How much cash rebate do HSBC mortgages offer?",
+    "What is the investment outlook for bonds?",
+    "Which markets does the outlook prefer for equities?",
+]
+
+NEWS_QUERIES = ["HSBC", "HSBC Hong Kong mortgage", "Asian banks"]
+
+# popular questions asked by many callers at the same time, in different spellings
+KNOWLEDGE_QUESTIONS = [
+    "What is the interest rate of the HSBC time deposit?",
+    "How do I report a lost HSBC card?",
+    "What is the annual fee of the HSBC Red credit card?",
+    "What are the HSBC Premier eligibility requirements?",
+]
+KNOWLEDGE_CALLERS = 8
+
+
+def percentile(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    index = min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def timed(fn: Callable, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+class Replay:
+    """Scenarios sharing one set of fakes; each returns the latency of every replayed item."""
+
+    def __init__(
+        self, latencies: FakeLatencies, latency_scale: float, concurrency: int
+    ):
+        self.latencies = latencies
+        self.scale = latency_scale
+        self.concurrency = concurrency
+        self.openai = FakeOpenAI(
+            latencies.make("llm", latency_scale, seed=1),
+            latencies.make("embedding", latency_scale, seed=2),
+        )
+
+    def fake_resources(self):
+        """Point the lazily created tool resources at the fakes."""
+        import openai
+
+        from src.knowledge_search import KnowledgeSearch
+        from src.newsearch.news_store import NewsStore
+        from src.resources import registry
+
+        # importing customized_tools registers the live factories first
+        import customized_tools
+
+        pg_conn = FakePgConnection(self.latencies.make("pgvector", self.scale, seed=3))
+        chat_llm = FakeCompletionLLM(
+            latency=self.latencies.make("llm", self.scale, seed=4)
+        )
+        # every scenario starts with an empty news store and knowledge search cache
+        knowledge_search = KnowledgeSearch(
+            customized_tools.lookup_hsbc_knowledge,
+            customized_tools.alookup_hsbc_knowledge,
+            ttl_seconds=customized_tools.KNOWLEDGE_CACHE_SECONDS,
+        )
+        resources = [
+            ("openai", openai),
+            ("pg_pool", FakePgPool(pg_conn)),
+            ("chat_llm", chat_llm),
+            ("news_store", NewsStore()),
+            ("knowledge_search", knowledge_search),
+        ]
+        for name, resource in resources:
+            registry.register(name, lambda resource=resource: resource)
+            # drop the instance of an earlier scenario
+            registry.reset(name)
+        patches = contextlib.ExitStack()
+        patches.enter_context(
+            mock.patch("openai.Embedding.create", self.openai.embedding_create)
+        )
+        patches.enter_context(
+            mock.patch("openai.Embedding.acreate", self.openai.embedding_acreate)
+        )
+        return patches
+
+    def agent(self) -> list[float]:
+        from vocode.streaming.models.agent import AzureOpenAIConfig, ChatGPTAgentConfig
+
+        from azure_gpt_agent import AzureChatGPTAgent
+
+        agent = AzureChatGPTAgent(
+            ChatGPTAgentConfig(
+                prompt_preamble="This is HSBC Hongkong customer service chatbot.",
+                azure_params=AzureOpenAIConfig(
+                    api_type="azure", api_version="2023-05-15", engine="replay"
+                ),
+            ),
+            logger=logging.getLogger("replay"),
+        )
+        agent._llm = FakeAgentChatModel(
+            latency=self.latencies.make("llm", self.scale, seed=5)
+        )
+
+        def replay_conversation(conversation: dict) -> list[float]:
+            return [
+                timed(agent.route_and_run, turn, conversation["conversation_id"])
+                for turn in conversation["turns"]
+            ]
+
+        with self.fake_resources(), ThreadPoolExecutor(
+            max_workers=self.concurrency
+        ) as executor:
+            conversations = load_data("conversations.json")
+            return [
+                s
+                for samples in executor.map(replay_conversation, conversations)
+                for s in samples
+            ]
+
+    def docsearch_ingest(self) -> list[float]:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        from src.docsearch.docsearch import docsearch_create_indexes_from_files
+
+        embeddings = FakeEmbeddings(
+            self.latencies.make("embedding", self.scale, seed=6)
+        )
+        client = FakeDocumentAnalysisClient(
+            self.latencies.make("ocr", self.scale, seed=7)
+        )
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=3_000, chunk_overlap=300
+        )
+        samples = []
+        with tempfile.TemporaryDirectory() as directory:
+            for path in write_documents(directory):
+                samples.append(
+                    timed(
+                        docsearch_create_indexes_from_files,
+                        1536,
+                        [path],
+                        client,
+                        embeddings,
+                        text_splitter,
+                    )
+                )
+        return samples
+
+    def docsearch_query(self) -> list[float]:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        from src.docsearch.docsearch import (
+            docsearch_create_indexes_from_files,
+            docsearch_query_indexes,
+        )
+
+        embeddings = FakeEmbeddings(self.latencies.make("embedding", 0))
+        client = FakeDocumentAnalysisClient(self.latencies.make("ocr", 0))
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=3_000, chunk_overlap=300
+        )
+        with tempfile.TemporaryDirectory() as directory, mock.patch("time.sleep"):
+            # the index is built without latency, only the queries are measured
+            faiss_index, index_doc_store = docsearch_create_indexes_from_files(
+                1536, write_documents(directory), client, embeddings, text_splitter
+            )
+        embeddings.latency = self.latencies.make("embedding", self.scale, seed=8)
+        llm = FakeCompletionLLM(latency=self.latencies.make("llm", self.scale, seed=9))
+
+        def query(question: str) -> float:
+            return timed(
+                docsearch_query_indexes,
+                question,
+                faiss_index,
+                index_doc_store,
+                embeddings,
+                llm,
+            )
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(query, DOCSEARCH_QUESTIONS))
+
+    def knowledge_burst(self) -> list[float]:
+        questions = [
+            question.upper() if caller % 2 else question
+            for question in KNOWLEDGE_QUESTIONS
+            for caller in range(KNOWLEDGE_CALLERS)
+        ]
+        with self.fake_resources():
+            from customized_tools import hsbc_knowledge_tool_pgvector
+
+            with ThreadPoolExecutor(max_workers=len(questions)) as executor:
+                return list(
+                    executor.map(
+                        lambda q: timed(hsbc_knowledge_tool_pgvector.run, q), questions
+                    )
+                )
+
+    def news_summary(self) -> list[float]:
+        rkd = FakeRKD(self.latencies.make("rkd", self.scale, seed=10))
+        with self.fake_resources(), mock.patch(
+            "src.newsearch.refinitiv_query.send_post_request", rkd.send_post_request
+        ):
+            from customized_tools import refinitiv_freetext_news_summary_tool
+
+            return [
+                timed(refinitiv_freetext_news_summary_tool.run, query)
+                for query in NEWS_QUERIES
+            ]
+
+    def news_summary_local(self) -> list[float]:
+        """news_summary after the news poller has filled the store; queries with too few stored matches go to RKD"""
+        rkd = FakeRKD(self.latencies.make("rkd", self.scale, seed=10))
+        with self.fake_resources(), mock.patch(
+            "src.newsearch.refinitiv_query.send_post_request", rkd.send_post_request
+        ):
+            from customized_tools import (
+                create_news_poller,
+                refinitiv_freetext_news_summary_tool,
+            )
+
+            with mock.patch("time.sleep"):
+                create_news_poller(["HSBC", "Asian banks"]).poll_once()
+            return [
+                timed(refinitiv_freetext_news_summary_tool.run, query)
+                for query in NEWS_QUERIES
+            ]
+
+    def run_scraping_dag(self, runs: int) -> tuple[list[float], FakePgConnection]:
+        """Run the scraping DAG runs times against one website and database.
+        :returns: duration of every run and the database
+        """
+        homepage_url = "https://replay.hsbc.local"
+        insights_url = homepage_url + "/wealth-insights.json"
+        website = FakeWebsite(
+            self.latencies.make("http", self.scale, seed=11), homepage_url, insights_url
+        )
+        pg_conn = FakePgConnection(
+            self.latencies.make("pgvector", self.scale, seed=12), knowledge=[]
+        )
+        state_dir = tempfile.mkdtemp()
+        env = {
+            "hsbc_homepage_url": homepage_url,
+            "wealth_insigths_articles": insights_url,
+            "crawl_state_file": os.path.join(state_dir, "crawl-state.json"),
+            "crawl_host_interval_seconds": str(0.05 * self.scale),
+        }
+        durations = []
+        with mock.patch.dict(os.environ, env), mock.patch(
+            "psycopg2.connect", lambda *a, **k: pg_conn
+        ), mock.patch("requests.get", website.get), mock.patch(
+            "openai.Embedding.create", self.openai.embedding_create
+        ), mock.patch(
+            "openai.ChatCompletion.create", self.openai.chat_completion_create
+        ):
+            dag = load_dag_module()
+            for _ in range(runs):
+                durations.append(timed(dag.extract_knowledge.function))
+        return durations, pg_conn
+
+    def scraping_dag(self) -> list[float]:
+        start = time.perf_counter()
+        _, pg_conn = self.run_scraping_dag(runs=1)
+        # every extracted page ends with one save to pgvector
+        timestamps = [start, *pg_conn.saved]
+        return [b - a for a, b in zip(timestamps, timestamps[1:])]
+
+    def scraping_dag_rerun(self) -> list[float]:
+        # the nightly run after the first one, the site did not change
+        durations, _ = self.run_scraping_dag(runs=2)
+        return durations[1:]
+
+
+def load_dag_module() -> types.ModuleType:
+    """Import the scraping DAG; airflow is replaced by a minimal stand-in when it is not installed."""
+    if "airflow" not in sys.modules and importlib.util.find_spec("airflow") is None:
+        airflow = types.ModuleType("airflow")
+        decorators = types.ModuleType("airflow.decorators")
+
+        class DAG(contextlib.nullcontext):
+            def __init__(self, *args, **kwargs):
+                super().__init__()
+
+        airflow.DAG = DAG
+        decorators.task = lambda **kwargs: _Task
+        sys.modules.setdefault("airflow", airflow)
+        sys.modules.setdefault("airflow.decorators", decorators)
+    # airflow puts the dags folder on sys.path, so that DAGs can import sibling modules
+    dags_dir = os.path.join(ROOT_DIR, "dags")
+    if dags_dir not in sys.path:
+        sys.path.insert(0, dags_dir)
+    path = os.path.join(dags_dir, "hsbc-homepage-scrapy-job.py")
+    spec = importlib.util.spec_from_file_location("hsbc_homepage_scrapy_job", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class _Task:
+    """Stand-in for an airflow task; calling it inside the DAG does not run it, .function does."""
+
+    def __init__(self, function: Callable):
+        self.function = function
+
+    def __call__(self, *args, **kwargs):
+        return None
+
+
+SCENARIOS = [
+    "agent",
+    "docsearch_ingest",
+    "docsearch_query",
+    "knowledge_burst",
+    "news_summary",
+    "news_summary_local",
+    "scraping_dag",
+    "scraping_dag_rerun",
+]
+
+
+def run_scenario(replay: Replay, name: str, trace_memory: bool) -> dict:
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    # the agent and tools print to stdout, keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(
+        io.StringIO()
+    ):
+        samples = getattr(replay, name)()
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if trace_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return {
+        "items": len(samples),
+        "seconds": elapsed,
+        "throughput": len(samples) / elapsed if elapsed else 0.0,
+        "p50": percentile(samples, 50),
+        "p99": percentile(samples, 99),
+        "mean": statistics.mean(samples),
+        "peak_memory_mb": peak / 1024 / 1024,
+    }
+
+
+def print_report(results: dict, baseline: dict) -> None:
+    print(
+        f"{'scenario':<18} {'items':>6} {'items/s':>9} {'p50 (s)':>9} {'p99 (s)':>9} {'peak MB':>9}"
+    )
+    for name, result in results.items():
+        line = (
+            f"{name:<18} {result['items']:>6} {result['throughput']:>9.2f} {result['p50']:>9.3f} "
+            f"{result['p99']:>9.3f} {result['peak_memory_mb']:>9.1f}"
+        )
+        previous = baseline.get(name)
+        if previous:
+            changes = [
+                f"{key} {(result[key] - previous[key]) / previous[key]:+.0%}"
+                for key in ("throughput", "p50", "p99", "peak_memory_mb")
+                if previous.get(key)
+            ]
+            line += "   vs baseline: " + ", ".join(changes)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--scenarios", nargs="*", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=1.0,
+        help="multiplier for all fake latencies",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="conversations or queries replayed in parallel",
+    )
+    parser.add_argument(
+        "--no-trace-memory",
+        action="store_true",
+        help="skip tracemalloc, which slows python code",
+    )
+    parser.add_argument(
+        "--output", help="write the results as json, e.g. to compare the next release"
+    )
+    parser.add_argument(
+        "--baseline", help="results json of a previous run to compare with"
+    )
+    args = parser.parse_args()
+
+    os.environ.setdefault("OPENAI_API_KEY", "replay")
+    logging.basicConfig(level=logging.WARNING)
+    replay = Replay(FakeLatencies(), args.latency_scale, args.concurrency)
+    results = {
+        name: run_scenario(replay, name, not args.no_trace_memory)
+        for name in args.scenarios
+    }
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    print_report(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "created": time.time(),
+                    "latency_scale": args.latency_scale,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+""" Peak memory and time to first story of streamed vs whole-body decoding of RKD story responses.
+
+Builds a RetrieveStoryML response of HTML-heavy stories and decodes it twice
+from a simulated download of 64 KB chunks at --mbps: once the previous way
+(wait for the body, response.text, json.loads) and once with iter_rkd_items,
+which decodes the HL items as the chunks arrive. Peak memory is measured with
+tracemalloc and includes the downloaded body.
+
+Usage:
+    python -m benchmarks.rkd_stream_benchmark --stories 50 --story-kb 200
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from unittest import mock
+
+from src.newsearch.refinitiv_query import STREAM_CHUNK_BYTES, iter_news_stories
+
+
+def story_response(num_stories: int, story_kb: int) -> bytes:
+    paragraph = "<p>HSBC said on Tuesday that its wealth business in Hong Kong grew &amp; expanded.</p>\n"
+    text = paragraph * (story_kb * 1024 // len(paragraph))
+    stories = [
+        {
+            "ID": f"urn:newsml:reuters.com:20230704:nL4N38Q{i:04d}",
+            "ST": "Usable",
+            "HT": f"Story {i}",
+            "TE": text,
+        }
+        for i in range(num_stories)
+    ]
+    response = {
+        "RetrieveStoryML_Response_1": {
+            "StoryMLResponse": {
+                "Status": {"StatusMsg": "OK", "StatusCode": 0},
+                "STORYML": {"HL": stories},
+            }
+        }
+    }
+    return json.dumps(response).encode("utf-8")
+
+
+class SimulatedDownload:
+    """Response whose body arrives in chunks at a fixed bandwidth."""
+
+    def __init__(self, body: bytes, bytes_per_second: float):
+        self.body = body
+        self.bytes_per_second = bytes_per_second
+
+    def iter_content(self, chunk_size: int):
+        for start in range(0, len(self.body), chunk_size):
+            chunk = self.body[start : start + chunk_size]
+            time.sleep(len(chunk) / self.bytes_per_second)
+            yield chunk
+
+    @property
+    def text(self) -> str:
+        return b"".join(self.iter_content(STREAM_CHUNK_BYTES)).decode("utf-8")
+
+    def close(self) -> None:
+        pass
+
+
+def whole_body(response: SimulatedDownload, started: float) -> tuple[float, int]:
+    result = json.loads(response.text, parse_int=str, parse_float=float)
+    stories = result["RetrieveStoryML_Response_1"]["StoryMLResponse"]["STORYML"]["HL"]
+    first = time.perf_counter() - started
+    return first, sum(len(story["TE"]) for story in stories)
+
+
+def streamed(response: SimulatedDownload, started: float) -> tuple[float, int]:
+    first, total = None, 0
+    with mock.patch(
+        "src.newsearch.refinitiv_query.send_post_request",
+        lambda *args, **kwargs: response,
+    ):
+        # each story is dropped once it has been processed
+        for story in iter_news_stories({}, []):
+            if first is None:
+                first = time.perf_counter() - started
+            total += len(story["TE"])
+    return first, total
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--stories", type=int, default=50)
+    parser.add_argument("--story-kb", type=int, default=200)
+    parser.add_argument(
+        "--mbps",
+        type=float,
+        default=100,
+        help="download bandwidth in megabits per second",
+    )
+    args = parser.parse_args()
+
+    body = story_response(args.stories, args.story_kb)
+    print(
+        f"response {len(body) / 2**20:.1f} MB, {args.stories} stories, {args.mbps:g} Mbit/s"
+    )
+    print(f"{'decoding':<12} {'first story (s)':>16} {'total (s)':>10} {'peak MB':>8}")
+    decoded = []
+    for name, decode in [("whole body", whole_body), ("streamed", streamed)]:
+        tracemalloc.start()
+        started = time.perf_counter()
+        first, characters = decode(
+            SimulatedDownload(body, args.mbps * 1e6 / 8), started
+        )
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        decoded.append(characters)
+        print(f"{name:<12} {first:>16.3f} {elapsed:>10.3f} {peak / 2**20:>8.1f}")
+    assert decoded[0] == decoded[1], "both decodings should return the same stories"
+
+
+if __name__ == "__main__":
+    main()
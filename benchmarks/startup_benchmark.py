@@ -0,0 +1,60 @@
+""" Startup time benchmark for the backend modules.
+
+Each module is imported in a fresh interpreter so that the measured time is what
+a new uvicorn worker pays before it can accept connections. Imports must not need
+live services, so the benchmark also fails if an import raises.
+
+Usage:
+    python -m benchmarks.startup_benchmark --repeat 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["customized_tools", "azure_gpt_agent", "main"]
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+
+def time_import(module: str) -> float:
+    """Import a module in a fresh interpreter and return the import time in seconds.
+    :param module: module name relative to the repository root
+    :returns: import time in seconds
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET.format(module=module)],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--modules", nargs="*", default=MODULES)
+    args = parser.parse_args()
+
+    print(f"{'module':<20} {'min (s)':>10} {'median (s)':>12} {'max (s)':>10}")
+    for module in args.modules:
+        timings = [time_import(module) for _ in range(args.repeat)]
+        print(
+            f"{module:<20} {min(timings):>10.3f} "
+            f"{statistics.median(timings):>12.3f} {max(timings):>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
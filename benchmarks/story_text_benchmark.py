@@ -0,0 +1,122 @@
+""" Summarisation prompt tokens and LLM calls with raw vs preprocessed Refinitiv story bodies.
+
+Wraps the recorded stories (benchmarks/data/rkd_articles.json) in the markup of
+RKD story bodies: styled paragraphs, company links, a data table, credits,
+contact lines, disclaimers and related coverage links, plus one long story to
+exercise the token cap. Each story is summarised with summarise_articles and
+the 7,000 character TEXT_SPLITTER of the news tool, once from the raw body and
+once from clean_story, counting the prompt tokens and LLM calls.
+
+Usage:
+    python -m benchmarks.story_text_benchmark --max-tokens 1000
+"""
+import argparse
+import time
+from typing import Any, List, Optional
+
+from langchain.llms.base import LLM
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from benchmarks.fakes import load_data
+from src.langchain_summary import summarise_articles
+from src.newsearch.story_text import clean_story
+from src.tokens import count_tokens
+
+
+class CountingLLM(LLM):
+    calls: int = 0
+    prompt_tokens: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "counting-llm"
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> str:
+        self.calls += 1
+        self.prompt_tokens += count_tokens(prompt)
+        return "summary"
+
+
+def rkd_story_body(article: dict, extra_paragraphs: int = 0) -> str:
+    link = '<a href="https://www.reuters.com/companies/0005.HK" class="tr-link" target="_blank">HSBC</a>'
+    paragraphs = [
+        f'<p class="tr-story-p1"><span class="tr-dateline">HONG KONG, July 4 (Reuters) - </span>'
+        f'{article["story"].removeprefix("<p>").split("</p>")[0].replace("HSBC", link, 1)}</p>',
+        *[
+            f'<p class="tr-story-p">{paragraph}</p>'
+            for paragraph in article["story"].replace("<p>", "").split("</p>")[1:]
+            if paragraph
+        ],
+        *[
+            f'<p class="tr-story-p">Analyst {i} at a Hong Kong brokerage expects net interest income '
+            f"to change by {i % 7 + 1}.{i % 10} percent in quarter {i % 4 + 1} as deposit costs shift.</p>"
+            for i in range(extra_paragraphs)
+        ],
+        '<table class="tr-table"><tr><th class="tr-th">Rate</th><th class="tr-th">Previous</th>'
+        '<th class="tr-th">Current</th></tr><tr><td class="tr-td">Prime</td><td class="tr-td">5.500%</td>'
+        '<td class="tr-td">5.625%</td></tr></table>',
+        '<p class="tr-signoff">(Reporting by Selena Li and Donny Kwok; Editing by Sam Holmes)</p>',
+        '<p class="tr-contact">((selena.li@thomsonreuters.com; +852 2843 1608; Reuters Messaging: '
+        "selena.li.thomsonreuters.com@reuters.net))</p>",
+        '<p class="tr-advisory">Our Standards: The Thomson Reuters Trust Principles.</p>',
+        '<ul class="tr-related"><li>For more on HSBC <a href="reuters://screen/verb=Open/url=cpurl://apps.cp./'
+        'Apps/0005.HK">click here</a></li><li>Further company coverage: <a href="reuters://REAL_TIME/'
+        'verb=FullQuote/ric=0005.HK">0005.HK</a></li></ul>',
+        '<p class="tr-copyright">Copyright Thomson Reuters 2023. All rights reserved.</p>',
+    ]
+    return (
+        '<div class="storyContent"><style>.tr-story-p{margin:0}</style>'
+        + "\n".join(paragraphs)
+        + "</div>"
+    )
+
+
+def summarise(headlines: list[str], texts: list[str]) -> CountingLLM:
+    llm = CountingLLM()
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=7_000, chunk_overlap=400)
+    summarise_articles(llm, text_splitter, headlines, texts)
+    return llm
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--max-tokens", type=int, default=1000, help="token budget of a clean story"
+    )
+    parser.add_argument("--long-story-paragraphs", type=int, default=200)
+    args = parser.parse_args()
+
+    articles = load_data("rkd_articles.json")
+    headlines = [a["headline"] for a in articles] + [
+        "HSBC outlook: analysts weigh rate path"
+    ]
+    bodies = [rkd_story_body(a) for a in articles] + [
+        rkd_story_body(articles[0], args.long_story_paragraphs)
+    ]
+
+    start = time.perf_counter()
+    stories = [clean_story(body, args.max_tokens) for body in bodies]
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{len(bodies)} stories, clean_story {elapsed / len(bodies) * 1000:.2f} ms/story"
+    )
+    print(f"{'story':<6} {'raw tokens':>10} {'clean tokens':>12}")
+    for index, story in enumerate(stories):
+        print(f"{index + 1:<6} {story.raw_tokens:>10} {story.tokens:>12}")
+    print(f"{'body':<6} {'LLM calls':>10} {'prompt tokens':>14}")
+    for name, texts in [("raw", bodies), ("clean", [story.text for story in stories])]:
+        llm = summarise(headlines, texts)
+        print(f"{name:<6} {llm.calls:>10} {llm.prompt_tokens:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,17 @@
 """ This is a file for custom tools that you can use in the LLM agent
 """
+import asyncio
+import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
+from itertools import islice
+from typing import Iterator
+
 import psycopg2
+import psycopg2.errors
+import psycopg2.pool
 import openai
 
 from azure.ai.formrecognizer import DocumentAnalysisClient
@@ -10,20 +20,37 @@ from dotenv import load_dotenv
 from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.llms import AzureOpenAI
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.tools import tool
+from langchain.tools import StructuredTool, tool
 
+from src.docsearch.chunker import StructuredChunker
 from src.docsearch.docsearch import (
     docsearch_create_indexes_from_files,
     docsearch_query_indexes,
 )
 from src.langchain_summary import produce_meta_summary, summarise_articles
+from src.newsearch.news_store import NewsPoller, NewsStore
+from src.newsearch.story_text import clean_story
 from src.newsearch.refinitiv_query import (
+    NewsArticle,
     create_rkd_base_header,
-    parse_freetext_headlines,
-    parse_news_stories_texts,
-    retrieve_freetext_headlines,
-    retrieve_news_stories,
+    iter_distinct_articles,
+    iter_freetext_headline_pages,
+    iter_news_stories,
+)
+from src.knowledge_search import (
+    KNOWLEDGE_SEARCH_ERRORS,
+    KnowledgeNotFound,
+    KnowledgeSearch,
+    classify_error,
+    group_chunks,
 )
+from src.llm_gateway import GatewayLLM, create_gateway
+from src.metrics import record_span, span
+from src.resources import registry
+from src.usage import BudgetGuard, ledger, record_embedding, usage_feature
+from src.utils import prefetch
+
+logger = logging.getLogger(__name__)
 
 # load environment variables
 load_dotenv()
@@ -32,32 +59,155 @@ load_dotenv()
 RKD_USERNAME = os.getenv("REFINITIV_USERNAME")
 RKD_PASSWORD = os.getenv("REFINITIV_PASSWORD")
 RKD_APP_ID = os.getenv("REFINITIV_APP_ID")
+# the news summary tool answers from the local news store when it has this many matching stories
+NEWS_STORE_MIN_HITS = int(os.getenv("NEWS_STORE_MIN_HITS", "3"))
+NEWS_MAX_ARTICLES = 10
+# story bodies are reduced to plain text of at most this many tokens before summarisation
+NEWS_STORY_MAX_TOKENS = int(os.getenv("NEWS_STORY_MAX_TOKENS", "1000"))
+# the knowledge search tool answers with the nearest of this many knowledge chunks within a token budget
+KNOWLEDGE_TOP_CHUNKS = int(os.getenv("KNOWLEDGE_TOP_CHUNKS", "4"))
+KNOWLEDGE_CONTEXT_TOKENS = int(os.getenv("KNOWLEDGE_CONTEXT_TOKENS", "350"))
+# knowledge search answers are reused for this long; the knowledge tables change once a night
+KNOWLEDGE_CACHE_SECONDS = float(os.getenv("KNOWLEDGE_CACHE_SECONDS", "300"))
+# database connections of the knowledge queries, shared by the agent threads, speculative and async lookups
+PG_POOL_SIZE = int(os.getenv("PG_POOL_SIZE", "8"))
+# queries wait for a free connection instead of failing when the pool is exhausted
+pg_pool_slots = threading.BoundedSemaphore(PG_POOL_SIZE)
+# tokens a conversation may use before expensive paths are downgraded, 0 is unlimited
+CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", "0"))
+# articles summarised by the news summary tool once the conversation is over its budget
+NEWS_OVER_BUDGET_ARTICLES = int(os.getenv("NEWS_OVER_BUDGET_ARTICLES", "3"))
+
+# shared by the agent routes and the tools
+conversation_budget = BudgetGuard(ledger, max_tokens=CONVERSATION_TOKEN_BUDGET)
+
+
+def configure_openai():
+    """Set the global openai configuration used by the embedding calls"""
+    openai.api_key = os.getenv('AZURE_OPENAI_API_KEY')
+    openai.api_version = os.getenv('AZURE_OPENAI_API_VERSION')
+    openai.api_type = os.getenv('AZURE_OPENAI_API_TYPE')
+    openai.api_base = os.getenv('AZURE_OPENAI_API_BASE')
+    return openai
+
+
+def create_chat_llm():
+    """Create an instance of Azure OpenAI per region behind a gateway; find completions is faster than chat"""
+    return GatewayLLM(
+        gateway=create_gateway(
+            lambda region: AzureOpenAI(
+                deployment_name="text-davinci-003",
+                model_name="text-davinci-003",
+                temperature=0,
+                best_of=1,
+                openai_api_base=region["api_base"],
+                openai_api_key=region["api_key"],
+                openai_api_version=os.getenv('AZURE_OPENAI_API_VERSION'),
+                openai_api_type=os.getenv('AZURE_OPENAI_API_TYPE', 'azure'),
+                max_retries=0,
+            ),
+            timeout=60.0,
+        )
+    )
+
+
+def create_pg_pool():
+    """Create a pool of database connections, one connection per concurrent query"""
+    host = os.getenv('PG_HOST')
+    dbname = os.getenv('PG_DB_NAME')
+    user = os.getenv('PG_USER')
+    password = os.getenv('PG_PASSWORD')
+    sslmode = os.getenv('PG_SSLMODE')
+
+    # Construct connection string
+    conn_string = f"host={host} user={user} dbname={dbname} password={password} sslmode={sslmode}"
+    return psycopg2.pool.ThreadedConnectionPool(1, PG_POOL_SIZE, conn_string)
+
+
+@contextmanager
+def pg_connection() -> Iterator:
+    """Connection of the pool for the queries of one thread; in autocommit, so that a
+    query leaves no transaction open and a failed query does not affect the next one.
+    A broken connection is closed instead of returned to the pool."""
+    pool = registry.get("pg_pool")
+    with pg_pool_slots:
+        conn = pool.getconn()
+        try:
+            conn.autocommit = True
+            yield conn
+        finally:
+            pool.putconn(conn, close=bool(conn.closed))
+
 
-# openai configuration
-openai.api_key = os.getenv('AZURE_OPENAI_API_KEY')
-openai.api_version = os.getenv('AZURE_OPENAI_API_VERSION')
-openai.api_type = os.getenv('AZURE_OPENAI_API_TYPE')
-openai.api_base = os.getenv('AZURE_OPENAI_API_BASE')
-
-# Create an instance of Azure OpenAI; find completions is faster than chat
-CHAT_LLM = AzureOpenAI(
-    deployment_name="text-davinci-003",
-    model_name="text-davinci-003",
-    temperature=0,
-    best_of=1,
+# resources are created on first use or during application startup warmup,
+# so importing this module does not need live services
+registry.register("openai", configure_openai)
+registry.register("chat_llm", create_chat_llm)
+registry.register("pg_pool", create_pg_pool, close=lambda pool: pool.closeall())
+registry.register("news_store", lambda: NewsStore(window_days=14))
+registry.register(
+    "knowledge_search",
+    lambda: KnowledgeSearch(
+        lookup_hsbc_knowledge, alookup_hsbc_knowledge, ttl_seconds=KNOWLEDGE_CACHE_SECONDS
+    ),
 )
+
+
+def create_news_poller(queries: list[str]) -> NewsPoller:
+    """Poller that keeps the news store filled with the headlines and stories of queries"""
+    return NewsPoller(
+        registry.get("news_store"),
+        lambda: create_rkd_base_header(RKD_USERNAME, RKD_PASSWORD, RKD_APP_ID),
+        queries,
+    )
+
 TEXT_SPLITTER = RecursiveCharacterTextSplitter(chunk_size=7_000, chunk_overlap=400)
 
-# Create database connection
-host = os.getenv('PG_HOST')
-dbname = os.getenv('PG_DB_NAME')
-user = os.getenv('PG_USER')
-password = os.getenv('PG_PASSWORD')
-sslmode = os.getenv('PG_SSLMODE')
+# fixed responses, shared with the intent router fast path in azure_gpt_agent
+KNOWLEDGE_NOT_FOUND_MESSAGE = "Sorry, I don't understand your question. Please try again."
+REJECT_MESSAGE = """
+    I'm sorry, but as a customer service chatbot for HSBC Hongkong, I am only able to assist with questions related to HSBC Hongkong products and services. 
+    Is there anything else related to HSBC Hongkong that I can help you with?
+    """
+
+
+def retrieve_news_articles(news_store: NewsStore, query: str) -> Iterator[NewsArticle]:
+    """
+    Distinct news articles with their stories from RKD, until NEWS_MAX_ARTICLES
+    articles have been found. An article is yielded as soon as its story has
+    been decoded from the response. Articles are written through to the news
+    store, so that follow-up questions on the topic are answered locally.
+    """
+    base_header = create_rkd_base_header(RKD_USERNAME, RKD_PASSWORD, RKD_APP_ID)
+
+    # freetext headline search; set last_n_weeks as 2; queries both headline and body
+    # for english text (Refinitiv is better for English than Chinese queries).
+    pages = iter_distinct_articles(
+        iter_freetext_headline_pages(base_header, query, 2, "both", "EN", page_size=NEWS_MAX_ARTICLES),
+        max_articles=NEWS_MAX_ARTICLES,
+    )
+    while True:
+        with span("refinitiv_headlines"):
+            articles = next(pages, None)
+        if articles is None:
+            return
 
-# Construct connection string
-conn_string = f"host={host} user={user} dbname={dbname} password={password} sslmode={sslmode}"
-conn = psycopg2.connect(conn_string)
+        # load full news stories related to those headlines; the span excludes
+        # the time the caller spends on an article before asking for the next one
+        articles_by_id = {article.id: article for article in articles}
+        started = time.perf_counter()
+        elapsed = 0.0
+        resumed = started
+        for story in iter_news_stories(base_header, list(articles_by_id)):
+            article = articles_by_id.get(story.get("ID"))
+            if article is None or story.get("ST") != "Usable" or "TE" not in story:
+                continue
+            article.story = story["TE"]
+            news_store.add([article])
+            elapsed += time.perf_counter() - resumed
+            yield article
+            resumed = time.perf_counter()
+        record_span("refinitiv_stories", started, elapsed + time.perf_counter() - resumed)
 
 
 @tool("Refinitiv freetext news search summary tool", return_direct=True)
@@ -67,29 +217,42 @@ def refinitiv_freetext_news_summary_tool(input: str) -> str:
     which have happened in the last num_weeks_ago.
     Then summarises the news articles and returns the summary of enriched headlines.
     """
-    base_header = create_rkd_base_header(RKD_USERNAME, RKD_PASSWORD, RKD_APP_ID)
+    # stories pulled in by the news poller; RKD is only queried live on a miss
+    news_store = registry.get("news_store")
+    with span("news_store_search"):
+        stored_articles = news_store.search(input, limit=NEWS_MAX_ARTICLES)
 
-    # freetext headline search; set last_n_weeks as 2; queries both headline and body
-    # for english text (Refinitiv is better for English than Chinese queries).
-    freetext_results = retrieve_freetext_headlines(base_header, input, 2, "both", "EN")
-    freetext_news_articles = parse_freetext_headlines(freetext_results)
+    if len(stored_articles) >= NEWS_STORE_MIN_HITS:
+        articles = iter(stored_articles)
+    else:
+        # the next story downloads and decodes while an article is summarised
+        articles = prefetch(retrieve_news_articles(news_store, input))
 
-    # load full news stories related to those headlines
-    news_stories = retrieve_news_stories(
-        base_header, [article.id for article in freetext_news_articles]
-    )
-    news_stories_texts = parse_news_stories_texts(news_stories)
-
-    # summarise the news stories
-    article_summaries = summarise_articles(
-        chat_llm=CHAT_LLM,
-        text_splitter=TEXT_SPLITTER,
-        article_headlines=[a.headline for a in freetext_news_articles],
-        article_texts=news_stories_texts,
-    )
+    # summarise the news stories; fewer of them once the conversation is over its budget
+    max_articles = NEWS_MAX_ARTICLES
+    if conversation_budget.exceeded():
+        conversation_budget.limit("news_articles_truncated")
+        max_articles = NEWS_OVER_BUDGET_ARTICLES
+    chat_llm = registry.get("chat_llm")
+    article_summaries = ""
+    raw_tokens = story_tokens = 0
+    for index, article in enumerate(islice(articles, max_articles)):
+        story = clean_story(article.story, NEWS_STORY_MAX_TOKENS)
+        raw_tokens += story.raw_tokens
+        story_tokens += story.tokens
+        with span("summarisation"), usage_feature("news_summary"):
+            article_summaries += summarise_articles(
+                chat_llm=chat_llm,
+                text_splitter=TEXT_SPLITTER,
+                article_headlines=[article.headline],
+                article_texts=[story.text],
+                first_index=index + 1,
+            )
+    logger.info(f"News stories reduced from {raw_tokens} to {story_tokens} tokens for summarisation")
 
     # produce meta summary
-    meta_summary = produce_meta_summary(CHAT_LLM, TEXT_SPLITTER, article_summaries)
+    with span("meta_summary"), usage_feature("news_summary"):
+        meta_summary = produce_meta_summary(chat_llm, TEXT_SPLITTER, article_summaries)
     return meta_summary
 
 
@@ -102,14 +265,15 @@ def document_question_answering(input: str) -> str:
 
     # initialise docsearch variables
     NUM_DIMENSIONS = 1536
-    EMBEDDINGS_MODEL = OpenAIEmbeddings(model="text-embedding-ada-002")
+    # Azure ada-002 deployments accept at most 16 inputs per request
+    EMBEDDINGS_MODEL = OpenAIEmbeddings(model="text-embedding-ada-002", chunk_size=16)
 
     ENDPOINT = os.getenv("FORM_RECOGNISER_ENDPOINT")
     CREDENTIAL = AzureKeyCredential(os.getenv("FORM_RECOGNISER_KEY"))
     DOC_ANALYSIS_CLIENT = DocumentAnalysisClient(ENDPOINT, CREDENTIAL)
 
-    # text splitter with smaller chunk size because docs are larger
-    TEXT_SPLITTER = RecursiveCharacterTextSplitter(chunk_size=3_000, chunk_overlap=300)
+    # layout-aware chunks of about 300 tokens that do not straddle sections
+    TEXT_SPLITTER = StructuredChunker(max_tokens=300)
 
     # TODO: Right now loads from a sample directory; need to find a way to load
     # from a vector database or otherwise? would this be pre-loaded??
@@ -118,49 +282,114 @@ def document_question_answering(input: str) -> str:
     uploaded_files = [os.path.join(FILES_DIR, f) for f in os.listdir(FILES_DIR)]
 
     # create faiss index and index_doc_store
-    faiss_index, index_doc_store = docsearch_create_indexes_from_files(
-        NUM_DIMENSIONS,
-        uploaded_files,
-        DOC_ANALYSIS_CLIENT,
-        EMBEDDINGS_MODEL,
-        TEXT_SPLITTER,
-    )
+    with span("docsearch_index"), usage_feature("document_qa"):
+        faiss_index, index_doc_store = docsearch_create_indexes_from_files(
+            NUM_DIMENSIONS,
+            uploaded_files,
+            DOC_ANALYSIS_CLIENT,
+            EMBEDDINGS_MODEL,
+            TEXT_SPLITTER,
+            layout_aware=True,
+        )
 
     # query faiss index
-    result = docsearch_query_indexes(
-        input, faiss_index, index_doc_store, EMBEDDINGS_MODEL, CHAT_LLM
-    )
+    with span("docsearch_query"), usage_feature("document_qa"):
+        result = docsearch_query_indexes(
+            input, faiss_index, index_doc_store, EMBEDDINGS_MODEL, registry.get("chat_llm")
+        )
     return result
 
 
-@tool("hsbc knowledge search tool")
-def hsbc_knowledge_tool_pgvector(input: str) -> str:
+def vector_literal(embedding: list[float], significant_digits: int = 7) -> str:
+    """pgvector literal of an embedding; float32 (vector) and float16 (halfvec) columns
+    do not keep more digits than this, so the query is half the size of the list repr"""
+    return "[" + ",".join(f"{x:.{significant_digits}g}" for x in embedding) + "]"
+
+
+def query_hsbc_knowledge(embedding: list[float]) -> str:
+    """Answer context of the knowledge chunks nearest to a query embedding"""
+    with pg_connection() as conn, span("pgvector_query"):
+        cur = conn.cursor()
+        try:
+            # nearest chunks, grouped by page
+            try:
+                cur.execute(
+                    "SELECT url, chunk_index, content FROM hsbc_homepage_chunk "
+                    f"ORDER BY embedding <-> '{vector_literal(embedding)}' LIMIT {KNOWLEDGE_TOP_CHUNKS};"
+                )
+                records = cur.fetchall()
+            except psycopg2.errors.UndefinedTable:
+                # the scraping DAG creates the chunk table on its next run
+                records = []
+            if not records:
+                # the knowledge was saved before it was chunked
+                cur.execute(
+                    f"SELECT content FROM hsbc_homepage_content ORDER BY embedding <-> '{vector_literal(embedding)}' LIMIT 1;"
+                )
+                records = [("", 0, content) for content, in cur.fetchall()]
+        finally:
+            cur.close()
+    if not records:
+        raise KnowledgeNotFound("hsbc knowledge tables are empty")
+    return group_chunks(records, KNOWLEDGE_CONTEXT_TOKENS)
+
+
+def lookup_hsbc_knowledge(query: str) -> str:
+    """Embed the query and answer with the nearest knowledge"""
+    registry.get("openai")
+    with span("embedding"):
+        response = openai.Embedding.create(input=query, engine="text-embedding-ada-002")
+    with usage_feature("knowledge_search"):
+        record_embedding([query], response)
+    return query_hsbc_knowledge(response['data'][0]['embedding'])
+
+
+async def alookup_hsbc_knowledge(query: str) -> str:
+    """Async version of lookup_hsbc_knowledge; the database query runs in a thread"""
+    registry.get("openai")
+    with span("embedding"):
+        response = await openai.Embedding.acreate(input=query, engine="text-embedding-ada-002")
+    with usage_feature("knowledge_search"):
+        record_embedding([query], response)
+    return await asyncio.to_thread(query_hsbc_knowledge, response['data'][0]['embedding'])
+
+
+def knowledge_search_failed(error: Exception) -> str:
+    """Log and count a failed knowledge search and answer with the not found message"""
+    kind = classify_error(error)
+    KNOWLEDGE_SEARCH_ERRORS.inc(1, kind)
+    # a broken connection is closed by pg_connection, the other connections of the pool stay in use
+    if kind == "unexpected":
+        logger.exception("hsbc knowledge search failed")
+    elif kind != "not_found":
+        logger.warning(f"hsbc knowledge search failed [{kind}]: {error}")
+    return KNOWLEDGE_NOT_FOUND_MESSAGE
+
+
+def search_hsbc_knowledge(input: str) -> str:
     """useful for when you need to answer questions about hsbc related knowledge"""
     try:
-        # get embedding from input
-        response = openai.Embedding.create(input=input, engine="text-embedding-ada-002")
-        embeddings = response['data'][0]['embedding']
-        # create cursor
-        cur = conn.cursor()
-        # execute query
-        cur.execute(f"SELECT content FROM hsbc_homepage_content ORDER BY embedding <-> '{embeddings}' LIMIT 1;")
-        # retrieve records
-        records = cur.fetchall()
-        # close cursor
-        cur.close()
-        # return answer
-        return records[0][0]
+        return registry.get("knowledge_search").search(input)
     except Exception as e:
-        print(e)
-        return "Sorry, I don't understand your question. Please try again."
+        return knowledge_search_failed(e)
 
 
+async def asearch_hsbc_knowledge(input: str) -> str:
+    """useful for when you need to answer questions about hsbc related knowledge"""
+    try:
+        return await registry.get("knowledge_search").asearch(input)
+    except Exception as e:
+        return knowledge_search_failed(e)
+
+
+# identical queries in flight share one lookup, answers are cached for KNOWLEDGE_CACHE_SECONDS
+hsbc_knowledge_tool_pgvector = StructuredTool.from_function(
+    search_hsbc_knowledge, name="hsbc knowledge search tool", coroutine=asearch_hsbc_knowledge
+)
+
 
 @tool("reject tool", return_direct=True)
 def reject_tool(input: str) -> str:
     # LLM agent sometimes will not reject question not related to HSBC, hence adding this tools to stop the thought/action process
     """useful for when you need to answer questions not related to HSBC"""
-    return """
-    I'm sorry, but as a customer service chatbot for HSBC Hongkong, I am only able to assist with questions related to HSBC Hongkong products and services. 
-    Is there anything else related to HSBC Hongkong that I can help you with?
-    """
+    return REJECT_MESSAGE
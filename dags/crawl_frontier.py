@@ -0,0 +1,327 @@
+""" Crawl frontier of the scraping DAG.
+
+Follows the links of the HSBC website from a set of seeds:
+- normalise_url resolves links and removes fragments, default ports and
+  tracking parameters, so every page has one key in the seen set;
+- CrawlFrontier is a priority queue of urls by depth and freshness, limited to
+  the allowed hosts, a maximum depth and a maximum number of pages, and can be
+  saved to and loaded from a json file so that a run cut short resumes;
+  fetched pages stay unfinished, and are queued again when the state is saved,
+  until the caller has processed them;
+- HostLimiter caps the concurrent requests per host and spaces them out;
+- crawl fetches pages in a thread pool and yields them as they arrive.
+"""
+import heapq
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+from bs4 import BeautifulSoup
+
+TRACKING_PARAMETER = re.compile(
+    r"^(?:utm_\w+|gclid|fbclid|mc_cid|mc_eid|wt\.\w+|cid)$", re.I
+)
+SKIPPED_EXTENSIONS = (
+    ".pdf",
+    ".jpg",
+    ".jpeg",
+    ".png",
+    ".gif",
+    ".svg",
+    ".ico",
+    ".css",
+    ".js",
+    ".zip",
+    ".doc",
+    ".docx",
+    ".xls",
+    ".xlsx",
+    ".ppt",
+    ".pptx",
+    ".mp3",
+    ".mp4",
+)
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalise_url(url: str, base: Optional[str] = None) -> Optional[str]:
+    """Absolute url without fragment, default port and tracking parameters, None if it is not a web page link.
+    :param url: link, relative to base if base is given
+    :param base: url of the page the link is on
+    """
+    url = url.strip()
+    if base:
+        url = urljoin(base, url)
+    parts = urlsplit(url)
+    if parts.scheme not in DEFAULT_PORTS or not parts.hostname:
+        return None
+    netloc = parts.hostname.lower()
+    if parts.port and parts.port != DEFAULT_PORTS[parts.scheme]:
+        netloc += f":{parts.port}"
+    path = re.sub(r"/{2,}", "/", parts.path) or "/"
+    query = urlencode(
+        sorted(
+            (key, value)
+            for key, value in parse_qsl(parts.query, keep_blank_values=True)
+            if not TRACKING_PARAMETER.match(key)
+        )
+    )
+    return urlunsplit((parts.scheme, netloc, path, query, ""))
+
+
+def extract_links(html, base: str) -> List[str]:
+    """Normalised urls of the links of a page."""
+    soup = BeautifulSoup(html, "html.parser")
+    links = (normalise_url(a["href"], base) for a in soup.find_all("a", href=True))
+    return [link for link in links if link]
+
+
+@dataclass(order=True)
+class FrontierEntry:
+    priority: float
+    sequence: int
+    url: str = field(compare=False)
+    depth: int = field(compare=False)
+
+
+class CrawlFrontier:
+    """Urls to crawl, lowest depth and freshest first, each url at most once."""
+
+    def __init__(
+        self,
+        allowed_hosts: Iterable[str],
+        max_depth: int = 3,
+        max_pages: int = 500,
+        excluded_prefixes: Tuple[str, ...] = (),
+    ):
+        """
+        :param allowed_hosts: hosts whose pages are crawled
+        :param max_depth: links of pages at this depth are not followed
+        :param max_pages: maximum number of urls handed out
+        :param excluded_prefixes: url paths that are never crawled, e.g. other languages
+        """
+        self.allowed_hosts = {host.lower() for host in allowed_hosts}
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.excluded_prefixes = excluded_prefixes
+        self.queue: List[FrontierEntry] = []
+        self.seen: set = set()
+        # e.g. article titles of seeds, used as extraction key words
+        self.labels: dict = {}
+        self.popped = 0
+        self.sequence = 0
+        # fetched pages the caller has not finished processing, e.g. whose knowledge is not saved yet
+        self.unfinished: dict = {}
+        # data of the caller saved with the crawl state, e.g. about the pages of the earlier runs
+        self.metadata: dict = {}
+
+    def __len__(self) -> int:
+        return len(self.queue)
+
+    def accepts(self, url: str, depth: int) -> bool:
+        parts = urlsplit(url)
+        return (
+            depth <= self.max_depth
+            and url not in self.seen
+            and (parts.hostname or "") in self.allowed_hosts
+            and not parts.path.lower().endswith(SKIPPED_EXTENSIONS)
+            and not parts.path.startswith(self.excluded_prefixes)
+        )
+
+    def add(
+        self, url: str, depth: int, freshness: float = 0.0, label: Optional[str] = None
+    ) -> bool:
+        """Queue a url unless it was seen before or is out of scope.
+        :param url: normalised url
+        :param depth: number of links from a seed
+        :param freshness: added urls with higher freshness are crawled before others of the same depth
+        :param label: optional label of the page
+        :returns: whether the url was queued
+        """
+        if not self.accepts(url, depth):
+            return False
+        self.seen.add(url)
+        if label:
+            self.labels[url] = label
+        self.sequence += 1
+        heapq.heappush(
+            self.queue, FrontierEntry(depth - freshness, self.sequence, url, depth)
+        )
+        return True
+
+    def pop(self) -> Optional[FrontierEntry]:
+        """Next url to crawl, None when the frontier is empty or max_pages urls were handed out."""
+        if not self.queue or self.popped >= self.max_pages:
+            return None
+        self.popped += 1
+        return heapq.heappop(self.queue)
+
+    def exhausted(self) -> bool:
+        return not self.queue or self.popped >= self.max_pages
+
+    def fetched(self, entry: FrontierEntry) -> None:
+        """Mark an entry as fetched; it is queued again by save until it is finished."""
+        self.unfinished[entry.url] = entry
+
+    def finish(self, url: str) -> None:
+        """Mark a fetched url as processed, a resumed crawl does not fetch it again."""
+        self.unfinished.pop(url, None)
+
+    def save(self, path: str, pending: Iterable[FrontierEntry] = ()) -> None:
+        """Write the frontier to a json file, atomically.
+        :param path: json file
+        :param pending: popped entries that were not crawled yet, queued again when the frontier is restored
+        """
+        pending = list(pending) + list(self.unfinished.values())
+        state = {
+            "queue": [
+                [e.priority, e.sequence, e.url, e.depth] for e in self.queue + pending
+            ],
+            "seen": sorted(self.seen),
+            "allowed_hosts": sorted(self.allowed_hosts),
+            "labels": self.labels,
+            "metadata": self.metadata,
+            "popped": self.popped - len(pending),
+            "sequence": self.sequence,
+        }
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+
+    def restore(self, path: str) -> bool:
+        """Continue the crawl saved at path.
+        :returns: whether a saved crawl was found
+        """
+        if not os.path.exists(path):
+            return False
+        with open(path) as f:
+            state = json.load(f)
+        self.queue = [FrontierEntry(*entry) for entry in state["queue"]]
+        heapq.heapify(self.queue)
+        self.seen = set(state["seen"])
+        # hosts allowed while the crawl ran, e.g. of the wealth insights articles
+        self.allowed_hosts.update(state.get("allowed_hosts", []))
+        self.labels = state["labels"]
+        self.metadata = state.get("metadata", {})
+        self.popped = state["popped"]
+        self.sequence = state["sequence"]
+        return True
+
+
+class HostLimiter:
+    """At most max_concurrency requests per host at a time, started at least min_interval seconds apart."""
+
+    def __init__(self, max_concurrency: int = 2, min_interval: float = 0.5):
+        self.min_interval = min_interval
+        self.semaphores = defaultdict(
+            lambda: threading.BoundedSemaphore(max_concurrency)
+        )
+        self.next_start = defaultdict(float)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, host: str) -> Iterator[None]:
+        with self._lock:
+            semaphore = self.semaphores[host]
+        with semaphore:
+            with self._lock:
+                start = max(time.monotonic(), self.next_start[host])
+                self.next_start[host] = start + self.min_interval
+            time.sleep(max(start - time.monotonic(), 0))
+            yield
+
+
+def crawl(
+    frontier: CrawlFrontier,
+    fetch: Callable[[str], object],
+    limiter: HostLimiter,
+    max_workers: int = 4,
+    deadline: Optional[float] = None,
+    state_path: Optional[str] = None,
+    save_every: int = 20,
+) -> Iterator[Tuple[FrontierEntry, object]]:
+    """
+    Crawl the frontier, following the links of html pages, and yield the pages as they arrive.
+
+    When the deadline passes, no new requests are started. The frontier is
+    saved to state_path every save_every pages and when the crawl stops early,
+    e.g. at the deadline or when the task times out, so that the next run
+    resumes the crawl. The saved state is removed once the frontier is exhausted.
+    Yielded pages are saved as pending until the caller calls frontier.finish,
+    so the pages of a crawl cut short are fetched again on resume.
+
+    :param frontier: urls to crawl
+    :param fetch: returns the response of a url, e.g. requests.get with a timeout
+    :param limiter: per host politeness
+    :param max_workers: concurrent requests over all hosts
+    :param deadline: time.monotonic() after which no new requests are started
+    :param state_path: json file of the crawl state
+    :param save_every: pages between saves of the crawl state
+    :returns: iterator of (frontier entry, response) of every successfully fetched page
+    """
+
+    def fetch_politely(url: str):
+        with limiter.slot(urlsplit(url).hostname):
+            return fetch(url)
+
+    crawled = 0
+    in_flight = {}
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        while True:
+            while len(in_flight) < max_workers and (
+                deadline is None or time.monotonic() < deadline
+            ):
+                entry = frontier.pop()
+                if entry is None:
+                    break
+                in_flight[executor.submit(fetch_politely, entry.url)] = entry
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                entry = in_flight.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    print(
+                        f"Skip current url -> error occurred when crawling [{entry.url}] with error:[{e}]"
+                    )
+                    continue
+                if getattr(response, "status_code", 200) != 200:
+                    print(
+                        f"Skip current url -> status {response.status_code} for [{entry.url}]"
+                    )
+                    continue
+                content_type = getattr(response, "headers", {}).get(
+                    "Content-Type", "text/html"
+                )
+                if "html" not in content_type:
+                    continue
+                if entry.depth < frontier.max_depth:
+                    for link in extract_links(response.content, entry.url):
+                        frontier.add(link, entry.depth + 1)
+                frontier.fetched(entry)
+                crawled += 1
+                if state_path and crawled % save_every == 0:
+                    frontier.save(state_path, pending=in_flight.values())
+                yield entry, response
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if state_path:
+            if frontier.exhausted() and not in_flight:
+                if os.path.exists(state_path):
+                    os.remove(state_path)
+            else:
+                frontier.save(state_path, pending=in_flight.values())
+                print(
+                    f"Crawl stopped with {len(frontier) + len(in_flight)} urls left, saved to {state_path}"
+                )
@@ -4,21 +4,61 @@ The knowledge will be stored in a txt file and upload to GCS bucket
 import re
 import os
 import json
+import time
+import hashlib
 import requests
+from collections import Counter
 import openai
 import psycopg2
 from datetime import datetime, timedelta
 from airflow import DAG
 from airflow.decorators import task
-from bs4 import BeautifulSoup
 from pydantic import BaseModel
-from typing import Union, List
+from typing import Dict, Union, List, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+# sibling modules in the dags folder, which airflow puts on sys.path
+from crawl_frontier import CrawlFrontier, HostLimiter, crawl, normalise_url
+from knowledge_chunks import chunk_knowledge
+from page_content import DuplicateDetector, Fingerprint, content_hash, page_blocks, remove_template, template_blocks
 
 # init variables
 homepage_url = os.getenv('hsbc_homepage_url')
 wealth_insigths_articles = os.getenv('wealth_insigths_articles')
 chinese_pattern = re.compile("[\u4e00-\u9fff\u3400-\u4dbf]+")
 
+# crawl configuration
+crawl_max_depth = int(os.getenv('crawl_max_depth', '3'))
+crawl_max_pages = int(os.getenv('crawl_max_pages', '500'))
+crawl_max_workers = int(os.getenv('crawl_max_workers', '4'))
+crawl_host_concurrency = int(os.getenv('crawl_host_concurrency', '2'))
+crawl_host_interval_seconds = float(os.getenv('crawl_host_interval_seconds', '0.5'))
+# leave the rest of the 4 hour DAG timeout for knowledge extraction
+crawl_time_budget_seconds = float(os.getenv('crawl_time_budget_seconds', '5400'))
+# required; must be shared by the task runs, e.g. on a mounted volume or the GCS data folder of the workers
+crawl_state_file = os.getenv('crawl_state_file')
+# other language versions of the site
+crawl_excluded_prefixes = ('/zh-hk/', '/zh-cn/')
+
+# knowledge extraction prompt; a change of the prompt, model or chunk size invalidates the knowledge of every page
+extraction_engine = os.getenv('openai_engine')
+extraction_system_prompt = "You are a knowledge extract assistant, help people extract key information."
+extraction_user_prompt = "Extract <{key_words}> related information from <{content}> in english around 1000 words."
+# knowledge is also saved as chunks of at most this many words, each with its own embedding
+knowledge_chunk_words = int(os.getenv('knowledge_chunk_words', '120'))
+# column type of the chunk embeddings: vector (float32) or halfvec (float16, pgvector 0.7 or later)
+knowledge_vector_type = os.getenv('knowledge_vector_type', 'vector')
+if knowledge_vector_type not in ('vector', 'halfvec'):
+    raise ValueError(f"knowledge_vector_type must be vector or halfvec, not {knowledge_vector_type}")
+extraction_prompt_version = hashlib.sha1(
+    f"{extraction_engine}\n{extraction_system_prompt}\n{extraction_user_prompt}\nchunks:{knowledge_chunk_words}".encode("utf-8")
+).hexdigest()[:12]
+# azure openai embeds at most 16 texts per request
+embedding_batch_size = 16
+# tokens a run may spend on extraction and embeddings, 0 is unlimited; pages left over are extracted next run
+extraction_token_budget = int(os.getenv('extraction_token_budget', '0'))
+# tokens of the current run by model call: extraction prompt and completion, embedding
+run_token_usage = Counter()
+
 # pgsql configuration
 host = os.getenv('pg_host')
 dbname = os.getenv('pg_db_name')
@@ -72,49 +112,137 @@ class OPENAICompletionResponse(BaseModel):
     usage: Union[OPENAICompletionResponseUsage, None] = None
 # ================================== OPENAI Response model ==================================
 
-def scrape_content_by_url(url: str):
-    """ scrape content by url
+def normalise_content(blocks: List[str]) -> str:
+    """ join text blocks, remove excess whitespace and chinese characters
     """
-    # Send a GET request to the webpage URL
-    response = requests.get(url, timeout=5)
-
-    # Parse the HTML content using BeautifulSoup
-    soup = BeautifulSoup(response.content, 'html.parser')
-
-    # Extract the text content and remove excess whitespace
-    text = soup.get_text()
+    text = ' '.join(blocks)
     text = re.sub('\s+', ' ', text).strip().lower()
     text = chinese_pattern.sub("", text)
-    
     return text
 
 
-def retreive_urls_by_parent_url():
-    """ retreive urls by parent url
+def distinct_page_contents(
+    pages: List[Tuple[str, str, List[str]]], state: Optional[dict] = None
+) -> Iterator[Tuple[str, str, str]]:
+    """ main content of the pages without the site template, skipping near duplicate pages
+    :param pages: (url, key words, text blocks) of every page of the crawl
+    :param state: template block counts and kept pages of the earlier runs of a crawl that was cut short,
+    updated with the pages; saved with the crawl state so a resumed crawl removes the same template
+    :returns: (url, key words, content) of the distinct pages
+    """
+    state = {} if state is None else state
+    # blocks repeated on many pages are the site template: menus, footers, disclaimers
+    counted_urls = set(state.get("template_urls", []))
+    counts = Counter(state.get("template_counts", {}))
+    template = template_blocks(
+        (blocks for url, _, blocks in pages if url not in counted_urls), counts=counts, num_pages=len(counted_urls)
+    )
+    state["template_urls"] = sorted(counted_urls.union(url for url, _, _ in pages))
+    state["template_counts"] = counts
+    duplicates = DuplicateDetector()
+    # json keys are strings
+    duplicates.seen.update((int(fingerprint), url) for fingerprint, url in state.get("kept_pages", {}).items())
+    state["kept_pages"] = duplicates.seen
+    raw_length = content_length = 0
+    for url, key_words, blocks in pages:
+        content = normalise_content(remove_template(blocks, template))
+        raw_length += len(normalise_content(blocks))
+        # skip the content if less than 50 words
+        if len(content) < 50:
+            print('Skip current url -> content less than 50 words with url=%s' % url)
+            continue
+        duplicate_url = duplicates.duplicate_of(url, content)
+        if duplicate_url:
+            print(f'Skip current url -> near duplicate of {duplicate_url} with url={url}')
+            continue
+        content_length += len(content)
+        yield url, key_words, content
+    print(f"Template removal and deduplication reduced the content from {raw_length} to {content_length} characters")
+
+
+def fetch_page(url: str) -> requests.Response:
+    """ fetch a page of the crawl
+    """
+    return requests.get(url, timeout=5)
+
+
+def content_url(url: str) -> str:
+    """ url saved with the knowledge: the path for homepage pages, the full url otherwise
+    """
+    parts = urlsplit(url)
+    if parts.hostname == urlsplit(homepage_url).hostname:
+        return parts.path + ('?' + parts.query if parts.query else '')
+    return url
+
+
+def crawl_frontier() -> CrawlFrontier:
+    """ frontier of the crawl: resumed when the last run was cut short, otherwise seeded with the
+    homepage and the wealth insights articles
+    """
+    if not crawl_state_file:
+        raise ValueError("crawl_state_file must be set to a persistent path shared by the task runs")
+    homepage = normalise_url(homepage_url)
+    frontier = CrawlFrontier(
+        allowed_hosts=[urlsplit(homepage).hostname],
+        max_depth=crawl_max_depth,
+        max_pages=crawl_max_pages,
+        excluded_prefixes=crawl_excluded_prefixes,
+    )
+    if frontier.restore(crawl_state_file):
+        print(f"Resuming the crawl with {len(frontier)} urls left from {crawl_state_file}")
+        return frontier
+    frontier.add(homepage, depth=0)
+    # wealth insights articles are the freshest content, crawl them first after the homepage
+    try:
+        response = requests.get(wealth_insigths_articles, timeout=10)
+        if response.status_code == 200:
+            for article in json.loads(response.text):
+                href = normalise_url(article["href"], homepage)
+                if href:
+                    frontier.allowed_hosts.add(urlsplit(href).hostname)
+                    frontier.add(href, depth=1, freshness=0.5, label=article["title"])
+        else:
+            print("Error: Could not retrieve JSON data")
+    except Exception as e:
+        print('Error occurred when retrieving wealth insights articles with error=%s' % e)
+    return frontier
+
+
+def crawl_pages(
+    validators: Dict[str, Tuple[Optional[str], Optional[str]]], frontier_urls: Dict[str, str]
+) -> Tuple[CrawlFrontier, List[Tuple[str, str, List[str]]]]:
+    """ crawl the site from the homepage and the wealth insights articles
+    :param validators: filled with the (ETag, Last-Modified) response headers of every crawled page
+    :param frontier_urls: filled with the frontier url of every crawled page
+    :returns: the frontier, and (url, key words, text blocks) of every crawled page but the homepage
     """
-    # Send a GET request to the webpage URL
-    response = requests.get(homepage_url, timeout=5)
-    # Parse the HTML content using BeautifulSoup
-    soup = BeautifulSoup(response.content, 'html.parser')
-    # Find the url start with a
-    a_tags = soup.find_all('a')
-    # retrieve all the link
-    urls = [a_tag.get('href') for a_tag in a_tags if a_tag is not None and a_tag.get('href') is not None]
-    # remove all the link start with http or https
-    urls = [url for url in urls if not url.startswith(('http', '#'))]
-    # remove other language url
-    urls = [url for url in urls if url not in ('/', '/zh-hk/', '/zh-cn/')]
-    return urls
+    frontier = crawl_frontier()
+    limiter = HostLimiter(max_concurrency=crawl_host_concurrency, min_interval=crawl_host_interval_seconds)
+    deadline = time.monotonic() + crawl_time_budget_seconds
+    pages = []
+    for entry, response in crawl(frontier, fetch_page, limiter, crawl_max_workers, deadline, crawl_state_file):
+        url = content_url(entry.url)
+        # the homepage only links to the content
+        if entry.depth == 0:
+            frontier.finish(entry.url)
+            continue
+        key_words = frontier.labels.get(entry.url) or url.replace('/', ' ')
+        validators[url] = (response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        frontier_urls[url] = entry.url
+        pages.append((url, key_words, page_blocks(response.content)))
+    print(f"Crawled {len(pages)} pages, {len(frontier)} urls left in the frontier")
+    return frontier, pages
+
 
 def knowledge_extraction(key_words:str, content: str):
     # genrate prompt
-    system_prompt = {"role" : "system", "content" : f"You are a knowledge extract assistant, help people extract key information."}
-    user_prompt = {"role" : "user", "content" : f"Extract <{key_words}> related information from <{content}> in english around 1000 words."}
+    system_prompt = {"role" : "system", "content" : extraction_system_prompt}
+    user_prompt = {"role" : "user", "content" : extraction_user_prompt.format(key_words=key_words, content=content)}
     # generate messages
     messages = [system_prompt, user_prompt]
     # generate response
     response = openai.ChatCompletion.create(
-        engine=os.getenv('openai_engine'),
+        engine=extraction_engine,
         max_tokens=1000,
         temperature=.7,
         top_p=1.0,
@@ -124,20 +252,26 @@ def knowledge_extraction(key_words:str, content: str):
     )
     # conver to data model
     openAICompletionResponse = OPENAICompletionResponse.parse_obj(response)
+    if openAICompletionResponse.usage is not None:
+        run_token_usage['extraction_prompt'] += openAICompletionResponse.usage.prompt_tokens
+        run_token_usage['extraction_completion'] += openAICompletionResponse.usage.completion_tokens
     # return content
     if len(openAICompletionResponse.choices) == 0:
         return ""
     else:
         return openAICompletionResponse.choices[0].message.content
     
-def embedding_calculation(content: str):
-    """Embedding calculation
+def embedding_calculation(texts: List[str]) -> List[List[float]]:
+    """Embedding calculation of several texts, one request per batch
     """
-    response = openai.Embedding.create(
-        input="content",
-        engine="text-embedding-ada-002"
-    )
-    embeddings = response['data'][0]['embedding']
+    embeddings = []
+    for start in range(0, len(texts), embedding_batch_size):
+        response = openai.Embedding.create(
+            input=texts[start:start + embedding_batch_size],
+            engine="text-embedding-ada-002"
+        )
+        embeddings += [item['embedding'] for item in sorted(response['data'], key=lambda item: item['index'])]
+        run_token_usage['embedding'] += (response.get('usage') or {}).get('prompt_tokens', 0)
     return embeddings
 
 def save_to_pgsql(url, keywords, content, embedding):
@@ -162,57 +296,160 @@ def save_to_pgsql(url, keywords, content, embedding):
         cursor.close()
 
 
+def save_chunks_to_pgsql(url: str, chunks: List[str], embeddings: List[List[float]]):
+    """ replace the knowledge chunks of a page, url references the page in hsbc_homepage_content
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("delete from hsbc_homepage_chunk where url = %s;", (url,))
+        for chunk_index, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
+            cursor.execute(
+                "insert into hsbc_homepage_chunk (url, chunk_index, content, embedding) values (%s, %s, %s, %s);",
+                (url, chunk_index, chunk, str(embedding)),
+            )
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def create_tables():
+    """ create the chunk and fingerprint tables next to hsbc_homepage_content on the first run;
+    the knowledge search queries the chunks by nearest embedding, through the hnsw index
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""
+        create table if not exists hsbc_homepage_chunk (
+            url text not null,
+            chunk_index integer not null,
+            content text not null,
+            embedding {knowledge_vector_type}(1536) not null,
+            primary key (url, chunk_index)
+        );
+        create index if not exists hsbc_homepage_chunk_embedding_idx
+            on hsbc_homepage_chunk using hnsw (embedding {knowledge_vector_type}_l2_ops);
+        create table if not exists hsbc_homepage_fingerprint (
+            url text primary key,
+            content_hash text not null,
+            etag text,
+            last_modified text,
+            prompt_version text not null,
+            updated_at timestamptz not null default now()
+        );
+        """)
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def load_fingerprints() -> Dict[str, Fingerprint]:
+    """ fingerprints of the pages whose knowledge is saved
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("select url, content_hash, etag, last_modified, prompt_version from hsbc_homepage_fingerprint;")
+        rows = cursor.fetchall()
+        conn.commit()
+    finally:
+        cursor.close()
+    return {url: Fingerprint(*fingerprint) for url, *fingerprint in rows}
+
+
+def save_fingerprint(url: str, fingerprint: Fingerprint):
+    """ save the fingerprint of a page after its knowledge is saved
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            """
+            insert into hsbc_homepage_fingerprint (url, content_hash, etag, last_modified, prompt_version, updated_at)
+            values (%s, %s, %s, %s, %s, now())
+            on conflict (url) do update set content_hash = excluded.content_hash, etag = excluded.etag,
+            last_modified = excluded.last_modified, prompt_version = excluded.prompt_version, updated_at = now();
+            """,
+            (url, *fingerprint),
+        )
+        conn.commit()
+    finally:
+        cursor.close()
+
+
 @task(task_id='scrapy')
 def extract_knowledge():
     """
     Extract knowledge from hsbc homepage and wealth insights
     """
-    # extract home page child urls
-    urls = retreive_urls_by_parent_url()
-    # loop and extract content
-    for url in urls:
+    # crawl all pages first; the site template is detected across pages
+    validators = {}
+    frontier_urls = {}
+    frontier, pages = crawl_pages(validators, frontier_urls)
+    # a crawl cut short left its state; the pages fetched stay queued in it until their knowledge is saved
+    resumable = os.path.exists(crawl_state_file)
+    retried = set()
+    create_tables()
+    fingerprints = load_fingerprints()
+    run_token_usage.clear()
+    updated = skipped = failed = deferred = 0
+
+    # loop and extract knowledge of the distinct main content
+    for url, key_words, content in distinct_page_contents(pages, frontier.metadata):
+        fingerprint = Fingerprint(content_hash(key_words, content), *validators[url], extraction_prompt_version)
+        saved_fingerprint = fingerprints.get(url)
+        if saved_fingerprint is not None and saved_fingerprint.unchanged(fingerprint):
+            skipped += 1
+            # keep the validators of the latest response
+            if saved_fingerprint != fingerprint:
+                save_fingerprint(url, fingerprint)
+            frontier.finish(frontier_urls[url])
+            continue
+        if extraction_token_budget and sum(run_token_usage.values()) >= extraction_token_budget:
+            # the fingerprint is not saved, so the page is extracted by the next run
+            deferred += 1
+            retried.add(url)
+            continue
         try:
-            # retreive content
-            content = scrape_content_by_url(homepage_url + url)
-            key_words = url.replace('/', ' ')
-            # skip the content if less than 50 words
-            if len(content) < 50:
-                print('Skip current url -> content less than 50 words with url=%s' % url)
-                continue
             # send content to LLM to do summaraization before feed into vector store
             knowledge = knowledge_extraction(key_words, content)
-            # send summary to LLM to calc embedding
-            embedding = embedding_calculation(knowledge)
+            # split the summary into chunks and calc the embeddings of the page and its chunks
+            chunks = chunk_knowledge(knowledge, knowledge_chunk_words)
+            embedding, *chunk_embeddings = embedding_calculation([knowledge, *chunks])
             # save into pg vector store
             save_to_pgsql(url, key_words, knowledge, embedding)
+            save_chunks_to_pgsql(url, chunks, chunk_embeddings)
+            save_fingerprint(url, fingerprint)
+            frontier.finish(frontier_urls[url])
+            updated += 1
+            if resumable and updated % 20 == 0:
+                frontier.save(crawl_state_file)
             # log
-            print(f"Successfuly saved embedding for {url}, content length {len(content)}, knowledge length {len(knowledge)}, embedding length {len(embedding)}")
-           
-        except Exception as e:
-            print(f'Skip current url -> error occurred when scraping content from [{url}] with error:[{e}]')
+            print(f"Successfuly saved embedding for {url}, content length {len(content)}, knowledge length {len(knowledge)}, {len(chunks)} chunks")
 
-    # extract wealth insights content
-    try:
-        # extract wealth insights content
-        response = requests.get(wealth_insigths_articles, timeout=10)
-        if response.status_code == 200:
-            data = json.loads(response.text)
-            for article in data:
-                title, href = article["title"], article["href"]
-                # retreive content
-                content = scrape_content_by_url(href)
-                # send content to LLM to do summaraization before feed into vector store
-                knowledge = knowledge_extraction(key_words, content)
-                # send summary to LLM to calc embedding
-                embedding = embedding_calculation(knowledge)
-                # save into pg vector store
-                save_to_pgsql(href, title, knowledge, embedding)
-                # log
-                print(f"Successfuly saved embedding for {href}, content length {len(content)}, knowledge length {len(knowledge)}, embedding length {len(embedding)}") 
-        else:
-            print("Error: Could not retrieve JSON data")
-    except Exception as e:
-        print('Error occurred when scraping wealth insights content with error=%s' % e)
+        except Exception as e:
+            failed += 1
+            retried.add(url)
+            print(f'Skip current url -> error occurred when extracting knowledge from [{url}] with error:[{e}]')
+    if resumable:
+        # short and duplicate pages are done as well; failed and deferred pages are fetched again on resume
+        for url, frontier_url in frontier_urls.items():
+            if url not in retried:
+                frontier.finish(frontier_url)
+        frontier.save(crawl_state_file)
+    print(f"Knowledge extraction: {updated} pages updated, {skipped} unchanged pages skipped, {failed} failed, "
+          f"{deferred} deferred by the token budget")
+    print(f"Token usage of the run: {sum(run_token_usage.values())} tokens, " +
+          ", ".join(f"{name}={tokens}" for name, tokens in sorted(run_token_usage.items())))
+    # one json line for log based metrics, in the rows of the usage endpoint of the service
+    print("pipeline_usage " + json.dumps({
+        "owner": os.getenv('AIRFLOW_CTX_DAG_RUN_ID', 'manual'),
+        "pipeline": "hsbc-knowledge-scrapy-job",
+        "by_feature": [
+            {"feature": "knowledge_extraction", "model": extraction_engine,
+             "prompt_tokens": run_token_usage['extraction_prompt'],
+             "completion_tokens": run_token_usage['extraction_completion']},
+            {"feature": "knowledge_embedding", "model": "text-embedding-ada-002",
+             "prompt_tokens": run_token_usage['embedding'], "completion_tokens": 0},
+        ],
+    }))
 
 
 with DAG(
@@ -0,0 +1,52 @@
+""" Chunks of extracted knowledge for multi-vector storage.
+
+knowledge_extraction returns about 1000 words per page. Besides the page row,
+the knowledge is stored as chunks of at most max_words words with their own
+embeddings, so that the knowledge search answers with the passages closest to
+a question instead of whole pages. Chunks end at line or sentence boundaries;
+only sentences longer than a chunk are cut.
+"""
+import re
+from typing import List, Tuple
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def knowledge_pieces(text: str, max_words: int) -> List[Tuple[str, bool]]:
+    """Lines of a text, split into sentences when longer than max_words.
+    :returns: (piece, whether the piece starts a line)
+    """
+    pieces = []
+    for line in text.splitlines():
+        line = " ".join(line.split())
+        if not line:
+            continue
+        if len(line.split()) <= max_words:
+            pieces.append((line, True))
+            continue
+        starts_line = True
+        for sentence in SENTENCE_END.split(line):
+            words = sentence.split()
+            for start in range(0, len(words), max_words):
+                pieces.append((" ".join(words[start : start + max_words]), starts_line))
+                starts_line = False
+    return pieces
+
+
+def chunk_knowledge(text: str, max_words: int = 120) -> List[str]:
+    """Split knowledge into chunks of consecutive lines and sentences of at most max_words words."""
+    chunks = []
+    chunk, chunk_words = "", 0
+    for piece, starts_line in knowledge_pieces(text, max_words):
+        words = len(piece.split())
+        if chunk and chunk_words + words > max_words:
+            chunks.append(chunk)
+            chunk, chunk_words = "", 0
+        if chunk:
+            chunk += ("\n" if starts_line else " ") + piece
+        else:
+            chunk = piece
+        chunk_words += words
+    if chunk:
+        chunks.append(chunk)
+    return chunks
@@ -0,0 +1,196 @@
+""" Main content of scraped pages for knowledge extraction.
+
+Pages of the HSBC website share navigation, footers, cookie banners and
+disclaimers. Before page text is sent to the LLM:
+1. page_blocks drops the elements that are never content (scripts, nav,
+   header, footer, forms, cookie and consent banners) and splits the rest
+   into text blocks;
+2. template_blocks finds the blocks repeated on many pages of the same crawl
+   (the site template), which remove_template then removes from each page;
+3. DuplicateDetector skips pages whose remaining content is a near duplicate
+   of a page already kept, comparing 64 bit SimHashes of word shingles;
+4. Fingerprint tells whether the knowledge extracted from a page in an
+   earlier run is still valid, so that unchanged pages are not sent again.
+"""
+import hashlib
+import re
+from collections import Counter
+from typing import Iterable, List, NamedTuple, Optional
+
+from bs4 import BeautifulSoup
+
+# elements that never hold page content
+NON_CONTENT_TAGS = [
+    "script",
+    "style",
+    "noscript",
+    "template",
+    "svg",
+    "iframe",
+    "nav",
+    "header",
+    "footer",
+    "form",
+    "aside",
+]
+# ids and classes of banners, menus and widgets
+NON_CONTENT_ATTRIBUTE = re.compile(
+    r"cookie|consent|gdpr|banner|breadcrumb|skip-?link|social|share|menu|navigation|footer|modal|popup",
+    re.I,
+)
+# elements that start a new text block; inline elements stay in their block
+BLOCK_TAGS = [
+    "p",
+    "div",
+    "section",
+    "article",
+    "main",
+    "li",
+    "ul",
+    "ol",
+    "dl",
+    "dt",
+    "dd",
+    "table",
+    "tr",
+    "td",
+    "th",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "blockquote",
+    "pre",
+    "br",
+    "hr",
+    "figcaption",
+    "button",
+]
+BLOCK_SEPARATOR = "\x1e"
+WHITESPACE = re.compile(r"\s+")
+WORD = re.compile(r"\w+")
+
+
+def normalise_block(text: str) -> str:
+    return WHITESPACE.sub(" ", text).strip()
+
+
+def page_blocks(html: str) -> List[str]:
+    """Text blocks of a page without the elements that are never content.
+    :param html: page html
+    :returns: non-empty text blocks in page order
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    for element in soup(NON_CONTENT_TAGS):
+        element.decompose()
+    for element in soup.find_all(attrs={"id": NON_CONTENT_ATTRIBUTE}) + soup.find_all(
+        attrs={"class": NON_CONTENT_ATTRIBUTE}
+    ):
+        # children of removed elements are already detached
+        if element.parent is not None:
+            element.decompose()
+    # newlines in the html source do not end a block, the separator does
+    for element in soup(BLOCK_TAGS):
+        element.insert_before(BLOCK_SEPARATOR)
+        element.insert_after(BLOCK_SEPARATOR)
+    root = soup.find("main") or soup.body or soup
+    blocks = (normalise_block(text) for text in root.get_text().split(BLOCK_SEPARATOR))
+    return [block for block in blocks if block]
+
+
+def block_key(block: str) -> str:
+    return hashlib.sha1(block.lower().encode("utf-8")).hexdigest()
+
+
+def template_blocks(
+    pages: Iterable[List[str]],
+    min_fraction: float = 0.5,
+    min_pages: int = 3,
+    counts: Optional[Counter] = None,
+    num_pages: int = 0,
+) -> set:
+    """Keys of the blocks that occur on at least min_fraction of the pages, the site template.
+    :param pages: text blocks of every page of a crawl
+    :param min_fraction: fraction of pages a block has to occur on
+    :param min_pages: pages a block has to occur on, so that small crawls keep their content
+    :param counts: pages per block key of the earlier runs of a crawl that was cut short, updated with pages
+    :param num_pages: number of pages of the earlier runs
+    :returns: set of block keys
+    """
+    counts = Counter() if counts is None else counts
+    for blocks in pages:
+        num_pages += 1
+        counts.update({block_key(block) for block in blocks})
+    threshold = max(min_pages, min_fraction * num_pages)
+    return {key for key, count in counts.items() if count >= threshold}
+
+
+def remove_template(blocks: List[str], template: set) -> List[str]:
+    return [block for block in blocks if block_key(block) not in template]
+
+
+def simhash(text: str, shingle_size: int = 3) -> int:
+    """64 bit SimHash of the word shingles of a text; similar texts differ in few bits."""
+    words = WORD.findall(text.lower())
+    shingles = [
+        " ".join(words[i : i + shingle_size])
+        for i in range(max(len(words) - shingle_size + 1, 1))
+    ]
+    weights = [0] * 64
+    for shingle in shingles:
+        value = int.from_bytes(
+            hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big"
+        )
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+class DuplicateDetector:
+    """Remembers the SimHash of kept pages and recognises near duplicates of them."""
+
+    def __init__(self, max_distance: int = 3):
+        """
+        :param max_distance: maximum number of differing SimHash bits of near duplicates
+        """
+        self.max_distance = max_distance
+        self.seen: dict[int, str] = {}
+
+    def duplicate_of(self, url: str, text: str) -> Optional[str]:
+        """The url of a kept page that text is a near duplicate of, otherwise keep the page and return None."""
+        fingerprint = simhash(text)
+        for other, other_url in self.seen.items():
+            # a page kept by an earlier run of a resumed crawl is not a duplicate of itself
+            if (
+                other_url != url
+                and bin(fingerprint ^ other).count("1") <= self.max_distance
+            ):
+                return other_url
+        self.seen[fingerprint] = url
+        return None
+
+
+def content_hash(key_words: str, content: str) -> str:
+    """Hash of the extraction input of a page."""
+    return hashlib.sha256(f"{key_words}\n{content}".encode("utf-8")).hexdigest()
+
+
+class Fingerprint(NamedTuple):
+    """Extraction input, HTTP validators and prompt version of a page."""
+
+    content_hash: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    prompt_version: str
+
+    def unchanged(self, other: "Fingerprint") -> bool:
+        """Whether knowledge extracted for this fingerprint is still valid for the other.
+        Only the content hash and prompt version decide: the page body is fetched anyway, and static
+        ETags or template Last-Modified dates stay the same when the content changes. The validators
+        are kept for conditional requests."""
+        return (
+            self.prompt_version == other.prompt_version
+            and self.content_hash == other.content_hash
+        )
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import typing
+from typing import Optional
+
+from fastapi import WebSocket
+from vocode.streaming.agent.base_agent import BaseAgent
+from vocode.streaming.client_backend.conversation import ConversationRouter
+from vocode.streaming.models.websocket import (
+    AudioConfigStartMessage,
+    AudioMessage,
+    ReadyMessage,
+    WebSocketMessage,
+    WebSocketMessageType,
+)
+from vocode.streaming.output_device.websocket_output_device import WebsocketOutputDevice
+from vocode.streaming.streaming_conversation import StreamingConversation
+
+from src.speech_pool import WarmPool
+
+
+class HSBCConversationRouter(ConversationRouter):
+    """
+    ConversationRouter that takes transcribers and synthesizers from warm pools
+    and gives them back when the websocket conversation ends.
+
+    While draining, new websockets are refused so that a worker can be stopped
+    once its active conversations have ended.
+    """
+
+    def __init__(
+        self,
+        agent: BaseAgent,
+        transcriber_pool: WarmPool,
+        synthesizer_pool: WarmPool,
+        logger: Optional[logging.Logger] = None,
+    ):
+        super().__init__(
+            agent=agent,
+            transcriber_thunk=transcriber_pool.acquire,
+            synthesizer_thunk=synthesizer_pool.acquire,
+            logger=logger,
+        )
+        self.transcriber_pool = transcriber_pool
+        self.synthesizer_pool = synthesizer_pool
+        self.active_conversations: dict[WebSocket, StreamingConversation] = {}
+        self.draining = False
+
+    async def conversation(self, websocket: WebSocket):
+        await websocket.accept()
+        if self.draining:
+            # 1013 try again later: the client reconnects and lands on another worker
+            await websocket.close(code=1013)
+            return
+        start_message: AudioConfigStartMessage = AudioConfigStartMessage.parse_obj(
+            await websocket.receive_json()
+        )
+        self.logger.debug(f"Conversation started")
+        output_device = WebsocketOutputDevice(
+            websocket,
+            start_message.output_audio_config.sampling_rate,
+            start_message.output_audio_config.audio_encoding,
+        )
+        conversation = self.get_conversation(output_device, start_message)
+        self.active_conversations[websocket] = conversation
+        try:
+            await conversation.start(lambda: websocket.send_text(ReadyMessage().json()))
+            while conversation.is_active():
+                message: WebSocketMessage = WebSocketMessage.parse_obj(
+                    await websocket.receive_json()
+                )
+                if message.type == WebSocketMessageType.STOP:
+                    break
+                audio_message = typing.cast(AudioMessage, message)
+                conversation.receive_audio(audio_message.get_bytes())
+        finally:
+            # also runs when the client disconnects without sending STOP
+            self.active_conversations.pop(websocket, None)
+            output_device.mark_closed()
+            conversation.terminate()
+            self.transcriber_pool.release(
+                start_message.input_audio_config, conversation.transcriber
+            )
+            self.synthesizer_pool.release(
+                start_message.output_audio_config, conversation.synthesizer
+            )
+
+    async def drain(self, timeout: float = 30.0, poll_interval: float = 0.5) -> int:
+        """
+        Stop accepting conversations and wait for the active ones to end.
+        Conversations still active after the timeout are closed.
+        :param timeout: seconds to wait for active conversations
+        :returns: number of conversations closed after the timeout
+        """
+        self.draining = True
+        self.logger.info(
+            f"Draining {len(self.active_conversations)} active conversations"
+        )
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.active_conversations and loop.time() < deadline:
+            await asyncio.sleep(poll_interval)
+        remaining = list(self.active_conversations)
+        for websocket in remaining:
+            try:
+                # 1012 service restart; conversation state is kept in the session store
+                await websocket.close(code=1012)
+            except Exception as e:
+                self.logger.warning(f"Failed to close websocket while draining: {e}")
+        if remaining:
+            self.logger.warning(
+                f"Closed {len(remaining)} conversations after drain timeout"
+            )
+        return len(remaining)
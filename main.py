@@ -1,18 +1,36 @@
+import asyncio
 import logging
 import os
-from fastapi import FastAPI
+import azure.cognitiveservices.speech as speechsdk
+from fastapi import FastAPI, Response
+from fastapi.responses import PlainTextResponse
 
 from vocode.streaming.models.agent import ChatGPTAgentConfig
 from vocode.streaming.models.agent import AzureOpenAIConfig
+from vocode.streaming.models.audio_encoding import AudioEncoding
+from vocode.streaming.models.client_backend import OutputAudioConfig
 from vocode.streaming.models.synthesizer import AzureSynthesizerConfig
-from vocode.streaming.synthesizer.azure_synthesizer import AzureSynthesizer
 from vocode.streaming.transcriber.azure_transcriber import AzureTranscriber
 from vocode.streaming.transcriber.azure_transcriber import AzureTranscriberConfig
-from vocode.streaming.client_backend.conversation import ConversationRouter
 from vocode.streaming.models.message import BaseMessage
 
 # customized AzureChatGPTAgent
-from azure_gpt_agent import AzureChatGPTAgent
+from azure_gpt_agent import FALLBACK_MESSAGE, AzureChatGPTAgent
+
+# customized AzureSynthesizer with TTS audio cache
+from azure_cached_synthesizer import CachedAzureSynthesizer
+
+# customized ConversationRouter using warm pools of speech clients
+from hsbc_conversation_router import HSBCConversationRouter
+from customized_tools import REJECT_MESSAGE, create_news_poller
+from src.intent_router import GREETING_RESPONSES
+from src.metrics import metrics, turns_of_conversation
+from src.resources import registry
+from src.session_store import create_session_store
+from src.speech_pool import WarmPool
+from src.tts_cache import TTSAudioCache
+from src.tts_chunker import chunk_text
+from src.usage import ledger
 
 
 from dotenv import load_dotenv
@@ -25,33 +43,251 @@ logging.basicConfig()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-# create conversation router
-conversation_router = ConversationRouter(
-    # create agent
-    agent=AzureChatGPTAgent(
-        ChatGPTAgentConfig(
-            prompt_preamble="This is HSBC Hongkong customer service chatbot.",
-            initial_message=BaseMessage(text=os.getenv("SPEECH_WELCOME_MESSAGE")),
-            azure_params=AzureOpenAIConfig(
-                api_type=os.getenv("AZURE_OPENAI_API_TYPE"),
-                api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
-                engine=os.getenv("AZURE_OPENAI_API_ENGINE"),
-            ),
-        )
-    ),
-    # create transcriber for STT
-    transcriber_thunk=lambda input_audio_config: AzureTranscriber(
+# synthesized audio cache shared by all conversations of this worker
+tts_audio_cache = TTSAudioCache(
+    cache_dir=os.getenv("TTS_CACHE_DIR", "./.tts_cache"),
+    max_memory_bytes=int(os.getenv("TTS_CACHE_MAX_MEMORY_MB", "64")) * 1024 * 1024,
+)
+
+# fixed phrases, chunked the same way the agent chunks them before synthesis
+PREWARM_PHRASES = [os.getenv("SPEECH_WELCOME_MESSAGE", "")]
+for fixed_response in [REJECT_MESSAGE, FALLBACK_MESSAGE, *GREETING_RESPONSES.values()]:
+    PREWARM_PHRASES += chunk_text(fixed_response)
+
+
+def create_transcriber(input_audio_config):
+    """Create transcriber for STT and open the speech service connection ahead of time"""
+    transcriber = AzureTranscriber(
         AzureTranscriberConfig.from_input_audio_config(
             input_audio_config=input_audio_config
-        )
-    ),
-    # create synthesizer for TTS
-    synthesizer_thunk=lambda output_audio_config: AzureSynthesizer(
+        ),
+        logger=logger,
+    )
+    speechsdk.Connection.from_recognizer(transcriber.speech).open(True)
+    return transcriber
+
+
+def create_synthesizer(output_audio_config):
+    """Create synthesizer for TTS and open the speech service connection ahead of time"""
+    synthesizer = CachedAzureSynthesizer(
         AzureSynthesizerConfig.from_output_audio_config(
             output_audio_config, voice_name=os.getenv("AZURE_SPEECH_VOICE_NAME")
-        )
+        ),
+        audio_cache=tts_audio_cache,
+        logger=logger,
+    )
+    synthesizer.ready_synthesizer()
+    return synthesizer
+
+
+# warm pools of speech clients per audio config; transcribers are single use
+SPEECH_POOL_SIZE = int(os.getenv("SPEECH_POOL_SIZE", "2"))
+transcriber_pool = WarmPool(
+    "transcriber", create_transcriber, size=SPEECH_POOL_SIZE, logger=logger
+)
+synthesizer_pool = WarmPool(
+    "synthesizer",
+    create_synthesizer,
+    size=SPEECH_POOL_SIZE,
+    reusable=True,
+    reset=lambda synthesizer: synthesizer.reset_for_reuse(),
+    logger=logger,
+)
+
+# chat history per conversation; set SESSION_STORE_URL to share it between workers
+session_store = create_session_store(
+    os.getenv("SESSION_STORE_URL"),
+    ttl_seconds=int(os.getenv("SESSION_TTL_SECONDS", "3600")),
+)
+# usage of every conversation is kept in the shared session store as well
+if os.getenv("SESSION_STORE_URL"):
+    ledger.share(session_store)
+
+# create agent; llm and agent chain are created during startup warmup
+agent = AzureChatGPTAgent(
+    ChatGPTAgentConfig(
+        prompt_preamble="This is HSBC Hongkong customer service chatbot.",
+        initial_message=BaseMessage(text=os.getenv("SPEECH_WELCOME_MESSAGE")),
+        azure_params=AzureOpenAIConfig(
+            api_type=os.getenv("AZURE_OPENAI_API_TYPE"),
+            api_version=os.getenv("AZURE_OPENAI_API_VERSION"),
+            engine=os.getenv("AZURE_OPENAI_API_ENGINE"),
+        ),
     ),
+    use_intent_router=os.getenv("INTENT_ROUTER_ENABLED", "true").lower() == "true",
+    speculative_retrieval=os.getenv("SPECULATIVE_RETRIEVAL_ENABLED", "false").lower()
+    == "true",
+    speculative_match_threshold=float(
+        os.getenv("SPECULATIVE_RETRIEVAL_MATCH_THRESHOLD", "0.6")
+    ),
+    session_store=session_store,
+    turn_deadline=float(os.getenv("LLM_TURN_DEADLINE_SECONDS", "15")),
+    memory_token_budget=int(os.getenv("MEMORY_TOKEN_BUDGET", "1000")),
+    logger=logger,
+)
+
+# create conversation router
+conversation_router = HSBCConversationRouter(
+    agent=agent,
+    transcriber_pool=transcriber_pool,
+    synthesizer_pool=synthesizer_pool,
     logger=logger,
 )
 
 app.include_router(conversation_router.get_router())
+
+
+# touched by stop.sh to make every worker drain before it is stopped
+DRAIN_FILE = os.getenv("DRAIN_FILE", "/tmp/vocode-hsbc.drain")
+DRAIN_TIMEOUT_SECONDS = float(os.getenv("DRAIN_TIMEOUT_SECONDS", "30"))
+
+# background ingestion of Refinitiv news into the local news store
+NEWS_POLLER_ENABLED = os.getenv("NEWS_POLLER_ENABLED", "false").lower() == "true"
+NEWS_POLL_QUERIES = [
+    q.strip() for q in os.getenv("NEWS_POLL_QUERIES", "HSBC").split(",") if q.strip()
+]
+NEWS_POLL_INTERVAL_SECONDS = float(os.getenv("NEWS_POLL_INTERVAL_SECONDS", "300"))
+
+
+@app.get("/healthz")
+async def healthz(response: Response):
+    """Readiness of the worker, 503 while draining so the load balancer stops sending calls"""
+    if conversation_router.draining:
+        response.status_code = 503
+        return {
+            "status": "draining",
+            "active_conversations": len(conversation_router.active_conversations),
+        }
+    return {
+        "status": "ok",
+        "active_conversations": len(conversation_router.active_conversations),
+    }
+
+
+@app.get("/stats/pools")
+async def pool_stats():
+    """Utilization of the speech client warm pools per audio config"""
+    return {
+        "transcriber": transcriber_pool.utilization(),
+        "synthesizer": synthesizer_pool.utilization(),
+    }
+
+
+@app.get("/stats/llm")
+async def llm_stats():
+    """Hedging and per-deployment latency and error stats of the LLM gateways created so far"""
+    stats = {}
+    if agent._llm is not None:
+        stats["chat"] = agent._llm.gateway.stats()
+    if registry.is_initialised("chat_llm"):
+        stats["completion"] = registry.get("chat_llm").gateway.stats()
+    return stats
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Per-turn span latency histograms in the Prometheus text format"""
+    return metrics.render()
+
+
+@app.get("/stats/turns/{conversation_id}")
+async def turn_stats(conversation_id: str):
+    """Span breakdown of the recent turns of a conversation handled by this worker"""
+    return turns_of_conversation(conversation_id)
+
+
+@app.get("/stats/usage/{conversation_id}")
+async def usage_stats(conversation_id: str):
+    """Tokens and estimated cost of a conversation by feature and model, of all workers with SESSION_STORE_URL"""
+    # reads the shared session store
+    return await asyncio.to_thread(ledger.report, conversation_id)
+
+
+def common_output_sampling_rates() -> list[int]:
+    sampling_rates = os.getenv("TTS_CACHE_PREWARM_SAMPLING_RATES", "44100,48000")
+    return [int(r) for r in sampling_rates.split(",") if r.strip()]
+
+
+async def prewarm_tts_cache():
+    """Synthesize the fixed phrases for the common output sampling rates"""
+    for sampling_rate in common_output_sampling_rates():
+        try:
+            synthesizer = CachedAzureSynthesizer(
+                AzureSynthesizerConfig(
+                    sampling_rate=sampling_rate,
+                    audio_encoding=AudioEncoding.LINEAR16,
+                    voice_name=os.getenv("AZURE_SPEECH_VOICE_NAME"),
+                ),
+                audio_cache=tts_audio_cache,
+                logger=logger,
+            )
+            await synthesizer.prewarm(PREWARM_PHRASES)
+        except Exception as e:
+            logger.warning(f"Failed to pre-warm TTS cache for {sampling_rate}Hz: {e}")
+    logger.info(f"TTS cache pre-warmed: {tts_audio_cache.stats()}")
+
+
+async def warmup_resources():
+    """Create llm clients, agent chain and database connection in parallel, off the event loop"""
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    results = await asyncio.gather(
+        loop.run_in_executor(None, registry.warmup),
+        loop.run_in_executor(None, agent.warmup),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"Startup warmup failed: {result}")
+    logger.info(f"Startup warmup finished in {loop.time() - start:.3f}s")
+
+
+async def watch_drain_file(poll_interval: float = 1.0):
+    """Start draining when the drain file appears"""
+    while not os.path.exists(DRAIN_FILE):
+        await asyncio.sleep(poll_interval)
+    logger.info(f"Drain file {DRAIN_FILE} found, draining worker {os.getpid()}")
+    await conversation_router.drain(DRAIN_TIMEOUT_SECONDS)
+
+
+# with several workers, /metrics sums the metrics every worker writes to this directory
+METRICS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+
+@app.on_event("startup")
+async def startup():
+    if METRICS_DIR:
+        metrics.share(METRICS_DIR)
+    if os.getenv("STARTUP_WARMUP", "true").lower() == "true":
+        await warmup_resources()
+    # pre-warm in the background so the worker accepts calls straight away
+    app.state.prewarm_task = asyncio.create_task(prewarm_tts_cache())
+    # synthesizers for the common output sampling rates, built in the background;
+    # transcriber pools fill on first use
+    app.state.synthesizer_warm_tasks = [
+        asyncio.create_task(
+            synthesizer_pool.warm(
+                OutputAudioConfig(
+                    sampling_rate=sampling_rate, audio_encoding=AudioEncoding.LINEAR16
+                )
+            )
+        )
+        for sampling_rate in common_output_sampling_rates()
+    ]
+    app.state.drain_task = asyncio.create_task(watch_drain_file())
+    app.state.news_poll_task = None
+    if NEWS_POLLER_ENABLED:
+        app.state.news_poll_task = asyncio.create_task(
+            create_news_poller(NEWS_POLL_QUERIES).run(NEWS_POLL_INTERVAL_SECONDS)
+        )
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # uvicorn closes websockets before this runs; drain is a no-op if stop.sh already drained
+    app.state.drain_task.cancel()
+    if app.state.news_poll_task:
+        app.state.news_poll_task.cancel()
+    await conversation_router.drain(timeout=0)
+    # the last values of this worker are kept in the shared metrics
+    metrics.write_snapshot()
@@ -0,0 +1,166 @@
+""" Prompt of the ReAct agent with a static, cacheable prefix.
+
+The default conversational chat agent puts the tool descriptions and the
+format instructions in the human message after the chat history, so the
+prompt differs from the first message onwards and provider-side prompt caching
+never applies. Here the system prompt, compact tool descriptions and format
+instructions are one system message, built once and byte-identical for every
+call of every turn. The dynamic parts follow it: chat history, user input and
+the agent scratchpad. Tokens of each section are recorded per LLM call.
+"""
+from typing import Any, List, Optional, Sequence
+
+from langchain.agents import Agent, ConversationalChatAgent
+from langchain.base_language import BaseLanguageModel
+from langchain.prompts.base import BasePromptTemplate
+from langchain.prompts.chat import (
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    MessagesPlaceholder,
+)
+from langchain.schema import BaseMessage, BaseOutputParser, SystemMessage
+from langchain.tools.base import BaseTool
+
+from src.metrics import metrics
+from src.tokens import count_message_tokens
+
+PROMPT_TOKENS = metrics.histogram(
+    "vocode_hsbc_agent_prompt_tokens",
+    "Tokens of each section of the agent prompt per LLM call",
+    ("section",),
+    buckets=(50, 100, 250, 500, 1000, 2000, 4000, 8000),
+)
+
+# sections of the agent prompt in order, the prefix is the only static one
+PREFIX_SECTION = "prefix"
+HISTORY_SECTION = "chat_history"
+INPUT_SECTION = "input"
+SCRATCHPAD_SECTION = "agent_scratchpad"
+
+TOOLS_TEMPLATE = """
+TOOLS
+------
+You can use these tools to look up information that helps answering the customer:
+{tools}
+
+RESPONSE FORMAT
+----------------
+Always respond with a markdown code snippet of a json blob with a single action and nothing else:
+```json
+{{"action": string, "action_input": string}}
+```
+"action" is one of: {tool_names} to use a tool, or "Final Answer" to answer the customer directly.
+"action_input" is the input of the tool or the answer to the customer.
+"""
+
+INPUT_TEMPLATE = """USER'S INPUT
+--------------------
+{input}"""
+
+TOOL_RESPONSE_TEMPLATE = """TOOL RESPONSE:
+---------------------
+{observation}
+
+USER'S INPUT
+--------------------
+What is the response to my last comment? Mention information from the tool response without mentioning the tool names, and respond with a json blob with a single action."""
+
+
+def compact_description(tool: BaseTool) -> str:
+    """Tool description without the signature added by the @tool decorator and the boilerplate wording."""
+    description = tool.description
+    if description.startswith(tool.name) and " - " in description:
+        description = description.split(" - ", 1)[1]
+    for boilerplate in ("useful for when you need to ", "useful when you need to "):
+        if description.lower().startswith(boilerplate):
+            description = description[len(boilerplate) :]
+    return description.strip()
+
+
+def static_prefix(system_prompt: str, tools: Sequence[BaseTool]) -> str:
+    """System prompt, tool descriptions and format instructions, identical for every call."""
+    return (
+        system_prompt.rstrip()
+        + "\n"
+        + TOOLS_TEMPLATE.format(
+            tools="\n".join(
+                f"> {tool.name}: {compact_description(tool)}" for tool in tools
+            ),
+            tool_names=", ".join(tool.name for tool in tools),
+        )
+    )
+
+
+class SectionedChatPromptTemplate(ChatPromptTemplate):
+    """Chat prompt that records the tokens of every section when it is formatted."""
+
+    section_names: List[str]
+
+    def format_messages(self, **kwargs: Any) -> List[BaseMessage]:
+        kwargs = self._merge_partial_and_user_variables(**kwargs)
+        result = []
+        for name, message_template in zip(self.section_names, self.messages):
+            if isinstance(message_template, BaseMessage):
+                messages = [message_template]
+            else:
+                messages = message_template.format_messages(
+                    **{
+                        k: v
+                        for k, v in kwargs.items()
+                        if k in message_template.input_variables
+                    }
+                )
+            PROMPT_TOKENS.observe(count_message_tokens(messages), name)
+            result.extend(messages)
+        return result
+
+
+class PrefixCachedChatAgent(ConversationalChatAgent):
+    """Conversational ReAct agent whose prompt starts with a static prefix."""
+
+    template_tool_response: str = TOOL_RESPONSE_TEMPLATE
+
+    @classmethod
+    def create_prompt(
+        cls,
+        tools: Sequence[BaseTool],
+        system_message: str = "",
+        human_message: str = INPUT_TEMPLATE,
+        input_variables: Optional[List[str]] = None,
+        output_parser: Optional[BaseOutputParser] = None,
+    ) -> BasePromptTemplate:
+        # a message instead of a template, so the prefix is never formatted again
+        messages = [
+            SystemMessage(content=static_prefix(system_message, tools)),
+            MessagesPlaceholder(variable_name="chat_history"),
+            HumanMessagePromptTemplate.from_template(human_message),
+            MessagesPlaceholder(variable_name="agent_scratchpad"),
+        ]
+        return SectionedChatPromptTemplate(
+            input_variables=input_variables
+            or ["input", "chat_history", "agent_scratchpad"],
+            messages=messages,
+            section_names=[
+                PREFIX_SECTION,
+                HISTORY_SECTION,
+                INPUT_SECTION,
+                SCRATCHPAD_SECTION,
+            ],
+        )
+
+    @classmethod
+    def from_llm_and_tools(
+        cls,
+        llm: BaseLanguageModel,
+        tools: Sequence[BaseTool],
+        system_message: str = "",
+        human_message: str = INPUT_TEMPLATE,
+        **kwargs: Any,
+    ) -> Agent:
+        return super().from_llm_and_tools(
+            llm,
+            tools,
+            system_message=system_message,
+            human_message=human_message,
+            **kwargs,
+        )
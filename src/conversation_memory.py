@@ -0,0 +1,260 @@
+""" Token-budgeted conversation memory with background compaction.
+
+The agent prompt only gets the most recent messages that fit in the token
+budget, preceded by a running summary of the older turns. Long answers (e.g.
+knowledge base content or news summaries returned directly by a tool) are
+truncated when they are saved. Turns that no longer fit in the budget are
+folded into the summary by an LLM call in the background, after the turn has
+been answered, so the summarisation never adds latency to a turn.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.schema import (
+    AIMessage,
+    BaseMessage,
+    SystemMessage,
+    messages_from_dict,
+    messages_to_dict,
+)
+
+from src.metrics import metrics
+from src.tokens import count_message_tokens, count_tokens, truncate_to_tokens
+from src.usage import usage_owner
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+MEMORY_TOKENS = metrics.histogram(
+    "vocode_hsbc_memory_prompt_tokens",
+    "Tokens of conversation memory added to the prompt per turn",
+    buckets=(100, 250, 500, 1000, 2000, 4000, 8000),
+)
+MEMORY_TOKENS_SAVED = metrics.counter(
+    "vocode_hsbc_memory_tokens_saved_total",
+    "Prompt tokens saved by truncating and summarising memory, compared with replaying the full history",
+)
+
+# summarises earlier turns: receives the previous summary and the messages to fold into it
+Summariser = Callable[[str, List[BaseMessage]], str]
+
+
+def original_tokens(message: BaseMessage) -> int:
+    """Tokens of a message before it was truncated."""
+    return message.additional_kwargs.get("original_tokens") or count_message_tokens(
+        [message]
+    )
+
+
+class TokenBudgetMemory(BaseChatMemory):
+    """Chat memory that returns a summary plus the most recent messages within `max_tokens`."""
+
+    memory_key: str = "chat_history"
+    return_messages: bool = True
+    max_tokens: int = 1000
+    max_message_tokens: int = 200
+    summary: str = ""
+    summarised_tokens: int = 0
+    # number of messages loaded from the session store, the rest were added in this turn
+    loaded_messages: int = 0
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    def prompt_messages(self) -> List[BaseMessage]:
+        """Summary message and the newest messages that fit in the token budget."""
+        prompt: List[BaseMessage] = []
+        budget = self.max_tokens
+        if self.summary:
+            summary_message = SystemMessage(content=SUMMARY_PREFIX + self.summary)
+            prompt.append(summary_message)
+            budget -= count_message_tokens([summary_message])
+        recent: List[BaseMessage] = []
+        for message in reversed(self.chat_memory.messages):
+            tokens = count_message_tokens([message])
+            if tokens > budget:
+                break
+            recent.append(message)
+            budget -= tokens
+        return prompt + recent[::-1]
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        messages = self.prompt_messages()
+        prompt_tokens = count_message_tokens(messages)
+        full_tokens = self.summarised_tokens + sum(
+            original_tokens(m) for m in self.chat_memory.messages
+        )
+        MEMORY_TOKENS.observe(prompt_tokens)
+        MEMORY_TOKENS_SAVED.inc(max(full_tokens - prompt_tokens, 0))
+        return {self.memory_key: messages}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        input_str, output_str = self._get_input_output(inputs, outputs)
+        self.chat_memory.add_user_message(
+            truncate_to_tokens(input_str, self.max_message_tokens)
+        )
+        output_tokens = count_tokens(output_str)
+        if output_tokens > self.max_message_tokens:
+            # long tool output returned as answer; the customer already heard it in full
+            self.chat_memory.add_message(
+                AIMessage(
+                    content=truncate_to_tokens(output_str, self.max_message_tokens),
+                    additional_kwargs={"original_tokens": output_tokens},
+                )
+            )
+        else:
+            self.chat_memory.add_ai_message(output_str)
+
+
+def split_summary(stored: List[dict]) -> tuple[Optional[dict], List[dict]]:
+    """Split stored messages into the summary message, if any, and the conversation messages."""
+    if stored and stored[0]["type"] == "system":
+        return stored[0], stored[1:]
+    return None, stored
+
+
+def summary_of(summary: Optional[dict]) -> tuple[str, int]:
+    """Summary text and the number of tokens it replaces, of a stored summary message."""
+    if not summary:
+        return "", 0
+    data = summary["data"]
+    return data["content"][len(SUMMARY_PREFIX) :], data.get(
+        "additional_kwargs", {}
+    ).get("summarised_tokens", 0)
+
+
+class ConversationMemoryStore:
+    """
+    Loads and saves TokenBudgetMemory in a session store and compacts it in the background.
+    Stored history is the summary as a leading system message followed by the messages.
+    """
+
+    def __init__(
+        self,
+        session_store,
+        summarise: Optional[Summariser] = None,
+        max_tokens: int = 1000,
+        max_message_tokens: int = 200,
+        max_messages: int = 40,
+        max_workers: int = 2,
+    ):
+        """
+        :param session_store: store shared by the workers, see src.session_store
+        :param summarise: LLM summariser; without it, messages over the budget are dropped
+        :param max_tokens: token budget of the memory in the prompt, summary included
+        :param max_message_tokens: longer messages are truncated when saved
+        :param max_messages: hard limit of stored messages, also when summarisation fails
+        """
+        self.session_store = session_store
+        self.summarise = summarise
+        self.max_tokens = max_tokens
+        self.max_message_tokens = max_message_tokens
+        self.max_messages = max_messages
+        # the summary gets a quarter of the budget, the recent messages the rest
+        self.summary_tokens = max_tokens // 4
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="memory-compaction"
+        )
+        self.compacting: set[str] = set()
+        # striped locks, so that the number of locks does not grow with the number of calls
+        self._locks = [threading.Lock() for _ in range(64)]
+        self._compacting_lock = threading.Lock()
+
+    def lock(self, conversation_id: str) -> threading.Lock:
+        return self._locks[hash(conversation_id) % len(self._locks)]
+
+    def load(self, conversation_id: Optional[str]) -> TokenBudgetMemory:
+        """Memory of a conversation, empty for an unknown or missing conversation id."""
+        memory = TokenBudgetMemory(
+            max_tokens=self.max_tokens, max_message_tokens=self.max_message_tokens
+        )
+        if conversation_id:
+            summary, messages = split_summary(self.session_store.load(conversation_id))
+            memory.summary, memory.summarised_tokens = summary_of(summary)
+            memory.chat_memory.messages = messages_from_dict(messages)
+            memory.loaded_messages = len(messages)
+        return memory
+
+    def save(self, conversation_id: Optional[str], memory: TokenBudgetMemory) -> None:
+        """Append the messages of this turn to the stored history and compact it if it is over budget."""
+        if not conversation_id:
+            return
+        new_messages = memory.chat_memory.messages[memory.loaded_messages :]
+        with self.lock(conversation_id):
+            # a compaction may have rewritten the history while the turn was running
+            summary, messages = split_summary(self.session_store.load(conversation_id))
+            messages = (messages + messages_to_dict(new_messages))[-self.max_messages :]
+            self.session_store.save(
+                conversation_id, ([summary] if summary else []) + messages
+            )
+        if (
+            count_message_tokens(messages_from_dict(messages))
+            > self.max_tokens - self.summary_tokens
+        ):
+            self.schedule_compaction(conversation_id)
+
+    def schedule_compaction(self, conversation_id: str) -> None:
+        with self._compacting_lock:
+            if conversation_id in self.compacting:
+                return
+            self.compacting.add(conversation_id)
+        self.executor.submit(self._compact_in_background, conversation_id)
+
+    def _compact_in_background(self, conversation_id: str) -> None:
+        try:
+            with usage_owner(conversation_id):
+                self.compact(conversation_id)
+        except Exception as e:
+            logger.warning(
+                f"Memory compaction of conversation {conversation_id} failed: {e}"
+            )
+        finally:
+            with self._compacting_lock:
+                self.compacting.discard(conversation_id)
+
+    def messages_to_fold(self, messages: List[BaseMessage]) -> int:
+        """Number of oldest messages to fold into the summary so the rest fits next to the summary."""
+        budget = self.max_tokens - self.summary_tokens
+        total = count_message_tokens(messages)
+        count = 0
+        # fold whole exchanges (human + ai) so the history never starts with an answer
+        while count < len(messages) and total > budget:
+            for message in messages[count : count + 2]:
+                total -= count_message_tokens([message])
+            count += 2
+        return min(count, len(messages))
+
+    def compact(self, conversation_id: str) -> None:
+        """Fold the oldest turns over the budget into the running summary."""
+        with self.lock(conversation_id):
+            summary, stored = split_summary(self.session_store.load(conversation_id))
+        messages = messages_from_dict(stored)
+        count = self.messages_to_fold(messages)
+        if count == 0:
+            return
+        folded = messages[:count]
+        previous, summarised_tokens = summary_of(summary)
+        summarised_tokens += sum(original_tokens(m) for m in folded)
+
+        # the LLM call runs without the lock, turns of the conversation are not blocked
+        new_summary = self.summarise(previous, folded) if self.summarise else previous
+        new_summary = truncate_to_tokens(new_summary, self.summary_tokens)
+
+        with self.lock(conversation_id):
+            _, current = split_summary(self.session_store.load(conversation_id))
+            if current[:count] != stored[:count]:
+                # history was trimmed meanwhile; try again after the next turn
+                return
+            summary_message = SystemMessage(
+                content=SUMMARY_PREFIX + new_summary,
+                additional_kwargs={"summarised_tokens": summarised_tokens},
+            )
+            self.session_store.save(
+                conversation_id, messages_to_dict([summary_message]) + current[count:]
+            )
+        logger.debug(f"Compacted {count} messages of conversation {conversation_id}")
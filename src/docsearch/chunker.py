@@ -0,0 +1,97 @@
+""" Layout-aware chunking of parsed document blocks.
+
+The block parsers (extract_blocks_from_img, parse_pdf_blocks) return one
+Document per paragraph or table with its section. StructuredChunker packs
+consecutive blocks of the same section into chunks of about max_tokens tokens,
+so chunks never straddle sections, and starts every chunk with its section
+heading. Blocks larger than a chunk are split at paragraph, line and sentence
+boundaries; tables are split by rows and keep their header row.
+"""
+from typing import Iterable, Iterator, List
+
+from langchain.docstore.document import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from src.tokens import count_tokens
+
+
+class StructuredChunker:
+    """Drop-in replacement of a text splitter's split_documents for block Documents."""
+
+    def __init__(self, max_tokens: int = 300):
+        """
+        :param max_tokens: maximum tokens per chunk, section heading included
+        """
+        self.max_tokens = max_tokens
+
+    def _text_splitter(self, max_tokens: int) -> RecursiveCharacterTextSplitter:
+        return RecursiveCharacterTextSplitter(
+            chunk_size=max_tokens,
+            chunk_overlap=0,
+            length_function=count_tokens,
+            separators=["\n\n", "\n", ". ", " ", ""],
+        )
+
+    def split_block(self, block: Document, max_tokens: int) -> Iterator[Document]:
+        """Split a block into pieces of at most max_tokens tokens."""
+        if count_tokens(block.page_content) <= max_tokens:
+            yield block
+            return
+        if block.metadata.get("kind") == "table":
+            header, *rows = block.page_content.split("\n")
+            piece: List[str] = [header]
+            for row in rows:
+                if (
+                    len(piece) > 1
+                    and count_tokens("\n".join(piece + [row])) > max_tokens
+                ):
+                    yield Document(
+                        page_content="\n".join(piece), metadata=block.metadata
+                    )
+                    piece = [header]
+                piece.append(row)
+            yield Document(page_content="\n".join(piece), metadata=block.metadata)
+            return
+        for text in self._text_splitter(max_tokens).split_text(block.page_content):
+            yield Document(page_content=text, metadata=block.metadata)
+
+    def merge(self, pieces: List[Document]) -> Document:
+        """One chunk of pieces of the same section, starting with the section heading."""
+        first, last = pieces[0].metadata, pieces[-1].metadata
+        section = first.get("section") or ""
+        text = "\n\n".join(piece.page_content for piece in pieces)
+        return Document(
+            page_content=f"{section}\n{text}" if section else text,
+            metadata={
+                "source": first.get("source"),
+                "section": section,
+                "page": first.get("page"),
+                "page_end": last.get("page"),
+            },
+        )
+
+    def split_documents(self, documents: Iterable[Document]) -> List[Document]:
+        """Pack consecutive blocks of a section into chunks of about max_tokens tokens."""
+        chunks: List[Document] = []
+        pieces: List[Document] = []
+        tokens = 0
+
+        def key(document: Document):
+            return document.metadata.get("source"), document.metadata.get("section")
+
+        for block in documents:
+            section = block.metadata.get("section") or ""
+            budget = self.max_tokens - (count_tokens(section) if section else 0)
+            for piece in self.split_block(block, budget):
+                piece_tokens = count_tokens(piece.page_content)
+                if pieces and (
+                    key(pieces[0]) != key(piece) or tokens + piece_tokens > budget
+                ):
+                    chunks.append(self.merge(pieces))
+                    pieces, tokens = [], 0
+                pieces.append(piece)
+                # plus the paragraph break that joins the pieces
+                tokens += piece_tokens + 1
+        if pieces:
+            chunks.append(self.merge(pieces))
+        return chunks
@@ -1,13 +1,21 @@
 from functools import partial
-from typing import Callable, Dict, List, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 
 import faiss
+import numpy as np
 from azure.ai.formrecognizer import DocumentAnalysisClient
 from langchain.llms import AzureOpenAI
 
-from .faiss_qa import embed_file, query_text_qa, retrieve_faiss_indexes_from_text
-from .ocr_parser import extract_text_from_img
-from .pdf_parser import parse_pdf
+from .faiss_qa import (
+    create_faiss_index,
+    embed_file,
+    query_text_qa,
+    query_texts_qa,
+    retrieve_faiss_indexes_from_text,
+    retrieve_faiss_indexes_from_texts,
+)
+from .ocr_parser import extract_blocks_from_img, extract_text_from_img
+from .pdf_parser import parse_pdf, parse_pdf_blocks
 
 
 def docsearch_create_indexes_from_files(
@@ -16,39 +24,46 @@ def docsearch_create_indexes_from_files(
     doc_analysis_client: DocumentAnalysisClient,
     embeddings_model: AzureOpenAI,
     text_splitter: Callable[[str], List[str]],
-) -> Tuple[faiss.IndexFlatL2, Dict[int, str]]:
+    layout_aware: bool = False,
+    quantization: Optional[str] = "fp16",
+) -> Tuple[faiss.Index, Dict[int, str]]:
     """
     Create Faiss indexes from uploaded files.
 
     This function takes in the number of dimensions for the Faiss index,
     a list of uploaded files, a document analysis client, an embeddings model
-    and a text splitter function. It initializes a Faiss index.
+    and a text splitter function.
 
     The function then loops through the uploaded files and checks if the
-    file is a PDF or an image. If it is a PDF, it chunks the file and adds it to the index.
-    If it is an image, it extracts text from the image and adds it to the index.
+    file is a PDF or an image. If it is a PDF, it chunks and embeds the file.
+    If it is an image, it extracts text from the image and embeds it. Then it
+    creates the Faiss index of all embeddings, quantized to fp16 by default.
     The function returns the Faiss index and a dictionary containing the indexed document store
 
+    With layout_aware, files are parsed into paragraph and table blocks with
+    page and section metadata; use it with a StructuredChunker as text splitter.
+
     :param num_dimensions: number of dimensions for the Faiss index
     :param uploaded_files: list of uploaded files, either bytes or filepaths
     :param doc_analysis_client: document analysis client to use for OCR
     :param embeddings_model: embeddings model to use for embedding
     :param text_splitter: text splitter to use for chunking
+    :param layout_aware: parse files into layout blocks instead of pages
+    :param quantization: storage of the index vectors: None (float32), fp16 or int8
     :return: Faiss index and index_doc_store
     """
 
-    # initialise faiss index
-    faiss_index = faiss.IndexFlatL2(num_dimensions)
-
     # create a partial function to pass to add_files_to_index
     img_extract_fn = partial(
-        extract_text_from_img,
+        extract_blocks_from_img if layout_aware else extract_text_from_img,
         document_analysis_client=doc_analysis_client,
     )
+    pdf_parse_fn = parse_pdf_blocks if layout_aware else parse_pdf
 
     # initialise index_doc_store; this is a dictionary that stores the index:document text
     index_doc_store = {}
     counter = 0
+    file_embeddings = []
 
     # loop through files and add them to index
     for uf in uploaded_files:
@@ -60,18 +75,27 @@ def docsearch_create_indexes_from_files(
             uf,
             embeddings_model,
             text_splitter,
-            parse_pdf if uf.endswith(".pdf") else img_extract_fn,
+            pdf_parse_fn if uf.endswith(".pdf") else img_extract_fn,
         )
         index_doc_store.update({i + counter: t for i, t in enumerate(file_texts)})
         counter += len(file_texts)
-        faiss_index.add(embedded_texts)
+        file_embeddings.append(embedded_texts.reshape(-1, num_dimensions))
+
+    # the int8 quantizer learns the range of every dimension from all embeddings
+    faiss_index = create_faiss_index(
+        num_dimensions,
+        np.concatenate(file_embeddings)
+        if file_embeddings
+        else np.empty((0, num_dimensions)),
+        quantization,
+    )
 
     return faiss_index, index_doc_store
 
 
 def docsearch_query_indexes(
     query_text: str,
-    faiss_index: faiss.IndexFlatL2,
+    faiss_index: faiss.Index,
     index_doc_store: Dict[int, str],
     embeddings_model: AzureOpenAI,
     llm: AzureOpenAI,
@@ -101,3 +125,42 @@ def docsearch_query_indexes(
         faiss_idxs,
     )
     return res
+
+
+def docsearch_query_indexes_batch(
+    query_texts: List[str],
+    faiss_index: faiss.Index,
+    index_doc_store: Dict[int, str],
+    embeddings_model: AzureOpenAI,
+    llm: AzureOpenAI,
+    max_workers: int = 5,
+) -> List[str]:
+    """
+    Batched version of docsearch_query_indexes for offline evaluation, query
+    expansion and pre-answering FAQs.
+
+    Embeds all query texts in batched requests, retrieves the nearest neighbours
+    of all of them with one search of the Faiss index and performs Q/A on the
+    queries concurrently.
+    :param query_texts: queries to answer
+    :param faiss_index: Faiss index to query
+    :param index_doc_store: dictionary containing the index:document text
+    :param embeddings_model: embeddings model to use for embedding
+    :param llm: language model to use for QA
+    :param max_workers: number of concurrent Q/A calls
+    :return: answers in the order of query_texts
+    """
+
+    faiss_idxs = retrieve_faiss_indexes_from_texts(
+        query_texts,
+        faiss_index,
+        embeddings_model,
+    )
+
+    return query_texts_qa(
+        query_texts,
+        index_doc_store,
+        llm,
+        faiss_idxs,
+        max_workers=max_workers,
+    )
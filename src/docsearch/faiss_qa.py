@@ -2,7 +2,7 @@ import time
 from collections.abc import Callable
 from concurrent.futures import ThreadPoolExecutor
 from functools import partial
-from typing import Tuple
+from typing import List, Tuple
 
 import faiss
 import numpy as np
@@ -12,6 +12,44 @@ from langchain.llms import AzureOpenAI
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from tqdm import tqdm
 
+from src.usage import EMBEDDING_MODEL, record_embedding
+
+# texts per embedding request; Azure OpenAI ada-002 deployments accept at most 16 inputs
+EMBEDDING_BATCH_SIZE = 16
+
+# faiss scalar quantizers of the stored vectors; float32 takes 4 bytes per dimension, fp16 2 and int8 1
+QUANTIZERS = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "int8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def create_faiss_index(
+    num_dimensions: int, embeddings: np.ndarray, quantization: str | None = None
+) -> faiss.Index:
+    """Create a faiss L2 index of embeddings, optionally storing the vectors quantized.
+    :param num_dimensions: number of dimensions of the embeddings
+    :param embeddings: np.ndarray of embeddings, one row per text
+    :param quantization: None for float32 vectors, fp16 or int8 (scalar quantization
+        with a per-dimension range learnt from the embeddings)
+    :return: faiss index containing the embeddings
+    """
+    if quantization is None:
+        faiss_index = faiss.IndexFlatL2(num_dimensions)
+    elif quantization in QUANTIZERS:
+        faiss_index = faiss.IndexScalarQuantizer(
+            num_dimensions, QUANTIZERS[quantization], faiss.METRIC_L2
+        )
+    else:
+        raise ValueError(f"Unknown quantization {quantization}, use one of {list(QUANTIZERS)}")
+
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32").reshape(-1, num_dimensions)
+    if not faiss_index.is_trained and len(embeddings):
+        faiss_index.train(embeddings)
+    if len(embeddings):
+        faiss_index.add(embeddings)
+    return faiss_index
+
 
 def embed_text(text: str, embeddings_model: OpenAIEmbeddings) -> np.ndarray:
     """Embed text with OpenAI embeddings model.
@@ -64,7 +102,7 @@ def embed_file(
     file_texts = text_splitter.split_documents(file_data)
     print(f"Chunked {len(file_texts)} chunks of text")
 
-    # embed the chunked texts
+    # embed the chunked texts; float32 as in the faiss index instead of the float64 default
     with ThreadPoolExecutor(max_workers=5) as executor:
         embedded_texts = np.array(
             list(
@@ -74,15 +112,19 @@ def embed_file(
                         [p.page_content for p in file_texts],
                     )
                 )
-            )
+            ),
+            dtype="float32",
         )
+    # one request per chunk; recorded here as the pool threads do not share the caller's usage context
+    for p in file_texts:
+        record_embedding([p.page_content], model=getattr(embeddings_model, "model", EMBEDDING_MODEL))
 
     return embedded_texts, file_texts
 
 
 def retrieve_faiss_indexes_from_text(
     text: str,
-    faiss_index: faiss.IndexFlatL2,
+    faiss_index: faiss.Index,
     embeddings_model: OpenAIEmbeddings,
     num_nn: int = 5,
 ) -> np.ndarray:
@@ -98,6 +140,7 @@ def retrieve_faiss_indexes_from_text(
     query_embedding = np.array(embeddings_model.embed_query(text)).astype(
         "float32"
     )
+    record_embedding([text], model=getattr(embeddings_model, "model", EMBEDDING_MODEL))
     # expand dimensions to match the right shape
     query_embedding = np.expand_dims(query_embedding, axis=0)
 
@@ -109,6 +152,40 @@ def retrieve_faiss_indexes_from_text(
     return I[0]  # retrieve first index
 
 
+def retrieve_faiss_indexes_from_texts(
+    texts: List[str],
+    faiss_index: faiss.Index,
+    embeddings_model: OpenAIEmbeddings,
+    num_nn: int = 5,
+) -> np.ndarray:
+    """Embeds many texts in batched requests and retrieves the num_nn closest results
+    of all of them with a single search of the faiss index.
+    :param: texts: texts to embed, sent EMBEDDING_BATCH_SIZE texts per request
+    :param: faiss_index: faiss index to query
+    :param: embeddings_model: OpenAI embeddings model
+    :param: num_nn: number of nearest neighbors to return per text
+    :return: np.ndarray of faiss indexes, one row per text
+    """
+    if not texts:
+        return np.empty((0, num_nn), dtype="int64")
+
+    # get vector embeddings of all queries, one row per query; OpenAIEmbeddings sends up to
+    # 1000 texts per request by default, more than an Azure deployment accepts
+    query_embeddings = []
+    for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        batch = texts[start : start + EMBEDDING_BATCH_SIZE]
+        query_embeddings += embeddings_model.embed_documents(batch)
+        record_embedding(batch, model=getattr(embeddings_model, "model", EMBEDDING_MODEL))
+    query_embeddings = np.array(query_embeddings).astype("float32")
+
+    # query faiss index with the whole matrix; k is num nn to return
+    _, I = faiss_index.search(query_embeddings, num_nn)
+
+    assert I.shape == (len(texts), num_nn), "Error in retrieving faiss indexes"
+
+    return I
+
+
 def query_text_qa(
     text: str,
     index_doc_store: dict[int, str],
@@ -131,3 +208,27 @@ def query_text_qa(
     res = qa_chain.run(input_documents=qa_docs, question=text)
 
     return res
+
+
+def query_texts_qa(
+    texts: List[str],
+    index_doc_store: dict[int, str],
+    llm_model: AzureOpenAI,
+    faiss_idxs: np.ndarray,
+    max_workers: int = 5,
+) -> List[str]:
+    """Answer many questions concurrently, each from the documents of its row of faiss indexes.
+    :param texts: texts to query
+    :param index_doc_store: dict of index to document
+    :param llm_model: llm model to use
+    :param faiss_idxs: faiss indexes, one row per text
+    :param max_workers: number of concurrent llm calls
+    :return: list of answers in the order of texts"""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(
+            executor.map(
+                lambda text, idxs: query_text_qa(text, index_doc_store, llm_model, idxs),
+                texts,
+                faiss_idxs,
+            )
+        )
@@ -1,13 +1,18 @@
 from azure.ai.formrecognizer import DocumentAnalysisClient
 from langchain.docstore.document import Document
 
+# paragraph roles that start a new section
+HEADING_ROLES = {"title", "sectionHeading"}
+# repeated on every page, they only add redundant text to the chunks
+SKIPPED_ROLES = {"pageHeader", "pageFooter", "pageNumber"}
 
-def extract_text_from_img(
+
+def analyze_document(
     file: str | bytes, document_analysis_client: DocumentAnalysisClient
-) -> list[Document]:
-    """Extract text from file using Azure Form Recogniser.
+):
+    """Analyze a file with the Azure Form Recogniser prebuilt-document model.
     :param file: File path (str) or BytesIO object
-    :returns: List of Document objects
+    :returns: AnalyzeResult with pages, paragraphs and tables
     """
 
     # if string; then extract bytes from file first
@@ -20,7 +25,19 @@ def extract_text_from_img(
         "prebuilt-document", document=file
     )
 
-    result = poller.result()
+    return poller.result()
+
+
+def extract_text_from_img(
+    file: str | bytes, document_analysis_client: DocumentAnalysisClient
+) -> list[Document]:
+    """Extract text from file using Azure Form Recogniser.
+    :param file: File path (str) or BytesIO object
+    :returns: List of Document objects
+    """
+
+    result = analyze_document(file, document_analysis_client)
+    source = file if isinstance(file, str) else None
 
     # Extract text from results; one Document per page
     output = []
@@ -29,6 +46,96 @@ def extract_text_from_img(
         for line in page.lines:
             text += line.content
             text += "\n"
-        output.append(Document(page_content=text))
+        output.append(
+            Document(
+                page_content=text, metadata={"source": source, "page": page.page_number}
+            )
+        )
+
+    return output
+
+
+def table_to_text(table) -> str:
+    """Render a Form Recogniser table as one line per row with cells separated by |."""
+    rows = [[""] * table.column_count for _ in range(table.row_count)]
+    for cell in table.cells:
+        rows[cell.row_index][cell.column_index] = cell.content
+    return "\n".join(" | ".join(row) for row in rows)
+
+
+def page_number_of(element) -> int:
+    """Page of the first bounding region of a paragraph or table."""
+    regions = element.bounding_regions or []
+    return regions[0].page_number if regions else 1
+
+
+def extract_blocks_from_img(
+    file: str | bytes, document_analysis_client: DocumentAnalysisClient
+) -> list[Document]:
+    """Extract the layout blocks of a file using Azure Form Recogniser.
+
+    Returns one Document per paragraph or table in reading order, with the
+    source, page, section heading and kind (paragraph or table) as metadata.
+    Headings set the section of the blocks that follow them, page headers,
+    footers and numbers are dropped.
+    :param file: File path (str) or BytesIO object
+    :returns: List of Document objects
+    """
+
+    result = analyze_document(file, document_analysis_client)
+    source = file if isinstance(file, str) else None
+
+    # results without paragraphs (e.g. prebuilt-read); one block per page
+    if not result.paragraphs:
+        return [
+            Document(
+                page_content="\n".join(line.content for line in page.lines),
+                metadata={
+                    "source": source,
+                    "page": page.page_number,
+                    "section": "",
+                    "kind": "paragraph",
+                },
+            )
+            for page in result.pages
+        ]
+
+    # tables are also returned as paragraphs of their cells; keep the table instead
+    tables = result.tables or []
+    table_spans = [(s.offset, s.offset + s.length) for t in tables for s in t.spans]
+
+    def in_table(paragraph) -> bool:
+        offset = paragraph.spans[0].offset if paragraph.spans else -1
+        return any(start <= offset < end for start, end in table_spans)
+
+    # merge paragraphs and tables in reading order by their offset in the content
+    elements = [
+        (p.spans[0].offset if p.spans else 0, "paragraph", p)
+        for p in result.paragraphs
+        if not in_table(p)
+    ]
+    elements += [(t.spans[0].offset if t.spans else 0, "table", t) for t in tables]
+    elements.sort(key=lambda e: e[0])
+
+    output = []
+    section = ""
+    for _, kind, element in elements:
+        if kind == "paragraph" and element.role in SKIPPED_ROLES:
+            continue
+        if kind == "paragraph" and element.role in HEADING_ROLES:
+            section = element.content.strip()
+            continue
+        text = table_to_text(element) if kind == "table" else element.content
+        output.append(
+            Document(
+                page_content=text,
+                metadata={
+                    "source": source,
+                    "page": page_number_of(element),
+                    "section": section,
+                    "kind": kind,
+                },
+            )
+        )
 
     return output
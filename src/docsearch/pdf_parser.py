@@ -5,20 +5,99 @@ from langchain.docstore.document import Document
 from pypdf import PdfReader
 
 
+def clean_pdf_text(text: str) -> str:
+    """Undo the line breaks of extracted pdf text, keeping paragraph breaks."""
+    # Merge hyphenated words
+    text = re.sub(r"(\w+)-\n(\w+)", r"\1\2", text)
+    # Fix newlines in the middle of sentences
+    text = re.sub(r"(?<!\n\s)\n(?!\s\n)", " ", text.strip())
+    # Remove multiple newlines
+    text = re.sub(r"\n\s*\n", "\n\n", text)
+    return text
+
+
 def parse_pdf(file: str | BytesIO) -> list[Document]:
     """Parse pdf file and return list of document pages.
     :param file: str or BytesIO object of pdf file
     :returns: List of Document objects
     """
     pdf = PdfReader(file)
+    source = file if isinstance(file, str) else None
+    output = []
+    for page_number, page in enumerate(pdf.pages, start=1):
+        text = clean_pdf_text(page.extract_text())
+        output.append(
+            Document(
+                page_content=text, metadata={"source": source, "page": page_number}
+            )
+        )
+    return output
+
+
+def outline_titles(pdf: PdfReader) -> list[tuple[int, str]]:
+    """Titles of the pdf outline (bookmarks) with their page numbers, in document order."""
+    titles = []
+
+    def walk(items):
+        for item in items:
+            if isinstance(item, list):
+                walk(item)
+                continue
+            try:
+                titles.append(
+                    (pdf.get_destination_page_number(item) + 1, item.title.strip())
+                )
+            except Exception:
+                # outline entries without a page destination
+                continue
+
+    try:
+        walk(pdf.outline)
+    except Exception:
+        return []
+    return sorted(titles, key=lambda t: t[0])
+
+
+def parse_pdf_blocks(file: str | BytesIO) -> list[Document]:
+    """Parse pdf file and return one Document per paragraph.
+
+    The section of each paragraph is taken from the pdf outline: a section
+    starts at the paragraph that begins with its title, or at the top of its
+    page if no paragraph does.
+    :param file: str or BytesIO object of pdf file
+    :returns: List of Document objects with source, page, section and kind metadata
+    """
+    pdf = PdfReader(file)
+    source = file if isinstance(file, str) else None
+    outline = outline_titles(pdf)
     output = []
-    for page in pdf.pages:
-        text = page.extract_text()
-        # Merge hyphenated words
-        text = re.sub(r"(\w+)-\n(\w+)", r"\1\2", text)
-        # Fix newlines in the middle of sentences
-        text = re.sub(r"(?<!\n\s)\n(?!\s\n)", " ", text.strip())
-        # Remove multiple newlines
-        text = re.sub(r"\n\s*\n", "\n\n", text)
-        output.append(Document(page_content=text))
+    section = ""
+    for page_number, page in enumerate(pdf.pages, start=1):
+        paragraphs = [
+            p.strip()
+            for p in clean_pdf_text(page.extract_text()).split("\n\n")
+            if p.strip()
+        ]
+        titles = [title for number, title in outline if number == page_number]
+        unmatched = [t for t in titles if not any(p.startswith(t) for p in paragraphs)]
+        if unmatched:
+            section = unmatched[-1]
+        for paragraph in paragraphs:
+            title = next((t for t in titles if paragraph.startswith(t)), None)
+            if title:
+                section = title
+                paragraph = paragraph[len(title) :].strip()
+                if not paragraph:
+                    continue
+            output.append(
+                Document(
+                    page_content=paragraph,
+                    metadata={
+                        "source": source,
+                        "page": page_number,
+                        "section": section,
+                        "kind": "paragraph",
+                    },
+                )
+            )
     return output
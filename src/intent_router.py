@@ -0,0 +1,322 @@
+""" Lightweight local intent router placed in front of the ReAct agent.
+
+Greetings, off-topic questions and direct knowledge lookups do not need the
+full thought/action loop of the agent, so they are classified locally with a
+small keyword model and answered through a zero-call or single-call path.
+"""
+import re
+import statistics
+import threading
+from collections import defaultdict, deque
+from dataclasses import dataclass
+
+# route names
+GREETING_ROUTE = "greeting"
+REJECT_ROUTE = "reject"
+KNOWLEDGE_ROUTE = "knowledge"
+AGENT_ROUTE = "agent"
+
+WORD_PATTERN = re.compile(r"[a-z0-9$']+")
+
+# short utterances with a greeting word and otherwise only small talk words are treated as small talk
+GREETING_WORDS = {
+    "hi",
+    "hello",
+    "hey",
+    "hiya",
+    "morning",
+    "afternoon",
+    "evening",
+    "thanks",
+    "thank",
+    "cheers",
+    "ok",
+    "okay",
+    "bye",
+    "goodbye",
+    "later",
+}
+SMALL_TALK_WORDS = {
+    "good",
+    "you",
+    "very",
+    "much",
+    "a",
+    "lot",
+    "great",
+    "see",
+    "there",
+    "all",
+    "that's",
+    "thats",
+    "for",
+    "now",
+    "nice",
+    "day",
+    "have",
+}
+THANKS_WORDS = {"thanks", "thank", "cheers"}
+GOODBYE_WORDS = {"bye", "goodbye", "later"}
+
+# vocabulary of HSBC Hongkong products and services
+DOMAIN_TERMS = {
+    "hsbc",
+    "account",
+    "accounts",
+    "bank",
+    "banking",
+    "card",
+    "cards",
+    "credit",
+    "debit",
+    "loan",
+    "loans",
+    "mortgage",
+    "mortgages",
+    "deposit",
+    "deposits",
+    "interest",
+    "rate",
+    "rates",
+    "fee",
+    "fees",
+    "charge",
+    "charges",
+    "transfer",
+    "transfers",
+    "fps",
+    "payment",
+    "payments",
+    "remittance",
+    "insurance",
+    "invest",
+    "investment",
+    "investments",
+    "wealth",
+    "fund",
+    "funds",
+    "stock",
+    "stocks",
+    "securities",
+    "fx",
+    "currency",
+    "exchange",
+    "premier",
+    "jade",
+    "savings",
+    "saving",
+    "cheque",
+    "atm",
+    "branch",
+    "branches",
+    "app",
+    "online",
+    "pin",
+    "password",
+    "login",
+    "statement",
+    "balance",
+    "reward",
+    "rewards",
+    "cashback",
+    "overdraft",
+    "tax",
+    "mpf",
+    "retirement",
+    "open",
+    "opening",
+    "apply",
+    "application",
+    "customer",
+    "service",
+    "hotline",
+}
+
+# topics that are clearly outside of the HSBC Hongkong customer service scope
+OFF_TOPIC_TERMS = {
+    "weather",
+    "recipe",
+    "recipes",
+    "cook",
+    "cooking",
+    "football",
+    "soccer",
+    "basketball",
+    "movie",
+    "movies",
+    "film",
+    "song",
+    "songs",
+    "music",
+    "poem",
+    "joke",
+    "jokes",
+    "game",
+    "games",
+    "celebrity",
+    "president",
+    "election",
+    "homework",
+    "math",
+    "translate",
+    "horoscope",
+    "restaurant",
+}
+
+# other banks; questions about their products are out of scope even if they are about banking
+OTHER_BANK_TERMS = {
+    "citi",
+    "citibank",
+    "seng",
+    "chartered",
+    "boc",
+    "dbs",
+    "barclays",
+    "jpmorgan",
+}
+
+# words that refer back to the previous turns; those turns need the agent memory
+FOLLOW_UP_TERMS = {
+    "it",
+    "that",
+    "this",
+    "those",
+    "these",
+    "them",
+    "they",
+    "above",
+    "previous",
+}
+
+# canned small talk responses
+GREETING_RESPONSES = {
+    "hello": "Hello, how can I help you with HSBC Hongkong products and services today?",
+    "thanks": "You're welcome. Is there anything else related to HSBC Hongkong that I can help you with?",
+    "goodbye": "Thank you for contacting HSBC Hongkong. Goodbye and have a nice day.",
+}
+
+QUESTION_WORDS = {
+    "what",
+    "how",
+    "where",
+    "when",
+    "which",
+    "who",
+    "can",
+    "could",
+    "do",
+    "does",
+    "is",
+    "are",
+    "should",
+    "why",
+}
+
+
+@dataclass
+class IntentResult:
+    route: str
+    domain_score: int
+    off_topic_score: int
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase and split utterance into words.
+    :param text: utterance to tokenize
+    :returns: list of words
+    """
+    return WORD_PATTERN.findall(text.lower())
+
+
+def classify_intent(text: str, max_greeting_words: int = 6) -> IntentResult:
+    """Classify an utterance into one of the routes with a keyword model.
+    :param text: utterance from the transcriber
+    :param max_greeting_words: longest utterance still treated as small talk
+    :returns: IntentResult with the chosen route and keyword scores
+    """
+    words = tokenize(text)
+    domain_score = sum(1 for w in words if w in DOMAIN_TERMS)
+    off_topic_score = sum(1 for w in words if w in OFF_TOPIC_TERMS)
+    other_bank_score = sum(1 for w in words if w in OTHER_BANK_TERMS)
+
+    # empty transcript or anything we cannot judge goes to the agent
+    if not words:
+        return IntentResult(AGENT_ROUTE, domain_score, off_topic_score)
+
+    # pure small talk, e.g. "hi there", "thank you very much", but not "is it good"
+    if (
+        len(words) <= max_greeting_words
+        and any(w in GREETING_WORDS for w in words)
+        and all(w in GREETING_WORDS or w in SMALL_TALK_WORDS for w in words)
+    ):
+        return IntentResult(GREETING_ROUTE, domain_score, off_topic_score)
+
+    # off topic and nothing about HSBC products, or about another bank
+    if "hsbc" not in words and (
+        other_bank_score > 0
+        or (off_topic_score > 0 and off_topic_score >= domain_score)
+    ):
+        return IntentResult(REJECT_ROUTE, domain_score, off_topic_score)
+
+    # direct, self-contained question about HSBC products; a question referring back to
+    # earlier turns, e.g. "what is the interest rate on it?", needs the agent memory
+    is_follow_up = any(w in FOLLOW_UP_TERMS for w in words)
+    is_question = words[0] in QUESTION_WORDS or text.strip().endswith("?")
+    if domain_score >= 2 and is_question and not is_follow_up:
+        return IntentResult(KNOWLEDGE_ROUTE, domain_score, off_topic_score)
+
+    return IntentResult(AGENT_ROUTE, domain_score, off_topic_score)
+
+
+def greeting_response(text: str) -> str:
+    """Canned response for small talk, no LLM call is needed.
+    :param text: utterance classified as greeting
+    :returns: response text
+    """
+    words = set(tokenize(text))
+    if words & GOODBYE_WORDS:
+        return GREETING_RESPONSES["goodbye"]
+    if words & THANKS_WORDS:
+        return GREETING_RESPONSES["thanks"]
+    return GREETING_RESPONSES["hello"]
+
+
+class IntentRouter:
+    """Classifies utterances and keeps per-route latency statistics."""
+
+    def __init__(self, max_samples: int = 1000):
+        self.max_samples = max_samples
+        self._latencies = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self._lock = threading.Lock()
+
+    def classify(self, text: str) -> str:
+        """Return the route name for an utterance.
+        :param text: utterance from the transcriber
+        :returns: route name
+        """
+        return classify_intent(text).route
+
+    def record_latency(self, route: str, seconds: float) -> None:
+        """Record how long a turn took on a route.
+        :param route: route name
+        :param seconds: elapsed seconds for the turn
+        """
+        with self._lock:
+            self._latencies[route].append(seconds)
+
+    def latency_summary(self) -> dict[str, dict[str, float]]:
+        """Per-route count, mean, p50 and p95 latency in seconds."""
+        summary = {}
+        with self._lock:
+            items = {route: list(samples) for route, samples in self._latencies.items()}
+        for route, samples in items.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            summary[route] = {
+                "count": len(ordered),
+                "mean": statistics.fmean(ordered),
+                "p50": ordered[int(0.50 * (len(ordered) - 1))],
+                "p95": ordered[int(0.95 * (len(ordered) - 1))],
+            }
+        return summary
@@ -0,0 +1,112 @@
+""" Incremental decoding of the items of a JSON array in a streamed response.
+
+RKD returns headlines and stories as a JSON array ("HL") nested in a few
+wrapper objects. Instead of decoding the whole body into one string and then
+one object tree, iter_json_array_items decodes the body chunk by chunk, skips
+to the array and yields its items one at a time, so that memory holds one item
+and one chunk and the first item can be processed before the download ends.
+"""
+import codecs
+import json
+import re
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+WHITESPACE = re.compile(r"[\s,]*")
+
+
+class JSONArrayNotFound(KeyError):
+    """The streamed document has no array under the key."""
+
+
+def iter_json_array_items(
+    chunks: Iterable[bytes],
+    key: str,
+    parse_int: Optional[Callable[[str], Any]] = None,
+    parse_float: Optional[Callable[[str], Any]] = None,
+    on_skipped: Optional[Callable[[str], None]] = None,
+) -> Iterator[Any]:
+    """
+    Yield the items of the first JSON array under key in a streamed document.
+
+    The key is located by its first occurrence followed by ':' and '[', so it
+    must not appear with an array value earlier in the document, e.g. in a string.
+
+    :param chunks: The document as bytes chunks, e.g. response.iter_content().
+    :param key: Name of the member holding the array, e.g. HL.
+    :param parse_int: Called with the text of every JSON int, as in json.loads.
+    :param parse_float: Called with the text of every JSON float, as in json.loads.
+    :param on_skipped: Called with the document text before the array once the array is found, before its
+        first item, and with the text after the array once the document ends, e.g. to read a status.
+    :returns: Iterator of the decoded array items.
+    :raises JSONArrayNotFound: when the document has no such array.
+    """
+    decoder = json.JSONDecoder(parse_int=parse_int, parse_float=parse_float)
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    array_start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+    chunks = iter(chunks)
+    buffer = ""
+    skipped = []
+    finished = False
+
+    def read() -> bool:
+        nonlocal buffer, finished
+        for chunk in chunks:
+            if chunk:
+                buffer += text_decoder.decode(chunk)
+                return True
+        buffer += text_decoder.decode(b"", final=True)
+        finished = True
+        return False
+
+    # skip to the array; keep the tail in case the key is split across chunks
+    keep = len(key) + 64
+    while True:
+        match = array_start.search(buffer)
+        if match:
+            skipped.append(buffer[: match.start()])
+            buffer = buffer[match.end() :]
+            if on_skipped:
+                on_skipped("".join(skipped))
+            break
+        if finished:
+            if on_skipped:
+                on_skipped("".join(skipped) + buffer)
+            raise JSONArrayNotFound(key)
+        if len(buffer) > keep:
+            skipped.append(buffer[:-keep])
+            buffer = buffer[-keep:]
+        read()
+
+    # a failed decode is only retried once the buffer has doubled, so that a
+    # large item arriving in many chunks is decoded a logarithmic number of times
+    retry_at = 0
+    while True:
+        position = WHITESPACE.match(buffer).end()
+        if position == len(buffer) or len(buffer) < retry_at:
+            if not read():
+                if position == len(buffer):
+                    raise json.JSONDecodeError("Unterminated array", buffer, position)
+                retry_at = 0
+            continue
+        if buffer[position] == "]":
+            break
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if finished:
+                raise
+            retry_at = 2 * len(buffer)
+            continue
+        # a number at the end of the buffer may continue in the next chunk
+        if end == len(buffer) and buffer[position] not in '{["' and not finished:
+            retry_at = len(buffer) + 1
+            continue
+        buffer = buffer[end:]
+        retry_at = 0
+        yield item
+
+    if on_skipped:
+        buffer = buffer[position + 1 :]
+        while read():
+            pass
+        on_skipped(buffer)
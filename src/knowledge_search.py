@@ -0,0 +1,237 @@
+""" Answer context of the hsbc knowledge search tool.
+
+The scraping DAG stores the knowledge of every page of the HSBC website as a
+page row in hsbc_homepage_content and as chunks with their own embeddings in
+hsbc_homepage_chunk. The tool retrieves the chunks nearest to a question and
+groups them by page, so that the agent gets a few precise passages within a
+token budget instead of a whole page summary.
+
+KnowledgeSearch wraps the lookup (embedding request and pgvector query) with
+a short-lived result cache keyed by the normalised query, and coalesces
+identical queries in flight, from threads or coroutines, into one lookup.
+A caller that is cancelled, e.g. by a barge-in, does not cancel a lookup that
+other callers wait for.
+Failures are classified by classify_error for logging and metrics.
+"""
+import asyncio
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Iterable, Optional, Tuple
+
+import openai
+import psycopg2
+
+from src.metrics import metrics
+from src.tokens import count_tokens
+
+KNOWLEDGE_SEARCHES = metrics.counter(
+    "vocode_hsbc_knowledge_searches_total",
+    "Knowledge searches by result: cache hit, coalesced with a search in flight, or lookup",
+    ("result",),
+)
+KNOWLEDGE_SEARCH_ERRORS = metrics.counter(
+    "vocode_hsbc_knowledge_search_errors_total",
+    "Failed knowledge searches by kind of error",
+    ("kind",),
+)
+
+WHITESPACE = re.compile(r"\s+")
+TRAILING_PUNCTUATION = re.compile(r"[\s?!.,;:]+$")
+QUERY_WORD = re.compile(r"[a-z0-9$%']+")
+# words of the question form that do not change what is looked up
+QUERY_STOP_WORDS = {
+    "a",
+    "about",
+    "an",
+    "and",
+    "any",
+    "are",
+    "can",
+    "could",
+    "do",
+    "does",
+    "for",
+    "how",
+    "i",
+    "in",
+    "is",
+    "me",
+    "my",
+    "of",
+    "on",
+    "please",
+    "tell",
+    "the",
+    "to",
+    "what",
+    "whats",
+    "which",
+    "with",
+    "you",
+}
+
+
+class KnowledgeNotFound(LookupError):
+    """The knowledge tables have no row for the query."""
+
+
+def classify_error(error: BaseException) -> str:
+    """Kind of a knowledge search failure: not_found, timeout, embedding_rate_limited, embedding,
+    database_connection, database_query or unexpected."""
+    if isinstance(error, KnowledgeNotFound):
+        return "not_found"
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, openai.error.Timeout)):
+        return "timeout"
+    if isinstance(error, openai.error.RateLimitError):
+        return "embedding_rate_limited"
+    if isinstance(error, openai.error.OpenAIError):
+        return "embedding"
+    if isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+        return "database_connection"
+    if isinstance(error, psycopg2.Error):
+        return "database_query"
+    return "unexpected"
+
+
+def normalise_query(query: str) -> str:
+    """Cache key of a query: case, whitespace and trailing punctuation do not change the answer."""
+    return TRAILING_PUNCTUATION.sub("", WHITESPACE.sub(" ", query).strip().lower())
+
+
+def query_similarity(query: str, other: str) -> float:
+    """Share of the content words two queries have in common, 1.0 for the same normalised query."""
+    query, other = normalise_query(query), normalise_query(other)
+    if query == other:
+        return 1.0
+    words, other_words = (
+        set(QUERY_WORD.findall(q)) - QUERY_STOP_WORDS for q in (query, other)
+    )
+    if not words or not other_words:
+        return 0.0
+    return len(words & other_words) / len(words | other_words)
+
+
+class KnowledgeSearch:
+    """Knowledge lookups with a TTL result cache and single-flight coalescing of identical queries."""
+
+    def __init__(
+        self,
+        lookup: Callable[[str], str],
+        alookup: Callable[[str], Awaitable[str]],
+        ttl_seconds: float = 300.0,
+        max_entries: int = 1024,
+    ):
+        """
+        :param lookup: answer context of a query, raises on failure
+        :param alookup: async version of lookup
+        :param ttl_seconds: how long an answer is reused, 0 disables the cache
+        :param max_entries: cached answers, least recently used are dropped first
+        """
+        self.lookup = lookup
+        self.alookup = alookup
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.cache: OrderedDict[str, Tuple[float, str]] = OrderedDict()
+        self.in_flight: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: str) -> Tuple[Optional[str], Future, bool]:
+        """Cached answer, or the future of the lookup in flight and whether the caller has to run it."""
+        with self._lock:
+            entry = self.cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.cache.move_to_end(key)
+                KNOWLEDGE_SEARCHES.inc(1, "hit")
+                return entry[1], None, False
+            if key in self.in_flight:
+                KNOWLEDGE_SEARCHES.inc(1, "coalesced")
+                return None, self.in_flight[key], False
+            future = self.in_flight[key] = Future()
+            KNOWLEDGE_SEARCHES.inc(1, "lookup")
+            return None, future, True
+
+    def _finish(
+        self,
+        key: str,
+        future: Future,
+        result: Optional[str],
+        error: Optional[BaseException],
+    ) -> None:
+        if error is not None and not isinstance(error, Exception):
+            # waiters catch Exception; an interrupted lookup must not cancel or kill their turns
+            error = TimeoutError(f"knowledge lookup was interrupted: {error!r}")
+        with self._lock:
+            self.in_flight.pop(key, None)
+            # failures are not cached, the next search retries
+            if error is None and self.ttl_seconds > 0:
+                self.cache[key] = (time.monotonic() + self.ttl_seconds, result)
+                self.cache.move_to_end(key)
+                while len(self.cache) > self.max_entries:
+                    self.cache.popitem(last=False)
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def search(self, query: str) -> str:
+        """Answer context of a query, from the cache, a lookup in flight or a new lookup."""
+        key = normalise_query(query)
+        cached, future, leader = self._join(key)
+        if cached is not None:
+            return cached
+        if not leader:
+            return future.result()
+        try:
+            result = self.lookup(query)
+        except BaseException as e:
+            self._finish(key, future, None, e)
+            raise
+        self._finish(key, future, result, None)
+        return result
+
+    async def asearch(self, query: str) -> str:
+        """Async version of search; coalesces with searches in flight in other threads and coroutines."""
+        key = normalise_query(query)
+        cached, future, leader = self._join(key)
+        if cached is not None:
+            return cached
+        if not leader:
+            # shielded, a cancelled waiter would otherwise cancel the shared future
+            return await asyncio.shield(asyncio.wrap_future(future))
+        lookup = asyncio.ensure_future(self._alookup(key, future, query))
+        # the lookup is not cancelled with the leader, it finishes for the waiters
+        lookup.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return await asyncio.shield(lookup)
+
+    async def _alookup(self, key: str, future: Future, query: str) -> str:
+        try:
+            result = await self.alookup(query)
+        except BaseException as e:
+            self._finish(key, future, None, e)
+            raise
+        self._finish(key, future, result, None)
+        return result
+
+
+def group_chunks(
+    rows: Iterable[Tuple[str, int, str]], max_tokens: Optional[int] = None
+) -> str:
+    """
+    Answer context of the nearest chunks.
+    :param rows: (page url, chunk index, content) nearest first
+    :param max_tokens: the nearest chunks are kept until this budget, at least one chunk
+    :returns: the chunks of each page in page order, pages by their nearest chunk
+    """
+    pages: dict[str, list[Tuple[int, str]]] = {}
+    tokens = 0
+    for url, chunk_index, content in rows:
+        tokens += count_tokens(content)
+        if pages and max_tokens is not None and tokens > max_tokens:
+            break
+        pages.setdefault(url, []).append((chunk_index, content))
+    return "\n\n".join(
+        "\n".join(content for _, content in sorted(chunks)) for chunks in pages.values()
+    )
@@ -4,7 +4,11 @@ from langchain.prompts import PromptTemplate
 
 
 def summarise_articles(
-    chat_llm, text_splitter, article_headlines: list[str], article_texts: list[str]
+    chat_llm,
+    text_splitter,
+    article_headlines: list[str],
+    article_texts: list[str],
+    first_index: int = 1,
 ) -> str:
     """Enriches news articles and texts with langchain stuff chain.
     Splits the text into chunks and summarises each chunk.
@@ -12,6 +16,7 @@ def summarise_articles(
     :param text_splitter: TextSplitter object
     :param article_headlines: List of article headlines
     :param article_texts: List of article texts
+    :param first_index: Number of the first article, when articles are summarised in pages
     :returns: A string containing the summarised articles.
     """
 
@@ -25,7 +30,7 @@ def summarise_articles(
 
     # build prompt template
     summary_prompt = """
-    Provided a news article headline and the news article body text in html format \
+    Provided a news article headline and the news article body text \
     enrich the headline with the body text and return the enriched headline which \
     should be no more than three sentences long. The enriched headline should \
     contain all the key information from the body text.
@@ -48,7 +53,7 @@ def summarise_articles(
     for idx, text in enumerate(enriched_headlines):
         # check if text is a string; if not then skip
         if not isinstance(text, str):
-            return_txt = f"Article: {idx+1}: No article text found"
+            return_txt = f"Article: {idx + first_index}: No article text found"
             final_news_text += return_txt
             continue
 
@@ -60,13 +65,15 @@ def summarise_articles(
         try:
             summarised_doc = summary_chain.run(txt_docs)
         except Exception as e:
-            return_txt = f"Article: {idx+1}: Error in summarising article: {e}"
+            return_txt = (
+                f"Article: {idx + first_index}: Error in summarising article: {e}"
+            )
             final_news_text += return_txt
             continue
 
         # add summarised doc to final news text
-        summarised_doc = summarised_doc.replace("$", "\$")
-        summarised_doc = f"Article {idx+1} {summarised_doc}\n\n"
+        summarised_doc = summarised_doc.replace("$", "\\$")
+        summarised_doc = f"Article {idx + first_index} {summarised_doc}\n\n"
         final_news_text += summarised_doc
 
     return final_news_text
@@ -99,5 +106,5 @@ def produce_meta_summary(chat_llm, text_splitter, text: str):
     article_docs = [Document(page_content=txt) for txt in article_split]
 
     meta_summary = summary_chain.run(article_docs)
-    meta_summary = meta_summary.replace("$", "\$")
+    meta_summary = meta_summary.replace("$", "\\$")
     return meta_summary
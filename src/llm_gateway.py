@@ -0,0 +1,429 @@
+""" LLM gateway over several Azure OpenAI deployments.
+
+Requests go to the fastest healthy deployment. If a request is still running
+after the hedge delay (a latency percentile observed for that deployment), a
+duplicate request is sent to the next deployment and the first answer wins.
+Deployments that return 429 are skipped until their cool-down ends, failed
+requests fail over to the next deployment, and all calls of a voice turn share
+the turn's deadline.
+
+GatewayChatModel and GatewayLLM expose the gateway as langchain models and
+record the token usage of every request, see src.usage.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Mapping, Optional, TypeVar
+
+import openai
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.chat_models.base import BaseChatModel
+from langchain.llms.base import BaseLLM
+from langchain.schema import BaseMessage, ChatResult, LLMResult
+
+from src.tokens import count_message_tokens, count_tokens
+from src.usage import current_feature, current_owner, record_llm_output
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# errors worth retrying on another deployment; anything else (e.g. invalid request) is raised
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.Timeout,
+    openai.error.APIError,
+    openai.error.APIConnectionError,
+    openai.error.ServiceUnavailableError,
+    TimeoutError,
+)
+
+# absolute time.monotonic() deadline of the current voice turn
+request_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "request_deadline", default=None
+)
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """All gateway calls in this context must finish within `seconds` from now."""
+    if seconds is None:
+        yield
+        return
+    token = request_deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        request_deadline.reset(token)
+
+
+class LLMGatewayTimeout(TimeoutError):
+    pass
+
+
+class Deployment:
+    """One deployment with its recent latencies and health."""
+
+    def __init__(self, name: str, client: Any, latency_window: int = 200):
+        """
+        :param name: deployment name used in logs and stats, e.g. the region
+        :param client: langchain model or client passed to the gateway call function
+        :param latency_window: number of recent successful calls to keep latencies of
+        """
+        self.name = name
+        self.client = client
+        self.latencies: deque[float] = deque(maxlen=latency_window)
+        self.throttled_until = 0.0
+        self.consecutive_errors = 0
+        self.requests = 0
+        self.errors = 0
+        self.throttles = 0
+        self._lock = threading.Lock()
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.throttled_until
+
+    def latency_percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            ordered = sorted(self.latencies)
+        if not ordered:
+            return None
+        return ordered[min(int(q / 100 * len(ordered)), len(ordered) - 1)]
+
+    def record_success(self, elapsed: float) -> None:
+        with self._lock:
+            self.requests += 1
+            self.latencies.append(elapsed)
+            self.consecutive_errors = 0
+
+    def record_failure(
+        self, error: Exception, throttle_seconds: float, error_cooldown_seconds: float
+    ) -> None:
+        with self._lock:
+            self.requests += 1
+            self.errors += 1
+            self.consecutive_errors += 1
+            if isinstance(error, openai.error.RateLimitError):
+                self.throttles += 1
+                retry_after = (getattr(error, "headers", None) or {}).get("retry-after")
+                cooldown = float(retry_after) if retry_after else throttle_seconds
+                self.throttled_until = time.monotonic() + cooldown
+            elif self.consecutive_errors >= 3:
+                # keep failing deployments out of rotation for a while
+                self.throttled_until = time.monotonic() + error_cooldown_seconds
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "throttles": self.throttles,
+            "p50": self.latency_percentile(50),
+            "p95": self.latency_percentile(95),
+            "available": self.is_available(time.monotonic()),
+        }
+
+
+class LLMGateway:
+    def __init__(
+        self,
+        deployments: List[Deployment],
+        hedge_percentile: float = 90,
+        initial_hedge_delay: float = 3.0,
+        min_hedge_delay: float = 0.2,
+        min_samples: int = 20,
+        max_hedges: int = 1,
+        timeout: float = 30.0,
+        throttle_seconds: float = 10.0,
+        error_cooldown_seconds: float = 30.0,
+        max_workers: int = 16,
+    ):
+        """
+        :param deployments: deployments in order of preference
+        :param hedge_percentile: latency percentile of a deployment after which a hedged request is sent
+        :param initial_hedge_delay: hedge delay until a deployment has `min_samples` latencies
+        :param min_hedge_delay: lower bound of the hedge delay
+        :param max_hedges: number of duplicate requests per call, 0 disables hedging
+        :param timeout: deadline of a call made outside a voice turn
+        :param throttle_seconds: cool-down after a 429 without retry-after header
+        :param error_cooldown_seconds: cool-down after three consecutive errors
+        """
+        if not deployments:
+            raise ValueError("LLMGateway needs at least one deployment")
+        self.deployments = deployments
+        self.hedge_percentile = hedge_percentile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.min_samples = min_samples
+        self.max_hedges = max_hedges
+        self.timeout = timeout
+        self.throttle_seconds = throttle_seconds
+        self.error_cooldown_seconds = error_cooldown_seconds
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="llm-gateway"
+        )
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def ranked_deployments(self) -> List[Deployment]:
+        """Available deployments, fastest first; all of them if none is available."""
+        now = time.monotonic()
+        available = [d for d in self.deployments if d.is_available(now)]
+        if not available:
+            return sorted(self.deployments, key=lambda d: d.throttled_until)
+
+        def rank(d: Deployment):
+            p50 = d.latency_percentile(50)
+            return (d.consecutive_errors, p50 if p50 is not None else 0.0)
+
+        return sorted(available, key=rank)
+
+    def hedge_delay(self, deployment: Deployment) -> float:
+        if len(deployment.latencies) < self.min_samples:
+            return self.initial_hedge_delay
+        return max(
+            deployment.latency_percentile(self.hedge_percentile), self.min_hedge_delay
+        )
+
+    def _run(self, deployment: Deployment, fn: Callable[[Any], T]) -> T:
+        start = time.perf_counter()
+        try:
+            result = fn(deployment.client)
+        except Exception as e:
+            deployment.record_failure(
+                e, self.throttle_seconds, self.error_cooldown_seconds
+            )
+            raise
+        deployment.record_success(time.perf_counter() - start)
+        return result
+
+    def call(self, fn: Callable[[Any], T], timeout: Optional[float] = None) -> T:
+        """
+        Call `fn` with the client of a deployment, hedging and failing over as needed.
+        :param fn: function that makes the request with a deployment's client
+        :param timeout: seconds for this call, bounded by the deadline of the current turn
+        :returns: result of the first successful request
+        """
+        now = time.monotonic()
+        call_deadline = now + (timeout or self.timeout)
+        turn_deadline = request_deadline.get()
+        if turn_deadline is not None:
+            call_deadline = min(call_deadline, turn_deadline)
+
+        candidates = self.ranked_deployments()
+        # a hedge or retry to the same deployment doubles the cost without avoiding a slow or
+        # throttled region, and spends the turn deadline on it
+        max_hedges = self.max_hedges if len(candidates) > 1 else 0
+        max_attempts = len(candidates) + max_hedges
+        pending: dict[Future, Deployment] = {}
+        attempts = 0
+        hedges_left = max_hedges
+        last_error: Optional[Exception] = None
+
+        def launch() -> Future:
+            nonlocal attempts
+            deployment = candidates[attempts % len(candidates)]
+            attempts += 1
+            future = self.executor.submit(self._run, deployment, fn)
+            pending[future] = deployment
+            return future
+
+        primary = launch()
+        hedge_at = now + self.hedge_delay(pending[primary])
+        while pending:
+            now = time.monotonic()
+            if now >= call_deadline:
+                break
+            wait_until = (
+                min(call_deadline, hedge_at)
+                if hedges_left and now < hedge_at
+                else call_deadline
+            )
+            done, _ = wait(
+                pending, timeout=max(wait_until - now, 0), return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                deployment = pending.pop(future)
+                try:
+                    result = future.result()
+                except RETRYABLE_ERRORS as e:
+                    logger.warning(f"LLM deployment {deployment.name} failed: {e!r}")
+                    last_error = e
+                    continue
+                if hedges_left < max_hedges and future is not primary:
+                    self.hedge_wins += 1
+                # requests still running are left to finish; their latency is still recorded
+                return result
+            if not pending and attempts < max_attempts:
+                # fail over to the next deployment
+                launch()
+            elif (
+                pending
+                and hedges_left
+                and time.monotonic() >= hedge_at
+                and attempts < max_attempts
+            ):
+                hedged = launch()
+                hedges_left -= 1
+                self.hedges += 1
+                logger.debug(f"Hedged LLM request to deployment {pending[hedged].name}")
+
+        if pending or time.monotonic() >= call_deadline:
+            raise LLMGatewayTimeout(
+                "LLM request did not finish before the deadline"
+            ) from last_error
+        raise last_error
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "deployments": {d.name: d.stats() for d in self.deployments},
+        }
+
+
+class GatewayChatModel(BaseChatModel):
+    """Chat model that sends every request through an LLMGateway of chat models."""
+
+    gateway: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return "llm-gateway-chat"
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        feature, owner = current_feature.get(), current_owner.get()
+
+        def generate(llm) -> ChatResult:
+            result = llm._generate(messages, stop=stop, **kwargs)
+            # every request is billed, including hedged duplicates that lose the race
+            record_llm_output(
+                result.llm_output,
+                getattr(llm, "model_name", "unknown"),
+                lambda: (
+                    count_message_tokens(messages),
+                    sum(
+                        count_tokens(generation.text)
+                        for generation in result.generations
+                    ),
+                ),
+                feature,
+                owner,
+            )
+            return result
+
+        return self.gateway.call(generate)
+
+    async def _agenerate(
+        self, messages, stop=None, run_manager=None, **kwargs
+    ) -> ChatResult:
+        # the sync path in a thread, with the deadline and usage context of the caller
+        return await asyncio.get_running_loop().run_in_executor(
+            None,
+            contextvars.copy_context().run,
+            functools.partial(self._generate, messages, stop, **kwargs),
+        )
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        return {"deployments": [d.name for d in self.gateway.deployments]}
+
+
+class GatewayLLM(BaseLLM):
+    """Completion model that sends every request through an LLMGateway of completion models."""
+
+    gateway: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return "llm-gateway"
+
+    def _generate(
+        self,
+        prompts: List[str],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> LLMResult:
+        feature, owner = current_feature.get(), current_owner.get()
+
+        def generate(llm) -> LLMResult:
+            result = llm._generate(prompts, stop=stop, **kwargs)
+            record_llm_output(
+                result.llm_output,
+                getattr(llm, "model_name", "unknown"),
+                lambda: (
+                    sum(count_tokens(prompt) for prompt in prompts),
+                    sum(
+                        count_tokens(g.text)
+                        for generations in result.generations
+                        for g in generations
+                    ),
+                ),
+                feature,
+                owner,
+            )
+            return result
+
+        return self.gateway.call(generate)
+
+    async def _agenerate(
+        self, prompts, stop=None, run_manager=None, **kwargs
+    ) -> LLMResult:
+        # the sync path in a thread, with the deadline and usage context of the caller
+        return await asyncio.get_running_loop().run_in_executor(
+            None,
+            contextvars.copy_context().run,
+            functools.partial(self._generate, prompts, stop, **kwargs),
+        )
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        return {"deployments": [d.name for d in self.gateway.deployments]}
+
+
+def azure_regions_from_env() -> List[dict[str, str]]:
+    """
+    Azure OpenAI resources to spread requests over. AZURE_OPENAI_REGIONS is a json list of
+    {"name": ..., "api_base": ..., "api_key": ...}; the default is the single AZURE_OPENAI_API_BASE resource.
+    """
+    regions = os.getenv("AZURE_OPENAI_REGIONS")
+    if regions:
+        return json.loads(regions)
+    return [
+        {
+            "name": "default",
+            "api_base": os.getenv("AZURE_OPENAI_API_BASE"),
+            "api_key": os.getenv("AZURE_OPENAI_API_KEY"),
+        }
+    ]
+
+
+def create_gateway(create_client: Callable[[dict], Any], **kwargs) -> LLMGateway:
+    """Create a gateway with one deployment per Azure region.
+    :param create_client: builds the langchain model of a region
+    :param kwargs: LLMGateway settings, overriding LLM_HEDGE_PERCENTILE and LLM_MAX_HEDGES
+    """
+    settings = {
+        "hedge_percentile": float(os.getenv("LLM_HEDGE_PERCENTILE", "90")),
+        "max_hedges": int(os.getenv("LLM_MAX_HEDGES", "1")),
+    }
+    settings.update(kwargs)
+    deployments = [
+        Deployment(region["name"], create_client(region))
+        for region in azure_regions_from_env()
+    ]
+    return LLMGateway(deployments, **settings)
@@ -0,0 +1,354 @@
+""" Per-turn latency spans and Prometheus histograms.
+
+Every span is recorded in a latency histogram labelled by span name and, if a
+turn is being traced, appended to the trace of that turn. Turn traces carry the
+conversation_id and are logged when the turn ends, so a slow turn in the
+histograms can be looked up in the logs or at the recent turns endpoint. The
+conversation_id is not a metric label to keep the number of series bounded.
+
+Metrics are rendered in the Prometheus text format without extra dependencies.
+With several worker processes, as in prometheus_client multiprocess mode, every
+worker writes its metrics to a shared directory and /metrics on any worker
+renders the sum over all workers, see MetricsRegistry.share.
+"""
+import bisect
+import contextvars
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# latency buckets in seconds, from a cache hit to a slow ReAct loop
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(
+    labelnames: Sequence[str], labelvalues: Sequence[str], extra: str = ""
+) -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets per combination of label values."""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [bucket counts..., +Inf count], sum
+        self.counts: dict[tuple, list[int]] = {}
+        self.sums: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self.counts.get(labelvalues)
+            if counts is None:
+                counts = self.counts[labelvalues] = [0] * (len(self.buckets) + 1)
+                self.sums[labelvalues] = 0.0
+            counts[index] += 1
+            self.sums[labelvalues] += value
+
+    def snapshot(self) -> dict:
+        """Values of all series, json serialisable, see merge."""
+        with self._lock:
+            series = [
+                [list(labels), list(counts), self.sums[labels]]
+                for labels, counts in self.counts.items()
+            ]
+        return {
+            "type": "histogram",
+            "documentation": self.documentation,
+            "labelnames": list(self.labelnames),
+            "buckets": list(self.buckets),
+            "series": series,
+        }
+
+    def merge(self, snapshot: dict) -> None:
+        """Add the values of a snapshot, e.g. of another worker."""
+        with self._lock:
+            for labels, counts, total in snapshot["series"]:
+                labels = tuple(labels)
+                current = self.counts.setdefault(labels, [0] * len(counts))
+                self.counts[labels] = [a + b for a, b in zip(current, counts)]
+                self.sums[labels] = self.sums.get(labels, 0.0) + total
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = [
+                (labels, list(counts), self.sums[labels])
+                for labels, counts in self.counts.items()
+            ]
+        for labelvalues, counts, total in sorted(series):
+            cumulative = 0
+            for bound, count in zip([*self.buckets, "+Inf"], counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}"
+                )
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter per combination of label values."""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *labelvalues: str) -> None:
+        with self._lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0.0) + amount
+
+    def value(self, *labelvalues: str) -> float:
+        with self._lock:
+            return self.values.get(labelvalues, 0.0)
+
+    def snapshot(self) -> dict:
+        """Values of all series, json serialisable, see merge."""
+        with self._lock:
+            series = [[list(labels), value] for labels, value in self.values.items()]
+        return {
+            "type": "counter",
+            "documentation": self.documentation,
+            "labelnames": list(self.labelnames),
+            "series": series,
+        }
+
+    def merge(self, snapshot: dict) -> None:
+        """Add the values of a snapshot, e.g. of another worker."""
+        with self._lock:
+            for labels, value in snapshot["series"]:
+                labels = tuple(labels)
+                self.values[labels] = self.values.get(labels, 0.0) + value
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        with self._lock:
+            series = sorted(self.values.items())
+        for labelvalues, value in series:
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}"
+            )
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.collectors: dict[str, Histogram | Counter] = {}
+        # directory shared by the worker processes, see share
+        self.directory: Optional[str] = None
+        self.worker = str(os.getpid())
+        self._stop_sharing = threading.Event()
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        """Return the histogram with this name, creating it on first use."""
+        if name not in self.collectors:
+            self.collectors[name] = Histogram(name, documentation, labelnames, buckets)
+        return self.collectors[name]
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> Counter:
+        """Return the counter with this name, creating it on first use."""
+        if name not in self.collectors:
+            self.collectors[name] = Counter(name, documentation, labelnames)
+        return self.collectors[name]
+
+    def share(
+        self, directory: str, interval: float = 5.0, worker: Optional[str] = None
+    ) -> None:
+        """Share the metrics with the other worker processes through a directory.
+        The metrics of this worker are written to the directory every interval seconds
+        and when rendered; render then sums the metrics of all workers, so any worker can
+        be scraped. Files of stopped workers are kept so that counters never go down;
+        clear the directory before the workers start, as start.sh does.
+        :param directory: directory shared by the workers, e.g. PROMETHEUS_MULTIPROC_DIR
+        :param interval: seconds between writes; metrics of other workers are at most this old
+        :param worker: name of the metrics file of this worker, the process id by default
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.worker = worker or self.worker
+        self.write_snapshot()
+
+        def write_periodically():
+            while not self._stop_sharing.wait(interval):
+                self.write_snapshot()
+
+        threading.Thread(
+            target=write_periodically, name="metrics-share", daemon=True
+        ).start()
+
+    def write_snapshot(self) -> None:
+        """Write the metrics of this worker to the shared directory, atomically."""
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f"metrics-{self.worker}.json")
+        snapshot = {name: c.snapshot() for name, c in list(self.collectors.items())}
+        try:
+            with open(path + ".tmp", "w") as f:
+                json.dump(snapshot, f)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics to {path}: {e}")
+
+    def merged(self) -> "MetricsRegistry":
+        """Sum of the metrics written to the shared directory by all workers."""
+        merged = MetricsRegistry()
+        for path in sorted(glob.glob(os.path.join(self.directory, "metrics-*.json"))):
+            try:
+                with open(path) as f:
+                    snapshots = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not read metrics from {path}: {e}")
+                continue
+            for name, snapshot in snapshots.items():
+                if snapshot["type"] == "histogram":
+                    collector = merged.histogram(
+                        name,
+                        snapshot["documentation"],
+                        snapshot["labelnames"],
+                        snapshot["buckets"],
+                    )
+                else:
+                    collector = merged.counter(
+                        name, snapshot["documentation"], snapshot["labelnames"]
+                    )
+                collector.merge(snapshot)
+        return merged
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format, of all workers when shared."""
+        collectors = self.collectors
+        if self.directory:
+            self.write_snapshot()
+            collectors = self.merged().collectors
+        lines = []
+        for collector in collectors.values():
+            lines += collector.render()
+        return "\n".join(lines) + "\n"
+
+
+@dataclass
+class TurnTrace:
+    conversation_id: Optional[str]
+    started_at: float = field(default_factory=time.time)
+    perf_start: float = field(default_factory=time.perf_counter)
+    duration: float = 0.0
+    # (span name, start offset in seconds from the turn start, duration in seconds)
+    spans: list[tuple[str, float, float]] = field(default_factory=list)
+
+
+# metrics shared by the whole worker
+metrics = MetricsRegistry()
+SPAN_SECONDS = metrics.histogram(
+    "vocode_hsbc_span_seconds", "Latency of the steps of a conversation turn", ("span",)
+)
+TURN_SECONDS = metrics.histogram(
+    "vocode_hsbc_turn_seconds", "Latency of a conversation turn"
+)
+
+# trace of the turn the current task or thread is working on
+current_turn: contextvars.ContextVar[Optional[TurnTrace]] = contextvars.ContextVar(
+    "current_turn", default=None
+)
+# most recent turn traces, newest last
+recent_turns: deque[TurnTrace] = deque(maxlen=200)
+
+
+def record_span(name: str, started: float, duration: float) -> None:
+    """Record a finished span.
+    :param name: span name, e.g. llm, tool:hsbc knowledge search tool, pgvector_query
+    :param started: time.perf_counter() when the span started
+    :param duration: span duration in seconds
+    """
+    SPAN_SECONDS.observe(duration, name)
+    trace = current_turn.get()
+    if trace is not None:
+        trace.spans.append((name, started - trace.perf_start, duration))
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time the enclosed block as a span of the current turn."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, started, time.perf_counter() - started)
+
+
+@contextmanager
+def trace_turn(conversation_id: Optional[str]) -> Iterator[TurnTrace]:
+    """Trace a conversation turn; spans recorded in this context belong to the turn.
+    Work sent to other threads has to run in a copy of the context, see contextvars.copy_context.
+    """
+    trace = TurnTrace(conversation_id)
+    token = current_turn.set(trace)
+    try:
+        yield trace
+    finally:
+        current_turn.reset(token)
+        trace.duration = time.perf_counter() - trace.perf_start
+        TURN_SECONDS.observe(trace.duration)
+        recent_turns.append(trace)
+        logger.info(
+            f"Turn conversation_id={conversation_id} duration={trace.duration:.3f}s spans="
+            + ", ".join(f"{name}={duration:.3f}s" for name, _, duration in trace.spans)
+        )
+
+
+def turns_of_conversation(conversation_id: str) -> list[dict]:
+    """Recent turn traces of a conversation, for correlating slow turns."""
+    return [
+        {
+            "started_at": trace.started_at,
+            "duration": trace.duration,
+            "spans": [
+                {"name": name, "offset": offset, "duration": duration}
+                for name, offset, duration in trace.spans
+            ],
+        }
+        for trace in list(recent_turns)
+        if trace.conversation_id == conversation_id
+    ]
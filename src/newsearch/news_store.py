@@ -0,0 +1,277 @@
+""" Local store of Refinitiv headlines and stories, filled by a background poller.
+
+Articles are keyed by story id and partitioned by creation date. Each
+partition keeps its own full-text index (word -> story ids) of headline and
+story text, so evicting everything older than the news window drops whole
+partitions without touching the others. The news summary tool searches the
+store first and only queries RKD live when the store has too few matches.
+"""
+import asyncio
+import datetime
+import logging
+import re
+import threading
+from collections import defaultdict
+from typing import Callable, Iterable, Optional
+
+from .refinitiv_query import (
+    NewsArticle,
+    iter_freetext_headline_pages,
+    parse_freetext_headlines,
+    retrieve_news_stories,
+)
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+TAG_PATTERN = re.compile(r"<[^>]+>")
+# ignored in queries, so that "latest news on HSBC" finds the stories about HSBC
+STOPWORDS = {
+    "a",
+    "about",
+    "an",
+    "and",
+    "any",
+    "are",
+    "for",
+    "from",
+    "in",
+    "is",
+    "latest",
+    "me",
+    "news",
+    "of",
+    "on",
+    "recent",
+    "s",
+    "tell",
+    "the",
+    "to",
+    "what",
+    "whats",
+    "with",
+}
+
+
+def index_words(text: str) -> set[str]:
+    """Lowercase words of a text, html tags removed."""
+    return set(WORD_PATTERN.findall(TAG_PATTERN.sub(" ", text or "").lower()))
+
+
+class NewsPartition:
+    """Articles created on one day and their full-text index."""
+
+    def __init__(self):
+        self.articles: dict[str, NewsArticle] = {}
+        self.postings: dict[str, set[str]] = defaultdict(set)
+
+    def add(self, article: NewsArticle) -> None:
+        previous = self.articles.get(article.id)
+        if previous is not None:
+            for word in index_words(f"{previous.headline} {previous.story}"):
+                self.postings[word].discard(article.id)
+        self.articles[article.id] = article
+        for word in index_words(f"{article.headline} {article.story}"):
+            self.postings[word].add(article.id)
+
+    def matches(self, words: set[str]) -> set[str]:
+        """Ids of the articles containing all words."""
+        ids = None
+        for word in words:
+            ids = (
+                self.postings.get(word, set())
+                if ids is None
+                else ids & self.postings.get(word, set())
+            )
+            if not ids:
+                return set()
+        return set(ids or ())
+
+
+class NewsStore:
+    def __init__(self, window_days: int = 14):
+        """
+        :param window_days: articles created before this many days ago are evicted
+        """
+        self.window_days = window_days
+        self.partitions: dict[datetime.date, NewsPartition] = {}
+        # story id -> creation date of its partition
+        self.dates: dict[str, datetime.date] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def __contains__(self, story_id: str) -> bool:
+        return story_id in self.dates
+
+    def cutoff(self, today: Optional[datetime.date] = None) -> datetime.date:
+        return (today or datetime.date.today()) - datetime.timedelta(
+            days=self.window_days
+        )
+
+    def add(self, articles: Iterable[NewsArticle]) -> int:
+        """Add or replace articles; articles outside the window are ignored.
+        :returns: number of articles added or replaced
+        """
+        cutoff = self.cutoff()
+        added = 0
+        with self._lock:
+            for article in articles:
+                if article.creation_date < cutoff:
+                    continue
+                self.partitions.setdefault(article.creation_date, NewsPartition()).add(
+                    article
+                )
+                self.dates[article.id] = article.creation_date
+                added += 1
+        return added
+
+    def get(self, story_id: str) -> Optional[NewsArticle]:
+        with self._lock:
+            date = self.dates.get(story_id)
+            return self.partitions[date].articles.get(story_id) if date else None
+
+    def search(
+        self, query: str, limit: int = 10, with_story: bool = True
+    ) -> list[NewsArticle]:
+        """Articles whose headline or story contain every word of the query, newest first.
+        :param query: free text query
+        :param limit: maximum number of articles
+        :param with_story: only return articles whose full story is stored
+        """
+        words = index_words(query) - STOPWORDS
+        if not words:
+            return []
+        results = []
+        with self._lock:
+            for date in sorted(self.partitions, reverse=True):
+                partition = self.partitions[date]
+                for story_id in sorted(partition.matches(words)):
+                    article = partition.articles[story_id]
+                    if with_story and not article.story:
+                        continue
+                    results.append(article)
+                    if len(results) == limit:
+                        return results
+        return results
+
+    def evict(self, today: Optional[datetime.date] = None) -> int:
+        """Drop the partitions older than the window.
+        :returns: number of evicted articles
+        """
+        cutoff = self.cutoff(today)
+        evicted = 0
+        with self._lock:
+            for date in [d for d in self.partitions if d < cutoff]:
+                partition = self.partitions.pop(date)
+                for story_id in partition.articles:
+                    self.dates.pop(story_id, None)
+                evicted += len(partition.articles)
+        return evicted
+
+
+def attach_stories(
+    articles: list[NewsArticle], stories: list[dict]
+) -> list[NewsArticle]:
+    """Set the story text of each article from RKD story results, matched by story id."""
+    texts = {
+        s["ID"]: s["TE"]
+        for s in stories
+        if s.get("ST") == "Usable" and "TE" in s and "ID" in s
+    }
+    for article in articles:
+        article.story = texts.get(article.id, article.story)
+    return articles
+
+
+class NewsPoller:
+    """Pulls new headlines and stories of a set of queries into a NewsStore."""
+
+    def __init__(
+        self,
+        store: NewsStore,
+        create_base_header: Callable[[], dict[str, str]],
+        queries: list[str],
+        page_size: int = 100,
+        max_pages: int = 10,
+        overlap: datetime.timedelta = datetime.timedelta(minutes=5),
+    ):
+        """
+        :param store: store to fill
+        :param create_base_header: returns an RKD request header with a fresh token
+        :param queries: free text queries to follow, e.g. HSBC
+        :param page_size: headlines per request
+        :param max_pages: requests per query and poll; the oldest headlines over this limit are not fetched
+        :param overlap: each poll starts this much before the previous one, for late indexed headlines
+        """
+        self.store = store
+        self.create_base_header = create_base_header
+        self.queries = queries
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.overlap = overlap
+        self.last_poll: Optional[datetime.datetime] = None
+
+    def poll_once(self) -> int:
+        """Fetch headlines since the last poll (the whole window on the first poll) and their stories.
+        Headlines are paged newest first back to the start of the poll, so a busy query keeps its newest headlines.
+        :returns: number of new articles stored
+        """
+        now = datetime.datetime.now()
+        start_time = self.last_poll - self.overlap if self.last_poll else None
+        base_header = self.create_base_header()
+        added = 0
+        for query in self.queries:
+            pages = iter_freetext_headline_pages(
+                base_header,
+                query,
+                self.store.window_days // 7 or 1,
+                "both",
+                "EN",
+                page_size=self.page_size,
+                max_pages=self.max_pages,
+                start_time=start_time,
+            )
+            seen = set()
+            page_count = 0
+            try:
+                for headlines in pages:
+                    page_count += 1
+                    # headlines of the same second are repeated on the next page
+                    new_articles = [
+                        a
+                        for a in parse_freetext_headlines(headlines)
+                        if a.id not in self.store and a.id not in seen
+                    ]
+                    seen.update(a.id for a in new_articles)
+                    if new_articles:
+                        stories = retrieve_news_stories(
+                            base_header, [a.id for a in new_articles]
+                        )
+                        added += self.store.add(attach_stories(new_articles, stories))
+            except KeyError:
+                # no headlines since the last poll, usual for a quiet query
+                logger.debug(f"News poll found no new headlines for {query}")
+                continue
+            if page_count == self.max_pages:
+                logger.warning(
+                    f"News poll of {query} stopped after {page_count} pages, older headlines were skipped"
+                )
+        self.last_poll = now
+        evicted = self.store.evict()
+        logger.info(
+            f"News poll stored {added} new articles, evicted {evicted}, {len(self.store)} in store"
+        )
+        return added
+
+    async def run(self, interval_seconds: float = 300) -> None:
+        """Poll in a loop, off the event loop, until cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.poll_once)
+            # send_post_request raises SystemExit on request errors
+            except (Exception, SystemExit) as e:
+                logger.warning(f"News poll failed: {e!r}")
+            await asyncio.sleep(interval_seconds)
@@ -1,10 +1,19 @@
 import datetime
-import json
+import re
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Iterable, Iterator
 
+from ..json_stream import JSONArrayNotFound, iter_json_array_items
 from ..utils import send_post_request
 
+# RKD responses are decoded in chunks of this size, see iter_rkd_items
+STREAM_CHUNK_BYTES = 64 * 1024
+STATUS_MSG = re.compile(r'"StatusMsg"\s*:\s*"([^"]*)"')
+
+
+class RKDRequestFailed(RuntimeError):
+    """An RKD response whose status is not OK."""
+
 
 @dataclass
 class NewsArticle:
@@ -72,14 +81,43 @@ def create_rkd_base_header(username: str, password: str, app_id: str) -> dict[st
     return headers
 
 
-def retrieve_freetext_headlines(
+def iter_rkd_items(
+    url: str, request_msg: dict, base_header: dict[str, str], on_skipped=None
+) -> Iterator[dict[str, Any]]:
+    """Send an RKD request and decode the HL items of the response one by one,
+    while the response is downloading.
+    :param url: RKD operation url
+    :param request_msg: RKD request message
+    :param base_header: Post request header containing auth token
+    :param on_skipped: Called with the response text outside the HL items
+    :returns: Iterator of the HL items; numbers are decoded as in the RKD json.loads calls.
+    :raises JSONArrayNotFound: when the response has no HL items.
+    """
+    response = send_post_request(url, request_msg, base_header, stream=True)
+    try:
+        yield from iter_json_array_items(
+            response.iter_content(chunk_size=STREAM_CHUNK_BYTES),
+            "HL",
+            parse_int=str,
+            parse_float=float,
+            on_skipped=on_skipped,
+        )
+    finally:
+        response.close()
+
+
+def iter_freetext_headlines(
     base_header: dict[str, str],
     query: str,
     n_weeks_prior: int,
     query_aspect="headline",
     lang="EN",
-) -> list[dict[str, str]]:
-    """Perform free-text query on RKD; get headlines with query.
+    start_time: datetime.datetime = None,
+    max_count: int = 10,
+    end_time: datetime.datetime = None,
+    direction: str = "Newer",
+) -> Iterator[dict[str, str]]:
+    """Perform free-text query on RKD; stream the headlines with query as they are downloaded.
     Documentation on output fields available:
     https://support-portal.rkd.refinitiv.com/SupportSite/TestApi/Op?svc=News_1&op=RetrieveHeadlineML_1
 
@@ -88,11 +126,15 @@ def retrieve_freetext_headlines(
     :param n_weeks_prior: Freshness of news to search in num weeks
     :param query_aspect: Where to search for query string; options: headline, body, both
     :param lang: Language of news to search; options: ZH, EN, None or Others in Refinitiv
-    :returns: List of dictionaries containing news objects.
+    :param start_time: Search news from this time instead of n_weeks_prior, e.g. the last poll
+    :param max_count: Maximum number of headlines
+    :param end_time: Search news until this time instead of now
+    :param direction: Newer returns the oldest headlines of the time range first, Older the newest
+    :returns: Iterator of dictionaries containing news objects.
     """
 
-    today = datetime.datetime.now()
-    n_weeks_prior = today - datetime.timedelta(weeks=n_weeks_prior)
+    today = end_time or datetime.datetime.now()
+    n_weeks_prior = start_time or today - datetime.timedelta(weeks=n_weeks_prior)
 
     freetext_query_url = "http://api.rkd.refinitiv.com/api/News/News.svc/REST/News_1/RetrieveHeadlineML_1"
 
@@ -100,8 +142,8 @@ def retrieve_freetext_headlines(
         "RetrieveHeadlineML_Request_1": {
             "HeadlineMLRequest": {
                 "TimeOut": 0,
-                "MaxCount": 10,
-                "Direction": "Newer",
+                "MaxCount": max_count,
+                "Direction": direction,
                 "StartTime": n_weeks_prior.strftime("%Y-%m-%dT%H:%M:%S"),
                 "EndTime": today.strftime("%Y-%m-%dT%H:%M:%S"),
                 "Filter": [
@@ -121,17 +163,67 @@ def retrieve_freetext_headlines(
             }
         }
     }
-    results_freetext = send_post_request(freetext_query_url, freetext_line, base_header)
+    # HEADLINEML is null when there are no results
+    try:
+        yield from iter_rkd_items(freetext_query_url, freetext_line, base_header)
+    except JSONArrayNotFound:
+        raise KeyError(f"No freetext results for {query}")
 
-    # load result; result is a valid JSON string
-    results_freetext = json.loads(
-        results_freetext.text, parse_int=str, parse_float=float
-    )["RetrieveHeadlineML_Response_1"]["HeadlineMLResponse"]
 
-    # check if there are results
-    if results_freetext["HEADLINEML"] is None:
-        raise KeyError(f"No freetext results for {query}")
-    return results_freetext["HEADLINEML"]["HL"]
+def retrieve_freetext_headlines(
+    base_header: dict[str, str],
+    query: str,
+    n_weeks_prior: int,
+    query_aspect="headline",
+    lang="EN",
+    start_time: datetime.datetime = None,
+    max_count: int = 10,
+    end_time: datetime.datetime = None,
+    direction: str = "Newer",
+) -> list[dict[str, str]]:
+    """Perform free-text query on RKD; get headlines with query.
+    See iter_freetext_headlines for the parameters.
+    :returns: List of dictionaries containing news objects.
+    """
+    return list(
+        iter_freetext_headlines(
+            base_header,
+            query,
+            n_weeks_prior,
+            query_aspect,
+            lang,
+            start_time,
+            max_count,
+            end_time,
+            direction,
+        )
+    )
+
+
+def iter_news_articles(
+    freetext_headlines: Iterable[dict[str, str]]
+) -> Iterator[NewsArticle]:
+    """Parse freetext results from RKD into NewsArticle objects one by one,
+    e.g. as iter_freetext_headlines decodes them.
+    Ignore articles that do not have 'Usable' status.
+    :param freetext_headlines: Dictionaries containing freetext results from RKD.
+    :returns: Iterator of NewsArticle objects parsed from the freetext results.
+    """
+    for ftr in freetext_headlines:
+        # skip if story is not 'usable'
+        if ftr["ST"] != "Usable":
+            continue
+        # parse date
+        formatted_date = datetime.datetime.fromisoformat(ftr["CT"]).date()
+        yield NewsArticle(
+            id=ftr["ID"],
+            creation_date=formatted_date,
+            headline=ftr["HT"],
+            topics=ftr["TO"].split(" ") if ftr["TO"] else [],
+            companies=ftr["CO"].split(" ") if ftr["CO"] else [],
+            language=ftr["LN"],
+            story=None,  # retrieve when querying full news story
+        )
 
 
 def parse_freetext_headlines(
@@ -142,36 +234,142 @@ def parse_freetext_headlines(
     :param freetext_results: A list of dictionaries containing freetext results from RKD.
     :returns: A list of NewsArticle objects parsed from the freetext results.
     """
-    freetext_stories = []
-    for ftr in freetext_headlines:
-        # skip if story is not 'usable'
-        if ftr["ST"] != "Usable":
-            continue
-        # parse date
-        formatted_date = datetime.datetime.strptime(
-            ftr["CT"], "%Y-%m-%dT%H:%M:%S%z"
-        ).date()
-        freetext_stories.append(
-            NewsArticle(
-                id=ftr["ID"],
-                creation_date=formatted_date,
-                headline=ftr["HT"],
-                topics=ftr["TO"].split(" ") if ftr["TO"] else [],
-                companies=ftr["CO"].split(" ") if ftr["CO"] else [],
-                language=ftr["LN"],
-                story=None,  # retrieve when querying full news story
+    return list(iter_news_articles(freetext_headlines))
+
+
+def iter_freetext_headline_pages(
+    base_header: dict[str, str],
+    query: str,
+    n_weeks_prior: int,
+    query_aspect="headline",
+    lang="EN",
+    page_size: int = 10,
+    max_pages: int = 5,
+    start_time: datetime.datetime = None,
+) -> Iterator[list[dict[str, str]]]:
+    """Perform free-text query on RKD page by page, newest headlines first.
+    A page is only requested when the previous one has been consumed.
+    The last page is the one that reaches the start of the time range.
+
+    :param base_header: Post request header containing auth token
+    :param query: Query string
+    :param n_weeks_prior: Freshness of news to search in num weeks
+    :param query_aspect: Where to search for query string; options: headline, body, both
+    :param lang: Language of news to search; options: ZH, EN, None or Others in Refinitiv
+    :param page_size: Number of headlines per request
+    :param max_pages: Maximum number of requests
+    :param start_time: Search news from this time instead of n_weeks_prior, e.g. the last poll
+    :returns: Iterator of lists of headline dictionaries.
+    """
+    start_time = start_time or datetime.datetime.now() - datetime.timedelta(
+        weeks=n_weeks_prior
+    )
+    end_time = None
+    for page in range(max_pages):
+        try:
+            headlines = retrieve_freetext_headlines(
+                base_header,
+                query,
+                n_weeks_prior,
+                query_aspect,
+                lang,
+                start_time=start_time,
+                max_count=page_size,
+                end_time=end_time,
+                direction="Older",
             )
+        except KeyError:
+            # no (more) results; only an empty first page is an error
+            if page == 0:
+                raise
+            return
+        yield headlines
+        if len(headlines) < page_size:
+            return
+        # the next page ends at the oldest headline of this one; headlines
+        # created in the same second are returned again and deduplicated by id
+        oldest = (
+            datetime.datetime.fromisoformat(headlines[-1]["CT"])
+            .astimezone()
+            .replace(tzinfo=None)
         )
-    return freetext_stories
+        if end_time is not None and oldest >= end_time:
+            oldest = end_time - datetime.timedelta(seconds=1)
+        end_time = oldest
 
 
-def retrieve_news_stories(
+# wire services re-publish stories with prefixes like "UPDATE 2-" or "REFILE-"
+REPUBLISH_PREFIX = re.compile(
+    r"^\s*(?:(?:UPDATE|WRAPUP)\s*\d*|REFILE|CORRECTED|RPT|BRIEF|BUZZ)\s*[-:]\s*", re.I
+)
+HEADLINE_WORD = re.compile(r"[a-z0-9]+")
+
+
+def headline_words(headline: str) -> frozenset[str]:
+    """Words of a headline without re-publication prefixes, for near-duplicate detection."""
+    while True:
+        stripped = REPUBLISH_PREFIX.sub("", headline)
+        if stripped == headline:
+            break
+        headline = stripped
+    return frozenset(HEADLINE_WORD.findall(headline.lower()))
+
+
+def is_near_duplicate(
+    words: frozenset[str], seen: list[frozenset[str]], threshold: float = 0.8
+) -> bool:
+    """Whether the headline words overlap (Jaccard similarity) with any seen headline by at least threshold."""
+    for other in seen:
+        union = len(words | other)
+        if union and len(words & other) / union >= threshold:
+            return True
+    return False
+
+
+def iter_distinct_articles(
+    headline_pages: Iterator[list[dict[str, str]]],
+    max_articles: int = 10,
+    threshold: float = 0.8,
+) -> Iterator[list[NewsArticle]]:
+    """Parse pages of freetext headlines into usable articles, skipping articles
+    already seen and near-duplicate headlines. Stops reading pages once
+    max_articles distinct articles have been yielded.
+
+    :param headline_pages: Pages of headlines, e.g. from iter_freetext_headline_pages.
+    :param max_articles: Number of distinct articles to collect.
+    :param threshold: Jaccard similarity of headline words above which headlines are duplicates.
+    :returns: Iterator of lists of new distinct articles, one list per page that has any.
+    """
+    seen_ids: set[str] = set()
+    seen_words: list[frozenset[str]] = []
+    collected = 0
+    for headlines in headline_pages:
+        articles = []
+        for article in parse_freetext_headlines(headlines):
+            if article.id in seen_ids:
+                continue
+            seen_ids.add(article.id)
+            words = headline_words(article.headline)
+            if is_near_duplicate(words, seen_words, threshold):
+                continue
+            seen_words.append(words)
+            articles.append(article)
+            if collected + len(articles) == max_articles:
+                break
+        if articles:
+            collected += len(articles)
+            yield articles
+        if collected >= max_articles:
+            return
+
+
+def iter_news_stories(
     base_header: dict[str, str], story_ids: list[str]
-) -> list[dict[str, Any]]:
-    """Retrieve news stories for given story ids from RKD.
+) -> Iterator[dict[str, Any]]:
+    """Retrieve news stories for given story ids from RKD, one by one as they are downloaded.
     :param: base_header: Post request header containing auth token
     :param: story_ids: List of story ids to retrieve
-    :returns: List of dictionaries containing news objects.
+    :returns: Iterator of dictionaries containing news objects.
     """
 
     # Get news stories
@@ -184,30 +382,66 @@ def retrieve_news_stories(
             "StoryMLRequest": {"StoryId": [story_ids]},
         }
     }
-    # get news stories result
-    news_stories_result = send_post_request(
-        news_stories_url, news_stories_line, base_header
-    )
-    # load result; assume Result is a valid JSON string
-    news_stories_result = json.loads(
-        news_stories_result.text, parse_int=str, parse_float=float
-    )["RetrieveStoryML_Response_1"]["StoryMLResponse"]
-    assert news_stories_result["Status"]["StatusMsg"] == "OK", "News request failed"
+    # the response status is outside the stories; no story is yielded before it has been
+    # checked, stories of a response whose status follows them are held until the end
+    skipped = []
+    held = []
+    status = None
+    try:
+        for story in iter_rkd_items(
+            news_stories_url, news_stories_line, base_header, skipped.append
+        ):
+            if status is None:
+                status = STATUS_MSG.search("".join(skipped))
+                if status and status.group(1) != "OK":
+                    break
+            if status:
+                yield story
+            else:
+                held.append(story)
+    except JSONArrayNotFound:
+        # a failed request has no stories
+        pass
+    status = status or STATUS_MSG.search("".join(skipped))
+    if not status or status.group(1) != "OK":
+        raise RKDRequestFailed(
+            f"News request failed: {status.group(1) if status else 'no status'}"
+        )
+    yield from held
 
-    return news_stories_result["STORYML"]["HL"]
 
+def retrieve_news_stories(
+    base_header: dict[str, str], story_ids: list[str]
+) -> list[dict[str, Any]]:
+    """Retrieve news stories for given story ids from RKD.
+    :param: base_header: Post request header containing auth token
+    :param: story_ids: List of story ids to retrieve
+    :returns: List of dictionaries containing news objects.
+    """
+    return list(iter_news_stories(base_header, story_ids))
 
-def parse_news_stories_texts(news_stories_results: list[dict[str, Any]]) -> list[str]:
-    """Parse news stories results from RKD and return a list of news story texts.
+
+def iter_news_stories_texts(
+    news_stories_results: Iterable[dict[str, Any]]
+) -> Iterator[str]:
+    """Parse news stories results from RKD into news story texts one by one,
+    e.g. as iter_news_stories decodes them.
     Skip news stories that do not have 'Usable' status.
-    :param news_stories_results: A list of dictionaries containing full news stories results from RKD.
-    :returns: A list of news story texts parsed from the news stories results.
+    :param news_stories_results: Dictionaries containing full news stories results from RKD.
+    :returns: Iterator of news story texts parsed from the news stories results.
     """
-    news_stories_texts = []
     for nsr in news_stories_results:
         if "ST" not in nsr or nsr["ST"] != "Usable":
             continue
         if "TE" not in nsr:
             continue
-        news_stories_texts.append(nsr["TE"])
-    return news_stories_texts
+        yield nsr["TE"]
+
+
+def parse_news_stories_texts(news_stories_results: list[dict[str, Any]]) -> list[str]:
+    """Parse news stories results from RKD and return a list of news story texts.
+    Skip news stories that do not have 'Usable' status.
+    :param news_stories_results: A list of dictionaries containing full news stories results from RKD.
+    :returns: A list of news story texts parsed from the news stories results.
+    """
+    return list(iter_news_stories_texts(news_stories_results))
@@ -0,0 +1,139 @@
+""" Plain text of Refinitiv story bodies for summarisation.
+
+Story bodies (the TE field) are HTML with bylines, contact lines and
+disclaimers. clean_story turns a body into paragraphs of plain text without
+that boilerplate, normalises whitespace and caps the text at a token budget,
+so that summarisation prompts only pay for the news itself.
+"""
+import re
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import Optional
+
+from src.metrics import metrics
+from src.tokens import count_tokens, truncate_to_tokens
+
+STORY_TOKENS = metrics.histogram(
+    "vocode_hsbc_story_tokens",
+    "Tokens of a news story body before (raw) and after (clean) preprocessing",
+    ("stage",),
+    buckets=(100, 250, 500, 1000, 2000, 4000, 8000, 16000),
+)
+
+# tags whose text is never part of the story
+SKIPPED_TAGS = {"script", "style", "head", "title", "noscript"}
+# tags that end a paragraph or a line
+PARAGRAPH_TAGS = {
+    "p",
+    "div",
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "pre",
+    "blockquote",
+    "table",
+    "ul",
+    "ol",
+}
+LINE_TAGS = {"br", "li", "tr"}
+CELL_TAGS = {"td", "th"}
+
+# lines of wire boilerplate: credits, contacts, disclaimers and links
+BOILERPLATE = re.compile(
+    r"""^\W*(?:
+        (?:additional\s+)?reporting\s+by\b
+        | (?:writing|editing|compiled|graphic)\s+by\b
+        | our\s+standards\s*:
+        | \(\(.*\)\)$
+        | copyright\b | ©
+        | (?:double\s+)?click\s+(?:here|on)\b
+        | for\s+more\b.*\b(?:click|see|visit)\b
+        | keywords?\s*:
+        | source\s+text\b
+        | disclaimer\s*:
+        | .*\bhas\s+not\s+(?:verified|edited)\s+(?:this|the)\b
+        | .*\bis\s+not\s+responsible\s+for\b
+        | further\s+company\s+coverage\b
+    )""",
+    re.IGNORECASE | re.VERBOSE,
+)
+SPACES = re.compile(r"[ \t\r\f\v\u00a0]+")
+WHITESPACE = re.compile(r"\s+")
+MARKUP = re.compile(r"<[a-zA-Z!/]")
+
+
+class _StoryTextParser(HTMLParser):
+    def __init__(self, preserve_newlines: bool):
+        super().__init__(convert_charrefs=True)
+        self.parts: list[str] = []
+        self.skip_depth = 0
+        self.preserve_newlines = preserve_newlines
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+        elif tag in LINE_TAGS:
+            self.parts.append("\n")
+        elif tag in CELL_TAGS:
+            self.parts.append(" | ")
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+        elif tag in PARAGRAPH_TAGS:
+            self.parts.append("\n\n")
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            # in HTML, line breaks come from tags, not from newlines in the source
+            self.parts.append(
+                data if self.preserve_newlines else WHITESPACE.sub(" ", data)
+            )
+
+
+def html_to_text(html: str) -> str:
+    """Text of an HTML fragment with paragraphs separated by blank lines and whitespace normalised.
+    Text without markup keeps its line breaks."""
+    parser = _StoryTextParser(preserve_newlines=not MARKUP.search(html))
+    parser.feed(html)
+    parser.close()
+    paragraphs = []
+    for paragraph in "".join(parser.parts).split("\n\n"):
+        lines = [SPACES.sub(" ", line).strip(" |") for line in paragraph.split("\n")]
+        lines = [line.strip() for line in lines if line.strip()]
+        if lines:
+            paragraphs.append("\n".join(lines))
+    return "\n\n".join(paragraphs)
+
+
+@dataclass
+class StoryText:
+    text: str
+    raw_tokens: int
+    tokens: int
+
+
+def clean_story(story: str, max_tokens: Optional[int] = None) -> StoryText:
+    """
+    Plain text of a story body without wire boilerplate, capped at max_tokens.
+    :param story: story body, HTML or plain text
+    :param max_tokens: token budget of the text, no cap if None
+    :returns: the text and its tokens before and after preprocessing
+    """
+    raw_tokens = count_tokens(story)
+    paragraphs = []
+    for paragraph in html_to_text(story).split("\n\n"):
+        lines = [line for line in paragraph.split("\n") if not BOILERPLATE.match(line)]
+        # the same paragraph is often repeated, e.g. a standfirst
+        if lines and "\n".join(lines) not in paragraphs:
+            paragraphs.append("\n".join(lines))
+    text = "\n\n".join(paragraphs)
+    if max_tokens is not None:
+        text = truncate_to_tokens(text, max_tokens)
+    tokens = count_tokens(text)
+    STORY_TOKENS.observe(raw_tokens, "raw")
+    STORY_TOKENS.observe(tokens, "clean")
+    return StoryText(text=text, raw_tokens=raw_tokens, tokens=tokens)
@@ -0,0 +1,100 @@
+""" Lazy registry for expensive shared resources (LLM clients, database connections).
+
+Nothing is created at import time. A resource is built the first time it is
+requested, or ahead of time by `warmup`, which builds several resources in
+parallel during application startup.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceRegistry:
+    """Named resources built on demand, at most once each."""
+
+    def __init__(self):
+        self.factories: dict[str, Callable[[], Any]] = {}
+        self.closers: dict[str, Optional[Callable[[Any], None]]] = {}
+        self.instances: dict[str, Any] = {}
+        self.init_seconds: dict[str, float] = {}
+        self._locks: dict[str, threading.Lock] = {}
+
+    def register(
+        self,
+        name: str,
+        factory: Callable[[], Any],
+        close: Optional[Callable[[Any], None]] = None,
+    ) -> None:
+        """Register a factory; it is not called until the resource is needed.
+        :param name: resource name
+        :param factory: function without arguments that builds the resource
+        :param close: releases a resource dropped by reset, e.g. closes its connections
+        """
+        self.factories[name] = factory
+        self.closers[name] = close
+        self._locks[name] = threading.Lock()
+
+    def get(self, name: str) -> Any:
+        """Return the resource, building it on first use.
+        :param name: resource name
+        :returns: the resource instance
+        """
+        if name in self.instances:
+            return self.instances[name]
+        if name not in self.factories:
+            raise KeyError(f"Resource {name} is not registered")
+        with self._locks[name]:
+            # another thread may have built it while we waited for the lock
+            if name not in self.instances:
+                start = time.perf_counter()
+                self.instances[name] = self.factories[name]()
+                self.init_seconds[name] = time.perf_counter() - start
+                logger.debug(
+                    f"Initialised resource {name} in {self.init_seconds[name]:.3f}s"
+                )
+        return self.instances[name]
+
+    def is_initialised(self, name: str) -> bool:
+        return name in self.instances
+
+    def reset(self, name: str) -> None:
+        """Drop a resource so that it is rebuilt on next use, e.g. a broken connection.
+        The dropped resource is closed if it was registered with a close function.
+        """
+        with self._locks[name]:
+            instance = self.instances.pop(name, None)
+        close = self.closers.get(name)
+        if instance is not None and close is not None:
+            try:
+                close(instance)
+            except Exception as e:
+                logger.warning(f"Failed to close resource {name}: {e}")
+
+    def warmup(
+        self, names: Optional[Iterable[str]] = None, max_workers: int = 4
+    ) -> dict[str, Optional[str]]:
+        """Build resources in parallel; failures are logged, not raised.
+        :param names: resources to build, all registered resources by default
+        :param max_workers: number of resources built at the same time
+        :returns: resource name to error message, None if it was built successfully
+        """
+        names = list(names or self.factories)
+
+        def build(name: str) -> Optional[str]:
+            try:
+                self.get(name)
+                return None
+            except Exception as e:
+                logger.warning(f"Failed to warm up resource {name}: {e}")
+                return str(e)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(names, executor.map(build, names)))
+
+
+# registry shared by the tools and the agent
+registry = ResourceRegistry()
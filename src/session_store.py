@@ -0,0 +1,85 @@
+""" Conversation session store shared by all workers.
+
+Chat history is kept per conversation_id as a list of json serialisable messages,
+so that a conversation can be continued by any worker process, e.g. when the
+client reconnects after a rolling deploy. The in-memory store is only shared by
+the conversations of one worker; use the redis store for multi-worker serving.
+"""
+import json
+import threading
+import time
+from typing import Optional
+
+
+class InMemorySessionStore:
+    """Session store local to the worker process."""
+
+    def __init__(self, ttl_seconds: int = 3600):
+        self.ttl_seconds = ttl_seconds
+        self.sessions: dict[str, tuple[float, list[dict]]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, conversation_id: str) -> list[dict]:
+        """Return the stored messages of a conversation, empty if unknown or expired."""
+        with self._lock:
+            expires_at, messages = self.sessions.get(conversation_id, (0, []))
+            if expires_at < time.time():
+                self.sessions.pop(conversation_id, None)
+                return []
+            return list(messages)
+
+    def save(self, conversation_id: str, messages: list[dict]) -> None:
+        """Replace the stored messages of a conversation and refresh its ttl."""
+        with self._lock:
+            self.sessions[conversation_id] = (
+                time.time() + self.ttl_seconds,
+                list(messages),
+            )
+            # drop expired sessions so the store does not grow with every call
+            now = time.time()
+            for key in [k for k, (exp, _) in self.sessions.items() if exp < now]:
+                del self.sessions[key]
+
+    def delete(self, conversation_id: str) -> None:
+        with self._lock:
+            self.sessions.pop(conversation_id, None)
+
+
+class RedisSessionStore:
+    """Session store shared by all workers and hosts through redis."""
+
+    def __init__(
+        self, url: str, ttl_seconds: int = 3600, prefix: str = "vocode-hsbc:session:"
+    ):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError(
+                "RedisSessionStore requires the redis package, install it with `pip install redis`"
+            )
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    def load(self, conversation_id: str) -> list[dict]:
+        raw = self.client.get(self.prefix + conversation_id)
+        return json.loads(raw) if raw else []
+
+    def save(self, conversation_id: str, messages: list[dict]) -> None:
+        self.client.set(
+            self.prefix + conversation_id, json.dumps(messages), ex=self.ttl_seconds
+        )
+
+    def delete(self, conversation_id: str) -> None:
+        self.client.delete(self.prefix + conversation_id)
+
+
+def create_session_store(url: Optional[str] = None, ttl_seconds: int = 3600):
+    """Create the session store for a SESSION_STORE_URL; in-memory if not set.
+    :param url: redis url, e.g. redis://localhost:6379/0, None for the in-memory store
+    :param ttl_seconds: how long an idle conversation is kept
+    :returns: session store
+    """
+    if url:
+        return RedisSessionStore(url, ttl_seconds=ttl_seconds)
+    return InMemorySessionStore(ttl_seconds=ttl_seconds)
@@ -0,0 +1,150 @@
+""" Warm pool of pre-initialized speech clients (transcribers, synthesizers).
+
+Building a speech client and connecting it to the speech service is done ahead
+of time, so a new conversation only has to take a ready instance from the pool.
+Instances are keyed by audio config; the pool is refilled in the background
+after every checkout. Building an instance opens a connection to the speech
+service, so instances are built in a worker thread and never on the event loop.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Callable, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+def audio_config_key(audio_config: Any) -> str:
+    """Pool key of an audio config; pydantic models are keyed by their json."""
+    if hasattr(audio_config, "json"):
+        return audio_config.json()
+    return repr(audio_config)
+
+
+@dataclass
+class PoolStats:
+    idle: int = 0
+    in_use: int = 0
+    hits: int = 0
+    misses: int = 0
+    created: int = 0
+    recycled: int = 0
+    discarded: int = 0
+
+
+class WarmPool(Generic[T]):
+    """
+    Keeps `size` ready instances per audio config.
+
+    Single-use instances (e.g. transcribers, whose audio stream is closed when the
+    conversation ends) are never handed out twice; the pool builds a replacement
+    instead. Reusable instances are returned with `release` and reset before reuse.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        factory: Callable[[Any], T],
+        size: int = 2,
+        reusable: bool = False,
+        reset: Optional[Callable[[T], None]] = None,
+        logger: Optional[logging.Logger] = None,
+    ):
+        """
+        :param name: pool name used in logs and metrics
+        :param factory: builds an instance from an audio config
+        :param size: number of ready instances kept per audio config
+        :param reusable: whether released instances can be handed out again
+        :param reset: clears per-conversation state of a released instance
+        """
+        self.name = name
+        self.factory = factory
+        self.size = size
+        self.reusable = reusable
+        self.reset = reset
+        self.logger = logger or logging.getLogger(__name__)
+        self.idle: dict[str, list[T]] = defaultdict(list)
+        self.configs: dict[str, Any] = {}
+        self.stats: dict[str, PoolStats] = defaultdict(PoolStats)
+        self._refilling: set[str] = set()
+        # refill tasks, referenced until they finish
+        self._tasks: set[asyncio.Task] = set()
+
+    def _create(self, key: str) -> T:
+        instance = self.factory(self.configs[key])
+        self.stats[key].created += 1
+        return instance
+
+    async def warm(self, audio_config: Any) -> None:
+        """Fill the pool for an audio config up to `size` ready instances."""
+        key = audio_config_key(audio_config)
+        self.configs[key] = audio_config
+        if key in self._refilling:
+            return
+        self._refilling.add(key)
+        await self._fill(key)
+
+    async def _fill(self, key: str) -> None:
+        # instances are built one at a time in a thread, the event loop keeps serving live conversations
+        try:
+            while len(self.idle[key]) < self.size:
+                try:
+                    instance = await asyncio.to_thread(self._create, key)
+                except Exception as e:
+                    self.logger.warning(f"Failed to warm {self.name} pool: {e}")
+                    break
+                self.idle[key].append(instance)
+                self.stats[key].idle = len(self.idle[key])
+        finally:
+            self._refilling.discard(key)
+
+    def _schedule_refill(self, key: str) -> None:
+        # instances are built in the background after the current conversation has started
+        if self.size <= 0 or key in self._refilling:
+            return
+        self._refilling.add(key)
+        task = asyncio.get_running_loop().create_task(self._fill(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def acquire(self, audio_config: Any) -> T:
+        """Take a ready instance for the audio config, building one on a miss."""
+        key = audio_config_key(audio_config)
+        self.configs[key] = audio_config
+        stats = self.stats[key]
+        if self.idle[key]:
+            instance = self.idle[key].pop()
+            stats.hits += 1
+        else:
+            instance = self._create(key)
+            stats.misses += 1
+        stats.in_use += 1
+        stats.idle = len(self.idle[key])
+        self._schedule_refill(key)
+        return instance
+
+    def release(self, audio_config: Any, instance: T) -> None:
+        """Give an instance back at the end of a conversation."""
+        key = audio_config_key(audio_config)
+        stats = self.stats[key]
+        stats.in_use = max(stats.in_use - 1, 0)
+        if not self.reusable or len(self.idle[key]) >= self.size:
+            stats.discarded += 1
+            return
+        try:
+            if self.reset:
+                self.reset(instance)
+        except Exception as e:
+            self.logger.warning(
+                f"Failed to reset {self.name} instance, discarding: {e}"
+            )
+            stats.discarded += 1
+            return
+        self.idle[key].append(instance)
+        stats.recycled += 1
+        stats.idle = len(self.idle[key])
+
+    def utilization(self) -> dict[str, dict[str, int]]:
+        """Pool utilization per audio config."""
+        return {key: vars(stats).copy() for key, stats in self.stats.items()}
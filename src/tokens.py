@@ -0,0 +1,47 @@
+""" Token counting for prompt budgets and accounting.
+
+Uses the tiktoken cl100k_base encoding of the gpt-35-turbo/gpt-4 deployments
+when tiktoken is installed, otherwise an estimate of four characters per token.
+"""
+from functools import lru_cache
+from typing import Sequence
+
+# tokens added per chat message for the role and separators
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    """Number of tokens of a text."""
+    encoding = _encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: Sequence) -> int:
+    """Number of tokens of chat messages (langchain BaseMessage) including per-message overhead."""
+    return sum(count_tokens(m.content) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, marker: str = " ...") -> str:
+    """Cut a text to at most `max_tokens` tokens, marking the cut."""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _encoding()
+    if encoding is None:
+        return text[: max_tokens * 4].rstrip() + marker
+    return (
+        encoding.decode(
+            encoding.encode(text, disallowed_special=())[:max_tokens]
+        ).rstrip()
+        + marker
+    )
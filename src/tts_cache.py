@@ -0,0 +1,126 @@
+""" Two tier (memory + disk) cache for synthesized speech audio.
+
+Audio is keyed by voice name, audio config and text so that the same phrase is
+only sent to the speech service once per voice and output format.
+"""
+import hashlib
+import os
+import threading
+from collections import Counter, OrderedDict
+from typing import Optional
+
+
+def make_cache_key(voice_name: str, audio_config: tuple, text: str) -> str:
+    """Build the cache key for a synthesized phrase.
+    :param voice_name: TTS voice name
+    :param audio_config: tuple describing the output format, e.g. (encoding, sampling rate, pitch, rate)
+    :param text: text that is synthesized
+    :returns: hex digest used as cache key and file name
+    """
+    raw = "|".join([str(voice_name), *[str(c) for c in audio_config], text.strip()])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class TTSAudioCache:
+    """LRU memory tier bounded in bytes, backed by one file per phrase on disk."""
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        max_memory_bytes: int = 64 * 1024 * 1024,
+        max_tracked_requests: int = 10_000,
+    ):
+        """
+        :param cache_dir: directory of the disk tier, None to only keep audio in memory
+        :param max_memory_bytes: size of the memory tier
+        :param max_tracked_requests: number of uncached phrases to count requests for
+        """
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_tracked_requests = max_tracked_requests
+        self.request_counts = Counter()
+        self.memory: OrderedDict[str, bytes] = OrderedDict()
+        self.memory_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.bytes")
+
+    def _remember(self, key: str, audio: bytes) -> None:
+        # called with the lock held
+        if key in self.memory:
+            self.memory_bytes -= len(self.memory.pop(key))
+        if len(audio) > self.max_memory_bytes:
+            return
+        self.memory[key] = audio
+        self.memory_bytes += len(audio)
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Look up audio in memory, then on disk.
+        :param key: key from make_cache_key
+        :returns: audio bytes or None on a miss
+        """
+        with self._lock:
+            audio = self.memory.get(key)
+            if audio is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return audio
+
+        if self.cache_dir and os.path.exists(self._path(key)):
+            with open(self._path(key), "rb") as f:
+                audio = f.read()
+            with self._lock:
+                self._remember(key, audio)
+                self.hits += 1
+                self.disk_hits += 1
+            return audio
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, audio: bytes, persist: bool = True) -> None:
+        """Store audio in memory and optionally on disk.
+        :param key: key from make_cache_key
+        :param audio: synthesized audio bytes
+        :param persist: write the audio to the disk tier as well
+        """
+        with self._lock:
+            self._remember(key, audio)
+        if persist and self.cache_dir:
+            # write to a temp file first so readers never see a partial file
+            tmp_path = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, self._path(key))
+
+    def count_request(self, key: str) -> int:
+        """Count a request for a phrase that is not cached yet, shared by all conversations.
+        :param key: key from make_cache_key
+        :returns: number of times the phrase has been requested
+        """
+        with self._lock:
+            if len(self.request_counts) >= self.max_tracked_requests:
+                self.request_counts.clear()
+            self.request_counts[key] += 1
+            return self.request_counts[key]
+
+    def stats(self) -> dict[str, int]:
+        """Hit/miss counters and memory tier size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_items": len(self.memory),
+                "memory_bytes": self.memory_bytes,
+            }
@@ -0,0 +1,167 @@
+""" Incremental text chunker that turns an LLM token stream into TTS requests.
+
+Each chunk becomes one synthesis round-trip, so chunks should be long enough to
+be synthesized efficiently and split where a speaker would naturally pause.
+Decimals (3.5%), amounts (HK$1,000), abbreviations (e.g., Mr.) and URLs
+(www.hsbc.com.hk) are never split.
+"""
+import re
+from typing import Iterable
+
+# words that end with a dot but do not end a sentence; compared lowercased without the dot
+ABBREVIATIONS = {
+    "mr",
+    "mrs",
+    "ms",
+    "dr",
+    "prof",
+    "st",
+    "no",
+    "vs",
+    "etc",
+    "approx",
+    "incl",
+    "e.g",
+    "i.e",
+    "a.m",
+    "p.m",
+    "p.a",
+    "u.s",
+    "u.k",
+    "h.k",
+    "hk",
+    "co",
+    "ltd",
+    "corp",
+    "inc",
+    "dept",
+    "jan",
+    "feb",
+    "mar",
+    "apr",
+    "jun",
+    "jul",
+    "aug",
+    "sep",
+    "sept",
+    "oct",
+    "nov",
+    "dec",
+    "min",
+    "max",
+    "ref",
+    "tel",
+    "ext",
+    "fig",
+}
+
+# punctuation followed by whitespace; the whitespace must already be in the buffer
+# so that "3.5" or "1,000" are never split before the next token arrives
+BOUNDARY_PATTERN = re.compile(r"(?:[.!?]+|[,;:])[\"')\]]*(?=\s)|\n+")
+SENTENCE_END_CHARS = ".!?\n"
+PREVIOUS_WORD_PATTERN = re.compile(r"(\S+)$")
+
+
+class SpeechChunker:
+    """Accumulates streamed text and emits chunks ready for speech synthesis."""
+
+    def __init__(self, min_length: int = 40, max_length: int = 250):
+        """
+        :param min_length: shorter sentences are merged with the next one
+        :param max_length: longer text is split at a clause boundary or whitespace
+        """
+        self.min_length = min_length
+        self.max_length = max_length
+        self.buffer = ""
+
+    def feed(self, token: str) -> list[str]:
+        """Add a token to the buffer and return the chunks that are complete.
+        :param token: text fragment from the LLM stream, any length
+        :returns: list of chunks ready for synthesis
+        """
+        self.buffer += token
+        return self._drain()
+
+    def flush(self) -> list[str]:
+        """Return whatever is left in the buffer at the end of the stream."""
+        chunks = self._drain()
+        rest = self.buffer.strip()
+        self.buffer = ""
+        if rest:
+            chunks.append(rest)
+        return chunks
+
+    def _drain(self) -> list[str]:
+        chunks = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                return chunks
+            chunk = self.buffer[:cut].strip()
+            self.buffer = self.buffer[cut:].lstrip()
+            if chunk:
+                chunks.append(chunk)
+
+    def _find_cut(self) -> int | None:
+        """Index in the buffer where the next chunk ends, or None to keep waiting."""
+        last_clause_cut = None
+        for match in BOUNDARY_PATTERN.finditer(self.buffer):
+            end = match.end()
+            if end > self.max_length:
+                break
+            if not self._is_boundary(match):
+                continue
+            if len(self.buffer[:end].strip()) < self.min_length:
+                continue
+            if match.group()[0] in SENTENCE_END_CHARS:
+                return end
+            last_clause_cut = end
+
+        # sentence is getting too long; split at the last clause boundary or whitespace
+        if len(self.buffer) > self.max_length:
+            if last_clause_cut is not None:
+                return last_clause_cut
+            space = self.buffer.rfind(" ", 0, self.max_length)
+            return space if space > 0 else self.max_length
+        return None
+
+    def _is_boundary(self, match: re.Match) -> bool:
+        """Check that a dot really ends a sentence."""
+        punctuation = match.group()
+        if not punctuation.startswith(".") or len(punctuation.rstrip("\"')]")) > 1:
+            return True
+        previous_word = PREVIOUS_WORD_PATTERN.search(self.buffer[: match.start()])
+        if previous_word is None:
+            return True
+        word = previous_word.group(1).lstrip("(\"'")
+        # initials such as "J. Smith"
+        if len(word) == 1 and word.isupper():
+            return False
+        return word.lower() not in ABBREVIATIONS
+
+
+def chunk_text(text: str, min_length: int = 40, max_length: int = 250) -> list[str]:
+    """Chunk a complete response, for callers that do not stream.
+    :param text: response text
+    :param min_length: shorter sentences are merged with the next one
+    :param max_length: longer text is split at a clause boundary or whitespace
+    :returns: list of chunks ready for synthesis
+    """
+    return chunk_stream([text], min_length, max_length)
+
+
+def chunk_stream(
+    tokens: Iterable[str], min_length: int = 40, max_length: int = 250
+) -> list[str]:
+    """Chunk a sequence of tokens, e.g. a recorded LLM stream.
+    :param tokens: iterable of text fragments
+    :param min_length: shorter sentences are merged with the next one
+    :param max_length: longer text is split at a clause boundary or whitespace
+    :returns: list of chunks ready for synthesis
+    """
+    chunker = SpeechChunker(min_length, max_length)
+    chunks = []
+    for token in tokens:
+        chunks.extend(chunker.feed(token))
+    chunks.extend(chunker.flush())
+    return chunks
@@ -0,0 +1,324 @@
+""" Token and cost accounting of LLM and embedding calls.
+
+Every LLM call through the gateway and every embedding request records its
+prompt and completion tokens in the usage ledger, under
+- the owner: the conversation of the turn, or a pipeline run, set by usage_owner;
+- the feature that made the call, e.g. agent, knowledge_answer, news_summary,
+  set by usage_feature around the code of a route or tool;
+- the model, which sets the price per 1K tokens.
+The ledger keeps the usage of the most recent owners for the usage endpoint;
+with several workers it is shared through the session store, see
+UsageLedger.share. Totals per feature and model are exported as Prometheus
+counters. Like the latency metrics, the owner is not a metric label.
+
+BudgetGuard compares the usage of an owner with a token or cost budget, so
+that expensive paths can be downgraded or skipped once a conversation is
+over its budget.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, Mapping, Optional, Tuple
+
+from src.metrics import metrics
+from src.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# USD per 1K (prompt, completion) tokens of the Azure OpenAI models; LLM_PRICES overrides them,
+# e.g. {"gpt-4": [0.03, 0.06]} for contract prices
+MODEL_PRICES = {
+    "gpt-35-turbo": (0.0015, 0.002),
+    "gpt-35-turbo-16k": (0.003, 0.004),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-32k": (0.06, 0.12),
+    "text-davinci-003": (0.02, 0.02),
+    "text-embedding-ada-002": (0.0001, 0.0),
+}
+MODEL_PRICES.update(
+    {
+        model: tuple(price)
+        for model, price in json.loads(os.getenv("LLM_PRICES", "{}")).items()
+    }
+)
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+LLM_TOKENS = metrics.counter(
+    "vocode_hsbc_llm_tokens_total",
+    "Tokens sent to and generated by models",
+    ("feature", "model", "kind"),
+)
+LLM_COST = metrics.counter(
+    "vocode_hsbc_llm_cost_usd_total",
+    "Estimated cost of model calls in USD",
+    ("feature", "model"),
+)
+LLM_CALLS = metrics.counter(
+    "vocode_hsbc_llm_calls_total", "Model calls", ("feature", "model")
+)
+BUDGET_ACTIONS = metrics.counter(
+    "vocode_hsbc_budget_actions_total",
+    "Requests of owners over their budget, by the action taken instead of the expensive path",
+    ("action",),
+)
+
+# conversation_id or pipeline run the current calls are made for
+current_owner: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "usage_owner", default=None
+)
+# route or tool the current calls are made for
+current_feature: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "usage_feature", default="other"
+)
+
+
+@contextmanager
+def usage_owner(owner: Optional[str]) -> Iterator[None]:
+    """Record the usage of the enclosed calls for a conversation or pipeline run.
+    Work sent to other threads has to run in a copy of the context, see contextvars.copy_context.
+    """
+    token = current_owner.set(owner)
+    try:
+        yield
+    finally:
+        current_owner.reset(token)
+
+
+@contextmanager
+def usage_feature(feature: str) -> Iterator[None]:
+    """Record the usage of the enclosed calls for a feature; the innermost feature wins."""
+    token = current_feature.set(feature)
+    try:
+        yield
+    finally:
+        current_feature.reset(token)
+
+
+def model_price(model: str) -> Tuple[float, float]:
+    """Price per 1K (prompt, completion) tokens of a model, by the longest known prefix of its name.
+    Versioned names (gpt-35-turbo-0613) and OpenAI names (gpt-3.5-turbo) use the price of the base model.
+    """
+    name = (model or "").lower().replace("gpt-3.5", "gpt-35")
+    matches = [known for known in MODEL_PRICES if name.startswith(known)]
+    if not matches:
+        return 0.0, 0.0
+    return MODEL_PRICES[max(matches, key=len)]
+
+
+@dataclass
+class Usage:
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost: float = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, other: "Usage") -> None:
+        self.calls += other.calls
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cost += other.cost
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "cost_usd": round(self.cost, 6),
+        }
+
+
+class UsageLedger:
+    """Usage per owner, feature and model of the most recent max_owners owners."""
+
+    def __init__(self, max_owners: int = 10_000):
+        self.max_owners = max_owners
+        self.owners: OrderedDict[str, dict[Tuple[str, str], Usage]] = OrderedDict()
+        # session store shared by the workers, see share
+        self.store = None
+        self._lock = threading.Lock()
+
+    def share(self, store) -> None:
+        """Keep the usage of every owner in a session store shared by the workers, e.g. the
+        redis store, so that the usage endpoint and the budget of a conversation see the
+        calls of every worker that served it. A conversation is served by one worker at a
+        time, which loads its usage from the store and writes it back after every call.
+        :param store: session store, see src.session_store
+        """
+        self.store = store
+
+    @staticmethod
+    def _store_key(owner: str) -> str:
+        return f"usage:{owner}"
+
+    def _load(self, owner: str) -> dict[Tuple[str, str], Usage]:
+        """Usage entries of an owner from the shared store."""
+        return {
+            (row["feature"], row["model"]): Usage(
+                row["calls"],
+                row["prompt_tokens"],
+                row["completion_tokens"],
+                row["cost"],
+            )
+            for row in self.store.load(self._store_key(owner))
+        }
+
+    def _entries(self, owner: str) -> dict[Tuple[str, str], Usage]:
+        """Usage entries of an owner, loaded from the shared store on first use; call with the lock."""
+        entries = self.owners.get(owner)
+        if entries is None:
+            entries = self.owners[owner] = self._load(owner) if self.store else {}
+            while len(self.owners) > self.max_owners:
+                self.owners.popitem(last=False)
+        self.owners.move_to_end(owner)
+        return entries
+
+    def record(
+        self,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int = 0,
+        feature: Optional[str] = None,
+        owner: Optional[str] = None,
+    ) -> Usage:
+        """Record one model call.
+        :param model: model name, e.g. gpt-35-turbo
+        :param feature: defaults to the current usage feature
+        :param owner: defaults to the current usage owner; calls without owner are only counted in the metrics
+        :returns: usage and estimated cost of the call
+        """
+        feature = feature or current_feature.get()
+        owner = owner or current_owner.get()
+        prompt_price, completion_price = model_price(model)
+        cost = (
+            prompt_tokens * prompt_price + completion_tokens * completion_price
+        ) / 1000
+        usage = Usage(1, prompt_tokens, completion_tokens, cost)
+        LLM_CALLS.inc(1, feature, model)
+        LLM_TOKENS.inc(prompt_tokens, feature, model, "prompt")
+        if completion_tokens:
+            LLM_TOKENS.inc(completion_tokens, feature, model, "completion")
+        LLM_COST.inc(usage.cost, feature, model)
+        if owner is not None:
+            with self._lock:
+                entries = self._entries(owner)
+                entries.setdefault((feature, model), Usage()).add(usage)
+                rows = [
+                    {"feature": f, "model": m, **vars(u)}
+                    for (f, m), u in entries.items()
+                ]
+            if self.store:
+                try:
+                    self.store.save(self._store_key(owner), rows)
+                except Exception as e:
+                    logger.warning(f"Could not share the usage of {owner}: {e!r}")
+        return usage
+
+    def total(self, owner: Optional[str] = None) -> Usage:
+        """Usage of an owner over all features and models, of the current owner by default."""
+        owner = owner or current_owner.get()
+        total = Usage()
+        if owner is None:
+            return total
+        with self._lock:
+            for usage in self._entries(owner).values():
+                total.add(usage)
+        return total
+
+    def report(self, owner: str) -> dict[str, Any]:
+        """Usage of an owner in total and by feature and model, for the usage endpoint.
+        When shared, the report is read from the store, so any worker can answer it.
+        """
+        if self.store:
+            entries = sorted(self._load(owner).items())
+        else:
+            with self._lock:
+                entries = sorted(self.owners.get(owner, {}).items())
+        total = Usage()
+        for _, usage in entries:
+            total.add(usage)
+        return {
+            "total": total.as_dict(),
+            "by_feature": [
+                {"feature": feature, "model": model, **usage.as_dict()}
+                for (feature, model), usage in entries
+            ],
+        }
+
+
+# usage of the whole worker
+ledger = UsageLedger()
+
+
+def record_llm_output(
+    llm_output: Optional[Mapping[str, Any]],
+    default_model: str,
+    estimate: Callable[[], Tuple[int, int]],
+    feature: Optional[str] = None,
+    owner: Optional[str] = None,
+) -> Usage:
+    """Record a langchain LLM or chat model call from the token usage in its llm_output.
+    :param estimate: (prompt tokens, completion tokens) counted locally, when the model does not report its usage
+    """
+    llm_output = llm_output or {}
+    token_usage = llm_output.get("token_usage")
+    if token_usage:
+        prompt_tokens, completion_tokens = token_usage.get(
+            "prompt_tokens", 0
+        ), token_usage.get("completion_tokens", 0)
+    else:
+        prompt_tokens, completion_tokens = estimate()
+    return ledger.record(
+        llm_output.get("model_name") or default_model,
+        prompt_tokens,
+        completion_tokens,
+        feature,
+        owner,
+    )
+
+
+def record_embedding(
+    texts: Iterable[str],
+    response: Optional[Mapping[str, Any]] = None,
+    model: str = EMBEDDING_MODEL,
+) -> Usage:
+    """Record an embedding request; tokens are counted locally unless the response reports its usage."""
+    usage = (response or {}).get("usage") or {}
+    prompt_tokens = usage.get("prompt_tokens")
+    if prompt_tokens is None:
+        prompt_tokens = sum(count_tokens(text) for text in texts)
+    return ledger.record(model, prompt_tokens)
+
+
+class BudgetGuard:
+    """Whether an owner is over its token or cost budget; a budget of 0 is unlimited."""
+
+    def __init__(
+        self, usage_ledger: UsageLedger, max_tokens: int = 0, max_cost: float = 0.0
+    ):
+        self.ledger = usage_ledger
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+
+    def exceeded(self, owner: Optional[str] = None) -> bool:
+        """Whether the owner, by default the current owner, has used up its budget."""
+        if not self.max_tokens and not self.max_cost:
+            return False
+        usage = self.ledger.total(owner)
+        return (bool(self.max_tokens) and usage.total_tokens >= self.max_tokens) or (
+            bool(self.max_cost) and usage.cost >= self.max_cost
+        )
+
+    def limit(self, action: str) -> None:
+        """Count an action taken instead of an expensive path, e.g. downgraded or truncated."""
+        BUDGET_ACTIONS.inc(1, action)
+        logger.info(f"Usage owner {current_owner.get()} is over budget: {action}")
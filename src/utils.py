@@ -1,13 +1,19 @@
+import contextvars
 import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, TypeVar
 
 import requests
 
+T = TypeVar("T")
+
 
 def send_post_request(
     url: str,
     requestMsg: dict[str, dict[str, str]],
     headers: dict[str, str],
     has_timeout_already: bool = False,
+    stream: bool = False,
 ) -> requests.models.Response:
     """
     Send a post request to url with data in request_msg and header also.
@@ -16,11 +22,14 @@ def send_post_request(
     :param requestMsg: The data to be sent in the post request.
     :param headers: The headers to be sent with the post request.
     :param has_timeout_already: A flag to indicate if a timeout has already occurred.
+    :param stream: Do not download the body before returning, read it with iter_content.
     :returns: The response from the post request.
     """
     result = None
     try:
-        result = requests.post(url, data=json.dumps(requestMsg), headers=headers)
+        result = requests.post(
+            url, data=json.dumps(requestMsg), headers=headers, stream=stream
+        )
         if result.status_code != 200:
             result.raise_for_status()
         return result
@@ -31,10 +40,36 @@ def send_post_request(
             raise SystemExit("Timeout error. Tried again but still failed.")
         else:
             print(f"Timeout error. Trying again with {url}")
-            return send_post_request(url, requestMsg, headers, True)
+            return send_post_request(url, requestMsg, headers, True, stream)
 
     except requests.exceptions.TooManyRedirects:
         print(f"The URL {url} is bad. Try a different one.")
     except requests.exceptions.RequestException as e:
         # catastrophic error. bail.
         raise SystemExit(e)
+
+
+def prefetch(iterator: Iterator[T]) -> Iterator[T]:
+    """
+    Iterate while the next item is produced in a background thread, e.g. load
+    the next page of results while the current one is processed.
+
+    The iterator runs in a copy of the caller's context, so its spans belong
+    to the caller's turn.
+
+    :param iterator: The iterator to read ahead of.
+    :returns: The items of iterator, in order.
+    """
+    context = contextvars.copy_context()
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        future = executor.submit(context.run, next, iterator, None)
+        while True:
+            item = future.result()
+            if item is None:
+                return
+            future = executor.submit(context.run, next, iterator, None)
+            yield item
+    finally:
+        # a caller that stops early does not wait for the item read ahead
+        executor.shutdown(wait=False, cancel_futures=True)
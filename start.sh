@@ -2,5 +2,10 @@
 
 # Active the python venv enviornment
 source /root/vocode_python_env/bin/activate
-# Start the FastAPI application
-nohup uvicorn main:app --host 0.0.0.0 --port 8000 &
\ No newline at end of file
+# Remove the drain file left by stop.sh, otherwise the new workers drain straight away
+rm -f "${DRAIN_FILE:-/tmp/vocode-hsbc.drain}"
+# Metrics of all workers are summed from this directory; clear the metrics of the previous run
+export PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-/tmp/vocode-hsbc-metrics}"
+rm -rf "${PROMETHEUS_MULTIPROC_DIR:?}" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+# Start the FastAPI application with WEB_CONCURRENCY worker processes
+nohup uvicorn main:app --host 0.0.0.0 --port 8000 --workers "${WEB_CONCURRENCY:-4}" &
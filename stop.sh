@@ -1,4 +1,17 @@
 #!/bin/bash
 
+# Drain the workers: refuse new conversations and wait for the active ones to end
+DRAIN_FILE="${DRAIN_FILE:-/tmp/vocode-hsbc.drain}"
+DRAIN_TIMEOUT_SECONDS="${DRAIN_TIMEOUT_SECONDS:-30}"
+touch "$DRAIN_FILE"
+for ((i = 0; i < DRAIN_TIMEOUT_SECONDS; i++)); do
+    if [ -z "$(ss -Htn state established '( sport = :8000 )' 2>/dev/null)" ]; then
+        break
+    fi
+    sleep 1
+done
+# Workers close the remaining conversations after the drain timeout, give them a moment
+sleep 2
+
 # Stop the FastAPI application
-pkill -f uvicorn
\ No newline at end of file
+pkill -f uvicorn
@@ -0,0 +1,70 @@
+from langchain.agents import AgentExecutor
+from langchain.chat_models.fake import FakeListChatModel
+from langchain.schema import AgentAction, AIMessage, HumanMessage
+from langchain.tools import Tool
+
+from src.agent_prompt import PROMPT_TOKENS, PrefixCachedChatAgent, compact_description
+
+TOOLS = [
+    Tool(
+        name="hsbc knowledge search tool",
+        description="hsbc knowledge search tool(input: str) -> str - useful for when you need to answer questions about hsbc related knowledge",
+        func=lambda query: "HSBC time deposits start from HKD 10,000.",
+    ),
+    Tool(
+        name="reject tool",
+        description="useful for when you need to answer questions not related to HSBC",
+        func=str,
+    ),
+]
+
+
+def test_prompt_starts_with_the_same_prefix_for_every_call():
+    """History, input and scratchpad only follow the static prefix."""
+    agent = PrefixCachedChatAgent.from_llm_and_tools(
+        FakeListChatModel(responses=[]), TOOLS, system_message="You are HSBC."
+    )
+    prompt = agent.llm_chain.prompt
+    first = prompt.format_messages(input="Hello", chat_history=[], agent_scratchpad=[])
+    later = prompt.format_messages(
+        input="And for {3} months?",
+        chat_history=[
+            HumanMessage(content="What is a time deposit?"),
+            AIMessage(content="A fixed term deposit."),
+        ],
+        agent_scratchpad=agent._construct_scratchpad(
+            [(AgentAction("reject tool", "x", "log"), "observation")]
+        ),
+    )
+
+    assert first[0].content == later[0].content
+    assert first[0].content.startswith("You are HSBC.")
+    assert (
+        "> hsbc knowledge search tool: answer questions about hsbc related knowledge"
+        in first[0].content
+    )
+    assert later[-3].content.endswith("And for {3} months?")
+    assert "TOOL RESPONSE:" in later[-1].content
+    assert sum(PROMPT_TOKENS.counts[("prefix",)]) >= 2
+
+
+def test_compact_description_drops_signature_and_boilerplate():
+    assert compact_description(TOOLS[1]) == "answer questions not related to HSBC"
+
+
+def test_agent_parses_actions_of_the_compact_format():
+    """The compact format instructions still produce actions the output parser understands."""
+    llm = FakeListChatModel(
+        responses=[
+            '```json\n{"action": "hsbc knowledge search tool", "action_input": "time deposit"}\n```',
+            '{"action": "Final Answer", "action_input": "From HKD 10,000."}',
+        ]
+    )
+    agent = PrefixCachedChatAgent.from_llm_and_tools(
+        llm, TOOLS, system_message="You are HSBC."
+    )
+    executor = AgentExecutor.from_agent_and_tools(agent=agent, tools=TOOLS)
+    assert (
+        executor.run(input="Minimum amount of a time deposit?", chat_history=[])
+        == "From HKD 10,000."
+    )
@@ -0,0 +1,112 @@
+from types import SimpleNamespace as NS
+
+from langchain.docstore.document import Document
+
+from src.docsearch.chunker import StructuredChunker
+from src.docsearch.ocr_parser import extract_blocks_from_img
+from src.tokens import count_tokens
+
+
+def paragraph(content, page, offset, role=None):
+    return NS(
+        role=role,
+        content=content,
+        bounding_regions=[NS(page_number=page)],
+        spans=[NS(offset=offset, length=len(content))],
+    )
+
+
+class StubAnalysisClient:
+    def __init__(self, result):
+        self.result = result
+
+    def begin_analyze_document(self, model_id, document):
+        return NS(result=lambda: self.result)
+
+
+def test_blocks_carry_page_and_section_and_drop_page_furniture():
+    table = NS(
+        row_count=2,
+        column_count=2,
+        cells=[
+            NS(row_index=0, column_index=0, content="Term"),
+            NS(row_index=0, column_index=1, content="Rate"),
+            NS(row_index=1, column_index=0, content="3 months"),
+            NS(row_index=1, column_index=1, content="3.50%"),
+        ],
+        bounding_regions=[NS(page_number=2)],
+        spans=[NS(offset=300, length=40)],
+    )
+    result = NS(
+        pages=[],
+        paragraphs=[
+            paragraph("HSBC Product guide", 1, 0, "pageHeader"),
+            paragraph("Time deposits", 1, 50, "sectionHeading"),
+            paragraph("The minimum deposit is HKD 10,000.", 1, 80),
+            paragraph("Page 1", 1, 200, "pageNumber"),
+            paragraph("Interest rates", 2, 250, "sectionHeading"),
+            # cell paragraph of the table, kept as part of the table
+            paragraph("3.50%", 2, 320),
+        ],
+        tables=[table],
+    )
+
+    blocks = extract_blocks_from_img(bytearray(b"image"), StubAnalysisClient(result))
+
+    assert [
+        (b.page_content, b.metadata["page"], b.metadata["section"], b.metadata["kind"])
+        for b in blocks
+    ] == [
+        ("The minimum deposit is HKD 10,000.", 1, "Time deposits", "paragraph"),
+        ("Term | Rate\n3 months | 3.50%", 2, "Interest rates", "table"),
+    ]
+
+
+def block(text, section, page=1, kind="paragraph"):
+    return Document(
+        page_content=text,
+        metadata={
+            "source": "guide.pdf",
+            "page": page,
+            "section": section,
+            "kind": kind,
+        },
+    )
+
+
+def test_chunks_do_not_straddle_sections_and_start_with_the_heading():
+    blocks = [
+        block("Fixed rate for 7 days to 12 months.", "Time deposits"),
+        block("Minimum HKD 10,000.", "Time deposits", page=2),
+        block("Early withdrawal needs approval.", "Early withdrawal", page=2),
+    ]
+
+    chunks = StructuredChunker(max_tokens=100).split_documents(blocks)
+
+    assert [c.page_content for c in chunks] == [
+        "Time deposits\nFixed rate for 7 days to 12 months.\n\nMinimum HKD 10,000.",
+        "Early withdrawal\nEarly withdrawal needs approval.",
+    ]
+    assert chunks[0].metadata == {
+        "source": "guide.pdf",
+        "section": "Time deposits",
+        "page": 1,
+        "page_end": 2,
+    }
+
+
+def test_large_blocks_are_split_within_the_token_budget():
+    rows = "\n".join(f"{term} months | {term / 10:.2f}%" for term in range(1, 60))
+    table = block("Term | Rate\n" + rows, "Interest rates", kind="table")
+    text = block(
+        " ".join(f"Sentence number {i} about deposits." for i in range(80)), "Terms"
+    )
+
+    chunks = StructuredChunker(max_tokens=60).split_documents([table, text])
+
+    assert len(chunks) > 4
+    assert all(count_tokens(c.page_content) <= 60 for c in chunks)
+    table_chunks = [c for c in chunks if c.metadata["section"] == "Interest rates"]
+    assert all(
+        c.page_content.startswith("Interest rates\nTerm | Rate\n") for c in table_chunks
+    )
@@ -0,0 +1,80 @@
+from src.conversation_memory import (
+    MEMORY_TOKENS_SAVED,
+    SUMMARY_PREFIX,
+    ConversationMemoryStore,
+    TokenBudgetMemory,
+)
+from src.session_store import InMemorySessionStore
+from src.tokens import count_message_tokens
+
+KNOWLEDGE = (
+    "HSBC time deposits offer a fixed interest rate for terms from 7 days to 12 months. "
+    * 20
+)
+
+
+def run_turns(store: ConversationMemoryStore, conversation_id: str, turns: int) -> None:
+    for i in range(turns):
+        memory = store.load(conversation_id)
+        memory.save_context(
+            {"input": f"Question {i} about time deposits?"}, {"output": KNOWLEDGE}
+        )
+        store.save(conversation_id, memory)
+
+
+def test_prompt_memory_stays_within_budget():
+    """Long answers are truncated and only the newest messages that fit are returned."""
+    memory = TokenBudgetMemory(max_tokens=300, max_message_tokens=50)
+    for i in range(10):
+        memory.save_context({"input": f"Question {i}?"}, {"output": KNOWLEDGE})
+    saved_before = MEMORY_TOKENS_SAVED.value()
+
+    messages = memory.load_memory_variables({})["chat_history"]
+
+    assert count_message_tokens(messages) <= 300
+    assert messages[-1].content.endswith("...")
+    assert messages[-1].additional_kwargs["original_tokens"] > 50
+    assert MEMORY_TOKENS_SAVED.value() > saved_before
+
+
+def test_compaction_folds_old_turns_into_summary():
+    """Turns over the budget are replaced by a summary; the newest turns are kept verbatim."""
+    folded = []
+
+    def summarise(summary, messages):
+        folded.extend(messages)
+        return (
+            summary + " " if summary else ""
+        ) + f"customer asked {len(messages) // 2} questions"
+
+    store = ConversationMemoryStore(
+        InMemorySessionStore(), summarise, max_tokens=400, max_message_tokens=60
+    )
+    run_turns(store, "call-1", 6)
+    store.executor.shutdown(wait=True)
+
+    memory = store.load("call-1")
+    prompt = memory.load_memory_variables({})["chat_history"]
+    assert folded
+    assert prompt[0].content.startswith(SUMMARY_PREFIX + "customer asked")
+    assert prompt[-1].content == memory.chat_memory.messages[-1].content
+    assert count_message_tokens(prompt) <= 400
+    assert memory.summarised_tokens > 0
+
+
+def test_save_appends_to_history_rewritten_by_compaction():
+    """A turn that started before a compaction does not bring the folded messages back."""
+    store = ConversationMemoryStore(
+        InMemorySessionStore(), lambda s, m: "earlier questions", max_tokens=400
+    )
+    run_turns(store, "call-1", 3)
+    store.executor.shutdown(wait=True)
+    memory = store.load("call-1")
+    stored_before = len(store.session_store.load("call-1"))
+
+    store.compact("call-1")
+    memory.save_context({"input": "And for 3 months?"}, {"output": "It is 4.2% p.a."})
+    store.save("call-1", memory)
+
+    assert len(store.session_store.load("call-1")) <= stored_before + 2
+    assert store.load("call-1").chat_memory.messages[-1].content == "It is 4.2% p.a."
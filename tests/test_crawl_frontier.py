@@ -0,0 +1,129 @@
+import os
+from itertools import islice
+
+from dags.crawl_frontier import CrawlFrontier, HostLimiter, crawl, normalise_url
+
+SITE = "https://www.hsbc.com.hk"
+LINKS = {
+    "/": [
+        "/accounts/",
+        "/cards/",
+        "https://www.hsbc.com.hk/accounts/#main",
+        "/zh-hk/",
+        "https://other.site/",
+    ],
+    "/accounts/": [
+        "/accounts/time-deposit/",
+        "/cards/?utm_source=nav",
+        "/forms/account.pdf",
+    ],
+    "/cards/": ["/cards/red/", "/accounts/"],
+    "/accounts/time-deposit/": ["/accounts/time-deposit/rates/"],
+    "/cards/red/": [],
+}
+
+
+class FakeResponse:
+    status_code = 200
+    headers = {"Content-Type": "text/html; charset=utf-8"}
+
+    def __init__(self, path: str):
+        self.content = "".join(
+            f'<a href="{link}">link</a>' for link in LINKS.get(path, [])
+        )
+
+
+def fetch(url: str) -> FakeResponse:
+    return FakeResponse(url[len(SITE) :])
+
+
+def new_frontier() -> CrawlFrontier:
+    frontier = CrawlFrontier(
+        [SITE[len("https://") :]], max_depth=2, excluded_prefixes=("/zh-hk/",)
+    )
+    frontier.add(normalise_url(SITE), depth=0)
+    return frontier
+
+
+def test_urls_are_normalised():
+    assert normalise_url(
+        "HTTPS://WWW.HSBC.com.hk:443//cards//red/?utm_source=x&b=2&a=1#apply"
+    ) == ("https://www.hsbc.com.hk/cards/red/?a=1&b=2")
+    assert (
+        normalise_url("../red/", "https://www.hsbc.com.hk/cards/platinum/")
+        == "https://www.hsbc.com.hk/cards/red/"
+    )
+    assert normalise_url("mailto:help@hsbc.com.hk") is None
+    assert normalise_url("javascript:void(0)") is None
+
+
+def test_frontier_orders_by_depth_and_freshness():
+    frontier = new_frontier()
+    frontier.add(SITE + "/cards/", depth=1)
+    frontier.add(
+        SITE + "/insights/rates/", depth=1, freshness=0.5, label="Rate outlook"
+    )
+
+    assert not frontier.add(SITE + "/cards/", depth=1)
+    assert not frontier.add("https://other.site/", depth=1)
+    assert not frontier.add(SITE + "/zh-hk/", depth=1)
+    assert not frontier.add(SITE + "/deep/", depth=3)
+    assert [frontier.pop().url for _ in range(3)] == [
+        SITE + "/",
+        SITE + "/insights/rates/",
+        SITE + "/cards/",
+    ]
+    assert frontier.labels == {SITE + "/insights/rates/": "Rate outlook"}
+
+
+def test_crawl_follows_links_once_and_resumes(tmp_path):
+    state_path = str(tmp_path / "crawl-state.json")
+    limiter = HostLimiter(max_concurrency=2, min_interval=0)
+
+    frontier = new_frontier()
+    pages = crawl(frontier, fetch, limiter, max_workers=1, state_path=state_path)
+    first_run = [entry.url for entry, _ in islice(pages, 2)]
+    # only the homepage was processed before the task stopped, e.g. at the DAG timeout
+    frontier.finish(SITE + "/")
+    pages.close()
+    assert os.path.exists(state_path)
+
+    frontier = CrawlFrontier(
+        [SITE[len("https://") :]], max_depth=2, excluded_prefixes=("/zh-hk/",)
+    )
+    assert frontier.restore(state_path)
+    second_run = [
+        entry.url
+        for entry, _ in crawl(
+            frontier, fetch, limiter, max_workers=2, state_path=state_path
+        )
+    ]
+
+    assert first_run == [SITE + "/", SITE + "/accounts/"]
+    # the unfinished page is fetched again
+    assert sorted(second_run) == [
+        SITE + "/accounts/",
+        SITE + "/accounts/time-deposit/",
+        SITE + "/cards/",
+        SITE + "/cards/red/",
+    ]
+    assert not os.path.exists(state_path)
+
+
+def test_allowed_hosts_and_metadata_are_restored(tmp_path):
+    state_path = str(tmp_path / "crawl-state.json")
+    frontier = new_frontier()
+    # hosts of the wealth insights articles are allowed after the frontier is seeded
+    frontier.allowed_hosts.add("www.hsbc.com")
+    frontier.add("https://www.hsbc.com/insights/", depth=1)
+    frontier.metadata["template_urls"] = [SITE + "/"]
+    frontier.save(state_path)
+
+    frontier = CrawlFrontier(
+        [SITE[len("https://") :]], max_depth=2, excluded_prefixes=("/zh-hk/",)
+    )
+    assert frontier.restore(state_path)
+
+    assert frontier.metadata == {"template_urls": [SITE + "/"]}
+    assert frontier.add("https://www.hsbc.com/insights/markets/", depth=2)
+    assert not frontier.add("https://other.site/", depth=1)
@@ -0,0 +1,109 @@
+import re
+from typing import List
+
+import faiss
+import numpy as np
+from langchain.embeddings.base import Embeddings
+from langchain.llms.base import LLM
+from langchain.schema import Document
+
+from src.docsearch.docsearch import (
+    docsearch_query_indexes,
+    docsearch_query_indexes_batch,
+)
+
+TOPICS = [
+    "mortgage",
+    "credit card",
+    "time deposit",
+    "travel insurance",
+    "stock trading",
+    "fx rates",
+]
+
+
+class TopicEmbeddings(Embeddings):
+    """One-hot embedding of the topic mentioned in a text; counts the embedding requests."""
+
+    def __init__(self, max_inputs: int = 16):
+        self.requests = 0
+        self.max_inputs = max_inputs
+
+    def vector(self, text: str) -> List[float]:
+        return [1.0 if topic in text else 0.0 for topic in TOPICS]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # as Azure OpenAI, which rejects requests of more than 16 inputs
+        if len(texts) > self.max_inputs:
+            raise ValueError(f"Too many inputs: {len(texts)}")
+        self.requests += 1
+        return [self.vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.requests += 1
+        return self.vector(text)
+
+
+class ContextEchoLLM(LLM):
+    """Answers with the first document of the stuffed prompt and the question."""
+
+    @property
+    def _llm_type(self) -> str:
+        return "context-echo"
+
+    def _call(self, prompt: str, stop=None, run_manager=None, **kwargs) -> str:
+        context = prompt.split("\n\n")[1]
+        question = re.search(r"Question: (.*)", prompt).group(1)
+        return f"{question} -> {context}"
+
+
+def build_index(embeddings: TopicEmbeddings):
+    texts = [f"All about {topic} at HSBC." for topic in TOPICS]
+    index = faiss.IndexFlatL2(len(TOPICS))
+    index.add(np.array(embeddings.embed_documents(texts), dtype="float32"))
+    return index, {i: Document(page_content=t) for i, t in enumerate(texts)}
+
+
+def test_batch_answers_match_single_queries_in_order():
+    embeddings = TopicEmbeddings()
+    index, doc_store = build_index(embeddings)
+    queries = [f"What about {topic}?" for topic in reversed(TOPICS)]
+    llm = ContextEchoLLM()
+
+    single = [
+        docsearch_query_indexes(q, index, doc_store, embeddings, llm) for q in queries
+    ]
+    embeddings.requests = 0
+    batch = docsearch_query_indexes_batch(
+        queries, index, doc_store, embeddings, llm, max_workers=3
+    )
+
+    assert batch == single
+    assert batch[0] == "What about fx rates? -> All about fx rates at HSBC."
+    # all queries are embedded in one request
+    assert embeddings.requests == 1
+
+
+def test_large_batch_is_embedded_in_requests_of_16_queries():
+    embeddings = TopicEmbeddings()
+    index, doc_store = build_index(embeddings)
+    queries = [f"What about {topic}?" for topic in TOPICS] * 6
+    llm = ContextEchoLLM()
+
+    embeddings.requests = 0
+    batch = docsearch_query_indexes_batch(queries, index, doc_store, embeddings, llm)
+
+    assert len(batch) == 36
+    assert batch[-1] == "What about fx rates? -> All about fx rates at HSBC."
+    assert embeddings.requests == 3
+
+
+def test_batch_of_no_queries():
+    embeddings = TopicEmbeddings()
+    index, doc_store = build_index(embeddings)
+    assert (
+        docsearch_query_indexes_batch(
+            [], index, doc_store, embeddings, ContextEchoLLM()
+        )
+        == []
+    )
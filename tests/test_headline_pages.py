@@ -0,0 +1,142 @@
+import datetime
+import json
+import time
+
+import pytest
+
+from src.newsearch.refinitiv_query import (
+    RKDRequestFailed,
+    iter_distinct_articles,
+    iter_freetext_headline_pages,
+    iter_news_stories,
+)
+from src.utils import prefetch
+
+
+def headline(i, text, status="Usable"):
+    created = datetime.datetime(
+        2023, 7, 4, 12, tzinfo=datetime.timezone.utc
+    ) - datetime.timedelta(hours=i)
+    return {
+        "ID": f"id{i}",
+        "ST": status,
+        "CT": created.isoformat(),
+        "HT": text,
+        "TO": "",
+        "CO": "",
+        "LN": "en",
+    }
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.content = json.dumps(payload).encode()
+
+    def iter_content(self, chunk_size):
+        return iter([self.content[:10], self.content[10:]])
+
+    def close(self):
+        pass
+
+
+class FakeHeadlineService:
+    """Pages of headlines, newest first, ending at the requested EndTime."""
+
+    def __init__(self, headlines):
+        self.headlines = headlines
+        self.requests = []
+
+    def send_post_request(self, url, message, headers, **kwargs):
+        request = message["RetrieveHeadlineML_Request_1"]["HeadlineMLRequest"]
+        self.requests.append(request)
+        end_time = datetime.datetime.fromisoformat(request["EndTime"])
+        page = [
+            h
+            for h in self.headlines
+            if datetime.datetime.fromisoformat(h["CT"])
+            .astimezone()
+            .replace(tzinfo=None)
+            <= end_time
+        ][: request["MaxCount"]]
+        body = {"HEADLINEML": {"HL": page} if page else None}
+        return FakeResponse(
+            {"RetrieveHeadlineML_Response_1": {"HeadlineMLResponse": body}}
+        )
+
+
+def test_pages_stop_once_enough_distinct_articles(monkeypatch):
+    headlines = [
+        headline(0, "HSBC raises Hong Kong prime rate"),
+        headline(1, "UPDATE 1-HSBC raises Hong Kong prime rate"),
+        headline(2, "HSBC to expand wealth business", status="Canceled"),
+        headline(3, "Asian banks rally"),
+        headline(4, "REFILE-Asian banks rally"),
+        headline(5, "HSBC completes sale of Canadian unit"),
+        headline(6, "Hong Kong mortgage applications pick up"),
+        headline(7, "HSBC results beat forecasts"),
+        headline(8, "HSBC names new chief"),
+    ]
+    service = FakeHeadlineService(headlines)
+    monkeypatch.setattr(
+        "src.newsearch.refinitiv_query.send_post_request", service.send_post_request
+    )
+
+    pages = iter_freetext_headline_pages({}, "HSBC", 2, page_size=3)
+    article_pages = list(iter_distinct_articles(pages, max_articles=4))
+
+    assert [[a.id for a in page] for page in article_pages] == [
+        ["id0"],
+        ["id3"],
+        ["id5", "id6"],
+    ]
+    # the page of id7 and id8 is never requested
+    assert len(service.requests) == 3
+    assert all(r["Direction"] == "Older" for r in service.requests)
+
+
+def story_response(status, status_first=True):
+    fields = [
+        ("Status", {"StatusMsg": status}),
+        ("STORYML", {"HL": [{"ID": "id0", "ST": "Usable", "TE": "Story"}]}),
+    ]
+    if not status_first:
+        fields.reverse()
+    return FakeResponse(
+        {"RetrieveStoryML_Response_1": {"StoryMLResponse": dict(fields)}}
+    )
+
+
+@pytest.mark.parametrize("status_first", [True, False])
+def test_stories_of_a_failed_response_are_not_yielded(monkeypatch, status_first):
+    monkeypatch.setattr(
+        "src.newsearch.refinitiv_query.send_post_request",
+        lambda *args, **kwargs: story_response("Failed", status_first),
+    )
+    stories = iter_news_stories({}, ["id0"])
+    with pytest.raises(RKDRequestFailed):
+        next(stories)
+
+
+@pytest.mark.parametrize("status_first", [True, False])
+def test_stories_of_an_ok_response(monkeypatch, status_first):
+    monkeypatch.setattr(
+        "src.newsearch.refinitiv_query.send_post_request",
+        lambda *args, **kwargs: story_response("OK", status_first),
+    )
+    assert [story["ID"] for story in iter_news_stories({}, ["id0"])] == ["id0"]
+
+
+def test_prefetch_reads_one_item_ahead():
+    produced = []
+
+    def items():
+        for i in range(3):
+            produced.append(i)
+            yield i
+
+    iterator = prefetch(items())
+    assert next(iterator) == 0
+    time.sleep(0.2)
+    # the second item was produced while the first was being consumed
+    assert produced == [0, 1]
+    assert list(iterator) == [1, 2]
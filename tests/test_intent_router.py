@@ -0,0 +1,76 @@
+from src.intent_router import (
+    AGENT_ROUTE,
+    GREETING_ROUTE,
+    KNOWLEDGE_ROUTE,
+    REJECT_ROUTE,
+    IntentRouter,
+    classify_intent,
+    greeting_response,
+)
+
+
+def test_greetings_use_zero_call_route():
+    """Small talk is answered without calling the LLM."""
+    for text in ["Hi", "hello there", "Thank you very much", "ok bye", "Good morning"]:
+        assert classify_intent(text).route == GREETING_ROUTE, text
+
+
+def test_short_questions_are_not_small_talk():
+    """Utterances without a greeting word are not answered with a canned greeting."""
+    for text in ["is it good", "good for you", "have it"]:
+        assert classify_intent(text).route != GREETING_ROUTE, text
+    assert classify_intent("thanks that's all for now").route == GREETING_ROUTE
+
+
+def test_off_topic_questions_are_rejected():
+    """Questions unrelated to HSBC go to the reject route."""
+    for text in [
+        "What's the weather like tomorrow?",
+        "Tell me a joke",
+        "How can I open an account at Citibank?",
+    ]:
+        assert classify_intent(text).route == REJECT_ROUTE, text
+
+
+def test_direct_knowledge_questions():
+    """Self-contained product questions use the single-call knowledge route."""
+    for text in [
+        "How can I open an account at HSBC HK?",
+        "What is the interest rate for a savings account?",
+        "What are the fees for an FPS transfer?",
+    ]:
+        assert classify_intent(text).route == KNOWLEDGE_ROUTE, text
+
+
+def test_ambiguous_and_follow_up_questions_go_to_agent():
+    """Follow up questions need the agent memory and tools."""
+    for text in [
+        "",
+        "What about that one?",
+        "Can you explain it again?",
+        "I lost my card",
+        "What is the interest rate on it?",
+        "Are there any fees for that account?",
+    ]:
+        assert classify_intent(text).route == AGENT_ROUTE, text
+
+
+def test_greeting_response():
+    """Canned responses depend on the kind of small talk."""
+    assert "welcome" in greeting_response("thanks a lot")
+    assert "Goodbye" in greeting_response("bye")
+    assert "Hello" in greeting_response("hi")
+
+
+def test_latency_summary():
+    """Per-route latency statistics are reported."""
+    router = IntentRouter()
+    for seconds in [0.1, 0.2, 0.3]:
+        router.record_latency(KNOWLEDGE_ROUTE, seconds)
+    router.record_latency(GREETING_ROUTE, 0.001)
+
+    summary = router.latency_summary()
+    assert summary[KNOWLEDGE_ROUTE]["count"] == 3
+    assert summary[KNOWLEDGE_ROUTE]["p50"] == 0.2
+    assert summary[GREETING_ROUTE]["count"] == 1
+    assert AGENT_ROUTE not in summary
@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+from src.json_stream import JSONArrayNotFound, iter_json_array_items
+
+DOCUMENT = {
+    "Response": {
+        "Status": {"StatusMsg": "OK"},
+        "STORYML": {
+            "HL": [
+                {"ID": str(i), "TE": "<p>港元 rate</p>" * i, "N": 12345}
+                for i in range(20)
+            ]
+            + [987654]
+        },
+    }
+}
+
+
+def chunked(data: bytes, size: int):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 100, 10_000])
+def test_items_decoded_across_chunk_boundaries(chunk_size):
+    body = json.dumps(DOCUMENT, ensure_ascii=False).encode("utf-8")
+    skipped = []
+
+    items = list(
+        iter_json_array_items(
+            chunked(body, chunk_size), "HL", parse_int=str, on_skipped=skipped.append
+        )
+    )
+
+    assert items == json.loads(body, parse_int=str)["Response"]["STORYML"]["HL"]
+    assert '"StatusMsg": "OK"' in skipped[0]
+
+
+def test_items_are_yielded_before_the_document_ends():
+    def chunks():
+        yield b'{"HL": [{"ID": "1"}, '
+        raise AssertionError("read past the first item")
+
+    assert next(iter_json_array_items(chunks(), "HL")) == {"ID": "1"}
+
+
+def test_missing_array():
+    skipped = []
+    with pytest.raises(JSONArrayNotFound):
+        list(
+            iter_json_array_items(
+                [b'{"HEADLINEML": null, "Status": "Failed"}'],
+                "HL",
+                on_skipped=skipped.append,
+            )
+        )
+    assert "Failed" in skipped[0]
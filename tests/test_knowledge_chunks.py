@@ -0,0 +1,22 @@
+from dags.knowledge_chunks import chunk_knowledge
+
+KNOWLEDGE = """Time deposits
+HSBC time deposits offer a fixed interest rate for terms from 7 days to 12 months. The minimum deposit is HKD 10,000.
+- Interest is paid at maturity.
+- Deposits can be placed in the HSBC HK app."""
+
+
+def test_chunks_end_at_lines_and_sentences():
+    assert chunk_knowledge(KNOWLEDGE, max_words=20) == [
+        "Time deposits\nHSBC time deposits offer a fixed interest rate for terms from 7 days to 12 months.",
+        "The minimum deposit is HKD 10,000.\n- Interest is paid at maturity.",
+        "- Deposits can be placed in the HSBC HK app.",
+    ]
+    assert chunk_knowledge(KNOWLEDGE) == [KNOWLEDGE]
+
+
+def test_long_sentences_are_cut():
+    sentence = " ".join(f"word{i}" for i in range(25))
+    assert [
+        len(chunk.split()) for chunk in chunk_knowledge(sentence, max_words=10)
+    ] == [10, 10, 5]
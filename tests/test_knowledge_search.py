@@ -0,0 +1,248 @@
+import asyncio
+import contextlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+import psycopg2
+import psycopg2.errors
+import pytest
+
+from src.knowledge_search import (
+    KnowledgeNotFound,
+    KnowledgeSearch,
+    classify_error,
+    group_chunks,
+    query_similarity,
+)
+from src.tokens import count_tokens
+
+
+def test_chunks_are_grouped_by_page_in_page_order():
+    rows = [
+        ("/accounts/time-deposit/", 2, "Interest is paid at maturity."),
+        ("/premier/", 0, "HSBC Premier needs a balance of HKD 1,000,000."),
+        ("/accounts/time-deposit/", 0, "Time deposits have fixed rates."),
+    ]
+    assert group_chunks(rows) == (
+        "Time deposits have fixed rates.\nInterest is paid at maturity.\n\n"
+        "HSBC Premier needs a balance of HKD 1,000,000."
+    )
+
+
+def test_context_is_cut_at_the_token_budget():
+    first, second, third = (
+        "Time deposits have fixed rates.",
+        "Premier needs HKD 1,000,000.",
+        "Apply in the app.",
+    )
+    rows = [("/a/", 0, first), ("/b/", 0, second), ("/a/", 1, third)]
+    budget = count_tokens(first) + count_tokens(second)
+
+    # the nearest chunk is kept even when it is over the budget
+    assert group_chunks(rows, max_tokens=1) == first
+    assert group_chunks(rows, max_tokens=budget) == f"{first}\n\n{second}"
+
+
+def test_identical_queries_share_one_lookup():
+    calls = []
+    release = threading.Event()
+
+    def lookup(query: str) -> str:
+        calls.append(query)
+        release.wait(timeout=5)
+        return f"answer to {query}"
+
+    search = KnowledgeSearch(lookup, None)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(search.search, q)
+            for q in ["Time deposit rates?", "time deposit  rates"] * 2
+        ]
+        while not search.in_flight:
+            time.sleep(0.001)
+        release.set()
+        answers = {future.result() for future in futures}
+
+    assert calls == ["Time deposit rates?"]
+    assert answers == {"answer to Time deposit rates?"}
+    # answered from the cache
+    assert search.search("TIME DEPOSIT RATES") == "answer to Time deposit rates?"
+    assert calls == ["Time deposit rates?"]
+
+
+def test_async_searches_coalesce_and_failures_are_not_cached():
+    calls = []
+
+    async def alookup(query: str) -> str:
+        calls.append(query)
+        await asyncio.sleep(0.01)
+        if len(calls) == 1:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        return "Time deposits have fixed rates."
+
+    async def main():
+        search = KnowledgeSearch(None, alookup)
+        failures = await asyncio.gather(
+            *(search.asearch("time deposit") for _ in range(3)), return_exceptions=True
+        )
+        return failures, await search.asearch("time deposit")
+
+    failures, answer = asyncio.run(main())
+
+    assert [classify_error(failure) for failure in failures] == [
+        "database_connection"
+    ] * 3
+    assert answer == "Time deposits have fixed rates."
+    assert len(calls) == 2
+
+
+def test_cancelled_leader_does_not_fail_the_waiters():
+    calls = []
+
+    async def alookup(query: str) -> str:
+        calls.append(query)
+        await asyncio.sleep(0.05)
+        return "Time deposits have fixed rates."
+
+    async def main():
+        search = KnowledgeSearch(None, alookup)
+        leader = asyncio.create_task(search.asearch("time deposit"))
+        await asyncio.sleep(0.01)
+        waiters = [
+            asyncio.create_task(search.asearch("Time deposit?")) for _ in range(2)
+        ]
+        await asyncio.sleep(0.01)
+        # barge-in of the leader's turn and of one of the waiters
+        leader.cancel()
+        waiters[0].cancel()
+        results = await asyncio.gather(leader, *waiters, return_exceptions=True)
+        return search, results
+
+    search, (leader, cancelled_waiter, waiter) = asyncio.run(main())
+
+    assert isinstance(leader, asyncio.CancelledError)
+    assert isinstance(cancelled_waiter, asyncio.CancelledError)
+    assert waiter == "Time deposits have fixed rates."
+    assert calls == ["time deposit"]
+    assert not search.in_flight
+    assert search.search("time deposit") == "Time deposits have fixed rates."
+
+
+def test_errors_are_classified():
+    assert classify_error(KnowledgeNotFound()) == "not_found"
+    assert (
+        classify_error(openai.error.RateLimitError("slow down"))
+        == "embedding_rate_limited"
+    )
+    assert classify_error(openai.error.APIConnectionError("reset")) == "embedding"
+    assert classify_error(psycopg2.errors.SyntaxError()) == "database_query"
+    assert classify_error(ValueError()) == "unexpected"
+
+
+class FakePool:
+    def __init__(self, *connections):
+        self.idle = list(connections)
+        self.returned = []
+
+    def getconn(self):
+        return self.idle.pop(0)
+
+    def putconn(self, connection, close=False):
+        self.returned.append((connection, close))
+        if not close:
+            self.idle.append(connection)
+
+    def closeall(self):
+        pass
+
+
+class Cursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, sql):
+        if self.connection.broken:
+            self.connection.closed = 2
+            raise psycopg2.OperationalError("server closed the connection")
+        if "hsbc_homepage_chunk" in sql:
+            raise psycopg2.errors.UndefinedTable(
+                'relation "hsbc_homepage_chunk" does not exist'
+            )
+        self.rows = [("Time deposit rates of HSBC",)]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class Connection:
+    def __init__(self, broken=False):
+        self.broken = broken
+        self.closed = 0
+        self.autocommit = False
+
+    def cursor(self):
+        return Cursor(self)
+
+
+@contextlib.contextmanager
+def knowledge_pool(pool):
+    import customized_tools
+    from src.resources import registry
+
+    registry.register("pg_pool", lambda: pool)
+    registry.reset("pg_pool")
+    try:
+        yield customized_tools
+    finally:
+        registry.register(
+            "pg_pool",
+            customized_tools.create_pg_pool,
+            close=lambda pool: pool.closeall(),
+        )
+        registry.reset("pg_pool")
+
+
+def test_knowledge_falls_back_to_pages_before_the_chunk_table_exists():
+    connection = Connection()
+    pool = FakePool(connection)
+    with knowledge_pool(pool) as customized_tools:
+        assert (
+            customized_tools.query_hsbc_knowledge([0.0] * 3)
+            == "Time deposit rates of HSBC"
+        )
+    # autocommit: the failed query leaves no aborted transaction for the next query
+    assert connection.autocommit
+    assert pool.returned == [(connection, False)]
+
+
+def test_broken_connection_is_closed_and_not_reused():
+    broken, healthy = Connection(broken=True), Connection()
+    pool = FakePool(broken, healthy)
+    with knowledge_pool(pool) as customized_tools:
+        with pytest.raises(psycopg2.OperationalError):
+            customized_tools.query_hsbc_knowledge([0.0] * 3)
+        assert (
+            customized_tools.query_hsbc_knowledge([0.0] * 3)
+            == "Time deposit rates of HSBC"
+        )
+    assert pool.returned == [(broken, True), (healthy, False)]
+
+
+def test_queries_are_compared_by_their_content_words():
+    assert (
+        query_similarity("What are the time deposit rates?", "time deposit rates")
+        == 1.0
+    )
+    assert (
+        query_similarity("HSBC time deposit rates", "HSBC time deposit interest rates")
+        == 0.8
+    )
+    assert query_similarity("And for 3 months?", "HSBC 3 month time deposit rate") < 0.2
+    assert query_similarity("What is it?", "What is it") == 1.0
+    assert query_similarity("What is it?", "credit card fee") == 0.0
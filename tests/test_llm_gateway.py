@@ -0,0 +1,137 @@
+import asyncio
+import time
+
+import openai
+import pytest
+from langchain.chat_models.fake import FakeListChatModel
+from langchain.llms.fake import FakeListLLM
+from langchain.schema import HumanMessage
+
+from src.llm_gateway import (
+    Deployment,
+    GatewayChatModel,
+    GatewayLLM,
+    LLMGateway,
+    LLMGatewayTimeout,
+    deadline,
+)
+
+
+class StubClient:
+    """Answers after a fixed latency, or raises the queued errors first."""
+
+    def __init__(self, name: str, latency: float = 0.0, errors=()):
+        self.name = name
+        self.latency = latency
+        self.errors = list(errors)
+        self.calls = 0
+
+    def complete(self) -> str:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        time.sleep(self.latency)
+        return self.name
+
+
+def make_gateway(*clients, **kwargs) -> LLMGateway:
+    return LLMGateway([Deployment(c.name, c) for c in clients], **kwargs)
+
+
+def test_hedged_request_cuts_tail_latency():
+    """A slow primary is hedged to the next deployment and the faster answer wins."""
+    slow, fast = StubClient("slow", latency=1.0), StubClient("fast", latency=0.01)
+    gateway = make_gateway(slow, fast, initial_hedge_delay=0.05)
+
+    start = time.perf_counter()
+    result = gateway.call(lambda client: client.complete())
+
+    assert result == "fast"
+    assert time.perf_counter() - start < 0.5
+    assert gateway.hedges == 1
+    assert gateway.hedge_wins == 1
+
+
+def test_throttled_deployment_fails_over_and_cools_down():
+    """A 429 fails over to the next deployment and keeps the throttled one out of rotation."""
+    throttled = StubClient("east", errors=[openai.error.RateLimitError("429")])
+    backup = StubClient("west")
+    gateway = make_gateway(throttled, backup, max_hedges=0, throttle_seconds=60)
+
+    assert gateway.call(lambda client: client.complete()) == "west"
+    assert gateway.call(lambda client: client.complete()) == "west"
+    assert throttled.calls == 1
+    assert gateway.stats()["deployments"]["east"]["throttles"] == 1
+    assert not gateway.stats()["deployments"]["east"]["available"]
+
+
+def test_turn_deadline_bounds_the_call():
+    gateway = make_gateway(StubClient("slow", latency=1.0), max_hedges=0)
+
+    start = time.perf_counter()
+    with deadline(0.1), pytest.raises(LLMGatewayTimeout):
+        gateway.call(lambda client: client.complete())
+    assert time.perf_counter() - start < 0.5
+
+
+def test_invalid_request_is_not_retried():
+    bad = StubClient(
+        "east", errors=[openai.error.InvalidRequestError("context too long", None)]
+    )
+    other = StubClient("west")
+    gateway = make_gateway(bad, other, max_hedges=0)
+
+    with pytest.raises(openai.error.InvalidRequestError):
+        gateway.call(lambda client: client.complete())
+    assert other.calls == 0
+
+
+def test_gateway_chat_model_is_a_langchain_chat_model():
+    gateway = LLMGateway(
+        [Deployment("fake", FakeListChatModel(responses=["Hello from HSBC"]))]
+    )
+    llm = GatewayChatModel(gateway=gateway)
+
+    assert (
+        llm.predict_messages([HumanMessage(content="hi")]).content == "Hello from HSBC"
+    )
+
+
+def test_single_deployment_is_not_hedged():
+    slow = StubClient("only", latency=0.2)
+    gateway = make_gateway(slow, initial_hedge_delay=0.01)
+
+    assert gateway.call(lambda client: client.complete()) == "only"
+    assert slow.calls == 1
+    assert gateway.hedges == 0
+
+
+def test_single_deployment_is_not_retried():
+    throttled = StubClient("only", errors=[openai.error.RateLimitError("429")])
+    gateway = make_gateway(throttled)
+
+    with pytest.raises(openai.error.RateLimitError):
+        gateway.call(lambda client: client.complete())
+    assert throttled.calls == 1
+
+
+def test_gateway_models_support_async_calls():
+    chat = GatewayChatModel(
+        gateway=LLMGateway([Deployment("fake", FakeListChatModel(responses=["Hello"]))])
+    )
+    completion = GatewayLLM(
+        gateway=LLMGateway(
+            [Deployment("fake", FakeListLLM(responses=["Rates are fixed."]))]
+        )
+    )
+
+    async def main():
+        with deadline(5):
+            return (
+                await chat.apredict_messages([HumanMessage(content="hi")]),
+                await completion.apredict("What are the time deposit rates?"),
+            )
+
+    message, text = asyncio.run(main())
+    assert message.content == "Hello"
+    assert text == "Rates are fixed."
@@ -0,0 +1,83 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from src.metrics import (
+    Histogram,
+    MetricsRegistry,
+    recent_turns,
+    span,
+    trace_turn,
+    turns_of_conversation,
+)
+
+
+def test_histogram_renders_cumulative_buckets():
+    """Bucket counts are cumulative and end with +Inf, sum and count."""
+    registry = MetricsRegistry()
+    histogram = registry.histogram("turn_seconds", "Turn latency", ("route",))
+    histogram.observe(0.02, "greeting")
+    histogram.observe(0.3, "greeting")
+    histogram.observe(12.0, "greeting")
+
+    text = registry.render()
+
+    assert "# TYPE turn_seconds histogram" in text
+    assert 'turn_seconds_bucket{route="greeting",le="0.025"} 1' in text
+    assert 'turn_seconds_bucket{route="greeting",le="0.5"} 2' in text
+    assert 'turn_seconds_bucket{route="greeting",le="+Inf"} 3' in text
+    assert 'turn_seconds_count{route="greeting"} 3' in text
+    assert registry.histogram("turn_seconds", "Turn latency") is histogram
+
+
+def test_spans_from_executor_threads_belong_to_the_turn():
+    """Spans recorded in a copied context are attached to the conversation's turn."""
+    recent_turns.clear()
+
+    def lookup():
+        with span("pgvector_query"):
+            pass
+
+    with trace_turn("call-1"):
+        with span("generate_response"):
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(contextvars.copy_context().run, lookup).result()
+    # spans outside a turn only go to the histograms
+    with span("pgvector_query"):
+        pass
+
+    turns = turns_of_conversation("call-1")
+    assert len(turns) == 1
+    assert [s["name"] for s in turns[0]["spans"]] == [
+        "pgvector_query",
+        "generate_response",
+    ]
+    assert turns_of_conversation("call-2") == []
+
+
+def test_histogram_without_labels():
+    histogram = Histogram("llm_seconds", "LLM latency")
+    histogram.observe(1.0)
+    assert "llm_seconds_sum 1.0" in histogram.render()
+
+
+def test_shared_metrics_are_summed_over_workers(tmp_path):
+    """Any worker renders the metrics of all workers sharing the directory."""
+    workers = []
+    for worker, latency in [("1", 0.02), ("2", 0.3)]:
+        registry = MetricsRegistry()
+        registry.histogram("turn_seconds", "Turn latency").observe(latency)
+        registry.counter("calls_total", "Calls", ("model",)).inc(2, "gpt-4")
+        registry.share(str(tmp_path), interval=60, worker=worker)
+        workers.append(registry)
+    workers[1].counter("calls_total", "Calls", ("model",)).inc(1, "gpt-4")
+    # other workers are seen as of their last write
+    assert 'calls_total{model="gpt-4"} 4.0' in workers[0].render()
+    workers[1].write_snapshot()
+
+    text = workers[0].render()
+
+    assert 'calls_total{model="gpt-4"} 5.0' in text
+    assert 'turn_seconds_bucket{le="0.025"} 1' in text
+    assert "turn_seconds_count 2" in text
+    # a stopped worker still counts, so counters never go down
+    assert workers[1].render() == workers[0].render()
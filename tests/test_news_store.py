@@ -0,0 +1,234 @@
+import datetime
+import json
+
+from src.newsearch.news_store import NewsPoller, NewsStore
+from src.newsearch.refinitiv_query import NewsArticle
+
+TODAY = datetime.date.today()
+
+
+def article(story_id, days_ago, headline, story="<p>Full story.</p>"):
+    return NewsArticle(
+        id=story_id,
+        creation_date=TODAY - datetime.timedelta(days=days_ago),
+        headline=headline,
+        topics=[],
+        companies=[],
+        language="en",
+        story=story,
+    )
+
+
+def test_search_matches_all_query_words_newest_first():
+    store = NewsStore()
+    store.add(
+        [
+            article("1", 3, "HSBC raises Hong Kong prime rate"),
+            article(
+                "2", 0, "HSBC to expand wealth business", "<p>Hong Kong clients</p>"
+            ),
+            article("3", 1, "Asian banks rally"),
+            article("4", 0, "HSBC results", story=None),
+        ]
+    )
+
+    assert [a.id for a in store.search("latest news on HSBC Hong Kong")] == ["2", "1"]
+    assert [a.id for a in store.search("hsbc", limit=1)] == ["2"]
+    # headlines without a stored story cannot be summarised
+    assert [a.id for a in store.search("results")] == []
+    assert store.search("news") == []
+
+
+def test_evict_drops_partitions_older_than_window():
+    store = NewsStore(window_days=14)
+    store.add(
+        [
+            article("1", 20, "HSBC old"),
+            article("2", 10, "HSBC recent"),
+            article("3", 2, "HSBC new"),
+        ]
+    )
+    assert "1" not in store and len(store) == 2
+
+    assert store.evict(today=TODAY + datetime.timedelta(days=5)) == 1
+    assert "2" not in store and store.get("3").headline == "HSBC new"
+    assert [a.id for a in store.search("HSBC")] == ["3"]
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.content = json.dumps(payload).encode()
+
+    def iter_content(self, chunk_size):
+        return iter([self.content[:10], self.content[10:]])
+
+    def close(self):
+        pass
+
+
+def test_poller_fetches_stories_of_new_headlines_only(monkeypatch):
+    headlines = [
+        {
+            "ID": f"id{i}",
+            "ST": "Usable",
+            "CT": f"{TODAY.isoformat()}T08:00:00+00:00",
+            "HT": f"HSBC news {i}",
+            "TO": "",
+            "CO": "",
+            "LN": "en",
+        }
+        for i in range(3)
+    ]
+    requests = []
+
+    def send_post_request(url, message, headers, **kwargs):
+        requests.append(message)
+        if "RetrieveHeadlineML" in url:
+            return FakeResponse(
+                {
+                    "RetrieveHeadlineML_Response_1": {
+                        "HeadlineMLResponse": {"HEADLINEML": {"HL": headlines}}
+                    }
+                }
+            )
+        ids = message["RetrieveStoryML_Request_1"]["StoryMLRequest"]["StoryId"][0]
+        stories = [{"ID": i, "ST": "Usable", "TE": f"story of {i}"} for i in ids]
+        return FakeResponse(
+            {
+                "RetrieveStoryML_Response_1": {
+                    "StoryMLResponse": {
+                        "Status": {"StatusMsg": "OK"},
+                        "STORYML": {"HL": stories},
+                    }
+                }
+            }
+        )
+
+    monkeypatch.setattr(
+        "src.newsearch.refinitiv_query.send_post_request", send_post_request
+    )
+    store = NewsStore()
+    store.add([article("id0", 0, "HSBC news 0")])
+    poller = NewsPoller(store, lambda: {}, ["HSBC"])
+
+    assert poller.poll_once() == 2
+    assert requests[-1]["RetrieveStoryML_Request_1"]["StoryMLRequest"]["StoryId"] == [
+        ["id1", "id2"]
+    ]
+    assert store.get("id2").story == "story of id2"
+
+    # the next poll only asks for headlines since the previous one
+    assert poller.poll_once() == 0
+    start_time = requests[-1]["RetrieveHeadlineML_Request_1"]["HeadlineMLRequest"][
+        "StartTime"
+    ]
+    assert start_time >= (poller.last_poll - datetime.timedelta(minutes=6)).strftime(
+        "%Y-%m-%dT%H:%M:%S"
+    )
+
+
+def test_poll_continues_after_a_query_without_headlines(monkeypatch):
+    def send_post_request(url, message, headers, **kwargs):
+        if "RetrieveHeadlineML" in url:
+            query = message["RetrieveHeadlineML_Request_1"]["HeadlineMLRequest"][
+                "Filter"
+            ][0]["FreeTextConstraint"]
+            if query["Value"]["Text"] == "quiet":
+                return FakeResponse(
+                    {
+                        "RetrieveHeadlineML_Response_1": {
+                            "HeadlineMLResponse": {"HEADLINEML": None}
+                        }
+                    }
+                )
+            headline = {
+                "ID": "id1",
+                "ST": "Usable",
+                "CT": f"{TODAY.isoformat()}T08:00:00+00:00",
+                "HT": "HSBC news",
+                "TO": "",
+                "CO": "",
+                "LN": "en",
+            }
+            return FakeResponse(
+                {
+                    "RetrieveHeadlineML_Response_1": {
+                        "HeadlineMLResponse": {"HEADLINEML": {"HL": [headline]}}
+                    }
+                }
+            )
+        stories = [{"ID": "id1", "ST": "Usable", "TE": "story of id1"}]
+        return FakeResponse(
+            {
+                "RetrieveStoryML_Response_1": {
+                    "StoryMLResponse": {
+                        "Status": {"StatusMsg": "OK"},
+                        "STORYML": {"HL": stories},
+                    }
+                }
+            }
+        )
+
+    monkeypatch.setattr(
+        "src.newsearch.refinitiv_query.send_post_request", send_post_request
+    )
+    poller = NewsPoller(NewsStore(), lambda: {}, ["quiet", "HSBC"])
+
+    assert poller.poll_once() == 1
+    assert poller.last_poll is not None
+
+
+def test_poll_pages_newest_headlines_first_back_to_the_last_poll(monkeypatch):
+    pages = [
+        [f"{TODAY.isoformat()}T09:00:00+00:00", f"{TODAY.isoformat()}T08:30:00+00:00"],
+        [f"{TODAY.isoformat()}T08:00:00+00:00"],
+    ]
+    requests = []
+
+    def send_post_request(url, message, headers, **kwargs):
+        if "RetrieveHeadlineML" in url:
+            requests.append(
+                message["RetrieveHeadlineML_Request_1"]["HeadlineMLRequest"]
+            )
+            headlines = [
+                {
+                    "ID": created,
+                    "ST": "Usable",
+                    "CT": created,
+                    "HT": "HSBC news",
+                    "TO": "",
+                    "CO": "",
+                    "LN": "en",
+                }
+                for created in pages[len(requests) - 1]
+            ]
+            return FakeResponse(
+                {
+                    "RetrieveHeadlineML_Response_1": {
+                        "HeadlineMLResponse": {"HEADLINEML": {"HL": headlines}}
+                    }
+                }
+            )
+        ids = message["RetrieveStoryML_Request_1"]["StoryMLRequest"]["StoryId"][0]
+        stories = [{"ID": i, "ST": "Usable", "TE": f"story of {i}"} for i in ids]
+        return FakeResponse(
+            {
+                "RetrieveStoryML_Response_1": {
+                    "StoryMLResponse": {
+                        "Status": {"StatusMsg": "OK"},
+                        "STORYML": {"HL": stories},
+                    }
+                }
+            }
+        )
+
+    monkeypatch.setattr(
+        "src.newsearch.refinitiv_query.send_post_request", send_post_request
+    )
+    poller = NewsPoller(NewsStore(), lambda: {}, ["HSBC"], page_size=2)
+
+    assert poller.poll_once() == 3
+    assert [r["Direction"] for r in requests] == ["Older", "Older"]
+    # the second page ends where the first one did
+    assert requests[1]["EndTime"] < requests[0]["EndTime"]
+    assert requests[1]["StartTime"] == requests[0]["StartTime"]
@@ -0,0 +1,115 @@
+from collections import Counter
+
+from dags.page_content import (
+    DuplicateDetector,
+    Fingerprint,
+    block_key,
+    content_hash,
+    page_blocks,
+    remove_template,
+    template_blocks,
+)
+
+TEMPLATE = """<html><head><script>var tracking = 1;</script></head><body>
+<div class="cookie-banner">We use cookies. Accept all</div>
+<nav><ul><li><a href="/mortgages/">Mortgages</a></li><li><a href="/cards/">Credit cards</a></li></ul></nav>
+<main><div class="promo">Apply in the HSBC HK app today</div>{content}</main>
+<footer>Issued by The Hongkong and Shanghai Banking Corporation Limited</footer></body></html>"""
+
+PAGES = {
+    "/mortgages/": "<h1>Mortgages</h1><p>Get a <a href='#'>cash rebate</a> of up to 1.2% of your loan.</p>",
+    "/cards/": "<h1>Credit cards</h1><p>Earn RewardCash on every purchase with your card.</p>",
+    "/deposits/": "<h1>Time deposits</h1><p>Fixed interest rates for terms from 7 days to 12 months.</p>",
+}
+
+
+def test_template_and_non_content_elements_are_removed():
+    pages = {
+        path: page_blocks(TEMPLATE.format(content=content))
+        for path, content in PAGES.items()
+    }
+    template = template_blocks(pages.values())
+
+    assert pages["/mortgages/"] == [
+        "Apply in the HSBC HK app today",
+        "Mortgages",
+        "Get a cash rebate of up to 1.2% of your loan.",
+    ]
+    # the promo is on every page, so it is part of the site template
+    assert remove_template(pages["/mortgages/"], template) == [
+        "Mortgages",
+        "Get a cash rebate of up to 1.2% of your loan.",
+    ]
+
+
+def test_small_crawls_keep_their_content():
+    pages = [["Shared block", "Page one"], ["Shared block", "Page two"]]
+    assert template_blocks(pages) == set()
+
+
+def test_near_duplicate_pages_are_detected():
+    text = " ".join(
+        f"Sentence {i} about HSBC time deposits and interest rates." for i in range(30)
+    )
+    detector = DuplicateDetector()
+
+    assert detector.duplicate_of("/deposits/", text) is None
+    assert (
+        detector.duplicate_of(
+            "/insights/deposits", text.replace("Sentence 7", "Sentence seven")
+        )
+        == "/deposits/"
+    )
+    assert (
+        detector.duplicate_of(
+            "/cards/", "Earn RewardCash on every purchase with your credit card."
+        )
+        is None
+    )
+
+
+def test_resumed_crawls_remove_the_template_of_all_runs():
+    pages = [
+        ["Shared block", f"Page {i} about HSBC time deposits and interest rates."]
+        for i in range(6)
+    ]
+    counts = Counter()
+    # a run cut short saw four pages, the template of the resumed run is counted over all six
+    assert template_blocks(pages[:4], counts=counts) == {block_key("Shared block")}
+    assert template_blocks(pages[4:]) == set()
+    assert template_blocks(pages[4:], counts=counts, num_pages=4) == {
+        block_key("Shared block")
+    }
+
+
+def test_pages_kept_by_an_earlier_run_are_not_their_own_duplicates():
+    text = " ".join(
+        f"Sentence {i} about HSBC time deposits and interest rates." for i in range(30)
+    )
+    detector = DuplicateDetector()
+
+    assert detector.duplicate_of("/deposits/", text) is None
+    assert detector.duplicate_of("/deposits/", text) is None
+    assert detector.duplicate_of("/insights/deposits", text) == "/deposits/"
+
+
+def test_unchanged_pages_are_recognised():
+    saved = Fingerprint(
+        content_hash("mortgages", "cash rebate"), '"v1"', None, "prompt-1"
+    )
+
+    assert saved.unchanged(
+        Fingerprint(content_hash("mortgages", "cash rebate"), '"v2"', None, "prompt-1")
+    )
+    # a stale or static validator does not hide a content change
+    assert not saved.unchanged(
+        Fingerprint(
+            content_hash("mortgages", "cash rebate, apply"), '"v1"', None, "prompt-1"
+        )
+    )
+    assert not saved.unchanged(
+        Fingerprint(content_hash("mortgages", "no rebate"), '"v2"', None, "prompt-1")
+    )
+    assert not saved.unchanged(
+        Fingerprint(content_hash("mortgages", "cash rebate"), '"v1"', None, "prompt-2")
+    )
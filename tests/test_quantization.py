@@ -0,0 +1,35 @@
+import faiss
+import numpy as np
+import pytest
+
+from src.docsearch.faiss_qa import create_faiss_index
+
+
+def unit_vectors(n, d, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((n, d))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype("float32")
+
+
+@pytest.mark.parametrize(
+    "quantization, max_bytes_per_dimension", [(None, 4), ("fp16", 2), ("int8", 1)]
+)
+def test_quantized_index_finds_the_same_neighbours_in_less_memory(
+    quantization, max_bytes_per_dimension
+):
+    vectors = unit_vectors(500, 64)
+    queries = vectors[:20] + 0.01 * unit_vectors(20, 64, seed=1)
+
+    faiss_index = create_faiss_index(64, vectors, quantization)
+    _, found = faiss_index.search(queries, 1)
+
+    assert (found[:, 0] == np.arange(20)).all()
+    # serialized index includes a small header and the quantizer ranges
+    assert (
+        faiss.serialize_index(faiss_index).nbytes
+        < 500 * 64 * max_bytes_per_dimension + 1024
+    )
+
+
+def test_unknown_quantization():
+    with pytest.raises(ValueError):
+        create_faiss_index(64, unit_vectors(10, 64), "int4")
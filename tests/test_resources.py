@@ -0,0 +1,80 @@
+import threading
+import time
+
+from src.resources import ResourceRegistry
+
+
+def test_resources_are_created_on_first_use_only():
+    """Registering a resource does not call its factory; get builds it once."""
+    calls = []
+    registry = ResourceRegistry()
+    registry.register("conn", lambda: calls.append(1) or object())
+
+    assert calls == []
+    assert not registry.is_initialised("conn")
+    assert registry.get("conn") is registry.get("conn")
+    assert calls == [1]
+
+
+def test_concurrent_get_builds_once():
+    """Threads asking for the same resource at the same time share one instance."""
+    calls = []
+
+    def factory():
+        calls.append(1)
+        time.sleep(0.05)
+        return object()
+
+    registry = ResourceRegistry()
+    registry.register("llm", factory)
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(registry.get("llm")))
+        for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert len({id(r) for r in results}) == 1
+
+
+def test_warmup_runs_in_parallel_and_reports_failures():
+    """Warmup builds resources concurrently and does not raise on failure."""
+
+    def slow():
+        time.sleep(0.2)
+        return object()
+
+    def broken():
+        raise ConnectionError("postgres is unreachable")
+
+    registry = ResourceRegistry()
+    registry.register("a", slow)
+    registry.register("b", slow)
+    registry.register("db", broken)
+
+    start = time.perf_counter()
+    errors = registry.warmup()
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 0.35
+    assert errors == {"a": None, "b": None, "db": "postgres is unreachable"}
+    assert not registry.is_initialised("db")
+
+
+def test_reset_rebuilds_resource():
+    """A reset resource is closed and rebuilt on next use."""
+    registry = ResourceRegistry()
+    closed = []
+    registry.register("conn", object, close=closed.append)
+    first = registry.get("conn")
+    registry.reset("conn")
+    assert closed == [first]
+    assert registry.get("conn") is not first
+    # a dropped resource is only closed once
+    registry.reset("conn")
+    registry.reset("conn")
+    assert len(closed) == 2
@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+import pytest
+
+from src.session_store import InMemorySessionStore, create_session_store
+
+MESSAGES = [
+    {"type": "human", "data": {"content": "What is the HSBC time deposit rate?"}},
+    {"type": "ai", "data": {"content": "It is 4.2% p.a. for a 3 month term."}},
+]
+
+
+def test_save_and_load_per_conversation():
+    """Conversations have separate histories; loaded lists are copies."""
+    store = create_session_store()
+    store.save("call-1", MESSAGES)
+
+    loaded = store.load("call-1")
+    loaded.append({"type": "human", "data": {"content": "thanks"}})
+
+    assert store.load("call-1") == MESSAGES
+    assert store.load("call-2") == []
+    store.delete("call-1")
+    assert store.load("call-1") == []
+
+
+def test_expired_sessions_are_dropped():
+    """Idle conversations expire after the ttl."""
+    store = InMemorySessionStore(ttl_seconds=0)
+    store.save("call-1", MESSAGES)
+    time.sleep(0.01)
+
+    assert store.load("call-1") == []
+    assert store.sessions == {}
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.close_codes = []
+
+    async def close(self, code: int = 1000):
+        self.close_codes.append(code)
+
+
+def test_router_drain_closes_conversations_after_timeout():
+    """Draining refuses new conversations and closes the ones still active at the timeout."""
+    pytest.importorskip("vocode")
+    from hsbc_conversation_router import HSBCConversationRouter
+    from src.speech_pool import WarmPool
+
+    router = HSBCConversationRouter(
+        agent=None,
+        transcriber_pool=WarmPool("transcriber", lambda config: None),
+        synthesizer_pool=WarmPool("synthesizer", lambda config: None),
+    )
+    websocket = FakeWebSocket()
+    router.active_conversations[websocket] = object()
+
+    closed = asyncio.run(router.drain(timeout=0.05, poll_interval=0.01))
+
+    assert router.draining
+    assert closed == 1
+    assert websocket.close_codes == [1012]
@@ -0,0 +1,141 @@
+import json
+import threading
+import time
+
+from langchain.chat_models.fake import FakeListChatModel
+from vocode.streaming.models.agent import AzureOpenAIConfig, ChatGPTAgentConfig
+
+import azure_gpt_agent
+from azure_gpt_agent import AzureChatGPTAgent
+
+
+class FakeKnowledgeTool:
+    name = "hsbc knowledge search tool"
+    description = (
+        "useful for when you need to answer questions about hsbc related knowledge"
+    )
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def run(self, query: str) -> str:
+        with self.lock:
+            self.queries.append(query)
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("pgvector is down")
+        return f"knowledge about {query}"
+
+
+def new_agent(monkeypatch, tool: FakeKnowledgeTool, **kwargs) -> AzureChatGPTAgent:
+    monkeypatch.setattr(azure_gpt_agent, "hsbc_knowledge_tool", tool)
+    agent = AzureChatGPTAgent(
+        ChatGPTAgentConfig(
+            prompt_preamble="This is HSBC Hongkong customer service chatbot.",
+            azure_params=AzureOpenAIConfig(
+                api_type="azure", api_version="2023-05-15", engine="test"
+            ),
+        ),
+        speculative_retrieval=True,
+        **kwargs,
+    )
+    agent.turn_context.conversation_id = "conversation-1"
+    return agent
+
+
+def test_speculative_result_is_used_for_the_same_query(monkeypatch):
+    tool = FakeKnowledgeTool()
+    agent = new_agent(monkeypatch, tool)
+
+    agent.start_speculative_retrieval(
+        "What are the time deposit rates?", "conversation-1"
+    )
+    assert (
+        agent.knowledge_lookup("what are the time deposit rates")
+        == "knowledge about What are the time deposit rates?"
+    )
+    assert tool.queries == ["What are the time deposit rates?"]
+    assert not agent.speculations
+
+
+def test_query_of_another_question_is_looked_up(monkeypatch):
+    tool = FakeKnowledgeTool()
+    agent = new_agent(monkeypatch, tool)
+
+    agent.start_speculative_retrieval("And for 3 months?", "conversation-1")
+    assert (
+        agent.knowledge_lookup("HSBC 3 month time deposit rate")
+        == "knowledge about HSBC 3 month time deposit rate"
+    )
+    assert "HSBC 3 month time deposit rate" in tool.queries
+    assert not agent.speculations
+
+
+def test_rephrased_agent_query_reuses_the_speculative_result(monkeypatch):
+    tool = FakeKnowledgeTool(delay=0.1)
+    agent = new_agent(monkeypatch, tool, use_intent_router=False)
+    agent._llm = FakeListChatModel(
+        responses=[
+            json.dumps(
+                {
+                    "action": "hsbc knowledge search tool",
+                    "action_input": "HSBC time deposit rates",
+                }
+            ),
+            json.dumps(
+                {"action": "Final Answer", "action_input": "The rates are 4.2% p.a."}
+            ),
+        ]
+    )
+
+    assert (
+        agent.route_and_run("What are HSBC time deposit rates?", "conversation-3")
+        == "The rates are 4.2% p.a."
+    )
+    # the transcript was looked up once, in parallel with the first LLM call
+    assert tool.queries == ["What are HSBC time deposit rates?"]
+    assert not agent.speculations
+
+
+def test_slow_or_failed_speculation_falls_back_to_a_lookup(monkeypatch):
+    slow = FakeKnowledgeTool(delay=0.5)
+    agent = new_agent(monkeypatch, slow, speculative_retrieval_timeout=0.01)
+    agent.start_speculative_retrieval("Credit card annual fee", "conversation-1")
+    slow.delay = 0.0
+    assert (
+        agent.knowledge_lookup("Credit card annual fee")
+        == "knowledge about Credit card annual fee"
+    )
+    assert slow.queries == ["Credit card annual fee"] * 2
+
+    failing = FakeKnowledgeTool(fail=True)
+    agent = new_agent(monkeypatch, failing)
+    agent.start_speculative_retrieval("Credit card annual fee", "conversation-1")
+    agent.speculations["conversation-1"][1].exception()
+    failing.fail = False
+    assert (
+        agent.knowledge_lookup("Credit card annual fee")
+        == "knowledge about Credit card annual fee"
+    )
+
+
+def test_unused_speculation_is_dropped_at_the_end_of_the_turn(monkeypatch):
+    tool = FakeKnowledgeTool()
+    agent = new_agent(monkeypatch, tool, use_intent_router=False)
+    agent._llm = FakeListChatModel(
+        responses=[
+            json.dumps(
+                {"action": "Final Answer", "action_input": "Hello, how can I help you?"}
+            )
+        ]
+    )
+
+    assert (
+        agent.route_and_run("Hello there", "conversation-2")
+        == "Hello, how can I help you?"
+    )
+    assert tool.queries == ["Hello there"]
+    assert not agent.speculations
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+
+from src.speech_pool import WarmPool
+
+AUDIO_CONFIG = {"sampling_rate": 44100, "audio_encoding": "linear16"}
+
+
+class FakeClient:
+    def __init__(self, audio_config):
+        self.audio_config = audio_config
+        self.used = False
+        self.thread = threading.get_ident()
+
+
+async def refilled(pool: WarmPool) -> None:
+    """Wait for the background refills of a pool."""
+    while pool._tasks:
+        await asyncio.sleep(0.001)
+
+
+def test_single_use_pool_refills_after_checkout():
+    """Single-use instances are never handed out twice and are replaced in the background."""
+
+    async def run():
+        pool = WarmPool("transcriber", FakeClient, size=2)
+        await pool.warm(AUDIO_CONFIG)
+        first = pool.acquire(AUDIO_CONFIG)
+        second = pool.acquire(AUDIO_CONFIG)
+        # refill runs in the background after the checkout
+        await refilled(pool)
+        third = pool.acquire(AUDIO_CONFIG)
+        pool.release(AUDIO_CONFIG, first)
+        await refilled(pool)
+        return pool, {id(first), id(second), id(third)}
+
+    pool, instance_ids = asyncio.run(run())
+    stats = list(pool.utilization().values())[0]
+    assert len(instance_ids) == 3
+    assert stats["hits"] == 3
+    assert stats["misses"] == 0
+    assert stats["discarded"] == 1
+    assert stats["in_use"] == 2
+    assert stats["idle"] == 2
+
+
+def test_reusable_pool_resets_released_instances():
+    """Reusable instances are reset and handed out again."""
+
+    def reset(client):
+        client.used = False
+
+    async def run():
+        pool = WarmPool("synthesizer", FakeClient, size=1, reusable=True, reset=reset)
+        client = pool.acquire(AUDIO_CONFIG)
+        client.used = True
+        pool.release(AUDIO_CONFIG, client)
+        return pool, client, pool.acquire(AUDIO_CONFIG)
+
+    pool, client, reused = asyncio.run(run())
+    stats = list(pool.utilization().values())[0]
+    assert reused is client
+    assert not reused.used
+    assert stats["misses"] == 1
+    assert stats["recycled"] == 1
+
+
+def test_pools_are_keyed_by_audio_config():
+    """Instances built for one audio config are not used for another."""
+
+    async def run():
+        pool = WarmPool("synthesizer", FakeClient, size=1)
+        await pool.warm(AUDIO_CONFIG)
+        return pool.acquire({"sampling_rate": 48000, "audio_encoding": "linear16"})
+
+    client = asyncio.run(run())
+    assert client.audio_config["sampling_rate"] == 48000
+
+
+def test_instances_are_built_off_the_event_loop():
+    """Building an instance connects to the speech service and must not block live conversations."""
+
+    async def run():
+        loop_thread = threading.get_ident()
+        pool = WarmPool("transcriber", FakeClient, size=1)
+        await pool.warm(AUDIO_CONFIG)
+        warmed = pool.acquire(AUDIO_CONFIG)
+        await refilled(pool)
+        return loop_thread, warmed, pool.acquire(AUDIO_CONFIG)
+
+    loop_thread, warmed, refill = asyncio.run(run())
+    assert warmed.thread != loop_thread
+    assert refill.thread != loop_thread
@@ -0,0 +1,36 @@
+from src.newsearch.story_text import clean_story, html_to_text
+
+STORY = """<div class="storyContent"><style>p{margin:0}</style>
+<p>HONG KONG, July 4 (Reuters) - <a href="https://www.reuters.com">HSBC</a>&#39;s prime rate
+rose&nbsp;12.5   bps.</p>
+<p>The move raises mortgage costs.</p>
+<table><tr><th>Rate</th><th>Current</th></tr><tr><td>Prime</td><td>5.625%</td></tr></table>
+<p>(Reporting by Jane Doe; Editing by John Roe)</p>
+<p>((jane.doe@thomsonreuters.com; +852 1234 5678))</p>
+<p>Our Standards: The Thomson Reuters Trust Principles.</p>
+<p>Reuters has not verified this story and does not vouch for its accuracy.</p>
+<p>The move raises mortgage costs.</p></div>"""
+
+
+def test_clean_story_keeps_only_the_news():
+    story = clean_story(STORY)
+
+    assert story.text == (
+        "HONG KONG, July 4 (Reuters) - HSBC's prime rate rose 12.5 bps.\n\n"
+        "The move raises mortgage costs.\n\n"
+        "Rate | Current\nPrime | 5.625%"
+    )
+    assert story.tokens < story.raw_tokens / 3
+
+
+def test_clean_story_caps_tokens():
+    story = clean_story(
+        " ".join(f"<p>Sentence number {i}.</p>" for i in range(500)), max_tokens=100
+    )
+
+    assert story.tokens <= 102
+    assert story.text.startswith("Sentence number 0.\n\nSentence number 1.")
+
+
+def test_plain_text_passes_through():
+    assert html_to_text("Plain  text\nwith lines") == "Plain text\nwith lines"
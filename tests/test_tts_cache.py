@@ -0,0 +1,49 @@
+import os
+
+from src.tts_cache import TTSAudioCache, make_cache_key
+
+AUDIO_CONFIG = ("linear16", 44100, 0, 15)
+
+
+def test_cache_key_depends_on_voice_config_and_text():
+    """Same text with a different voice or format is a different entry."""
+    key = make_cache_key("en-US-AriaNeural", AUDIO_CONFIG, "Welcome to HSBC")
+    assert key == make_cache_key("en-US-AriaNeural", AUDIO_CONFIG, " Welcome to HSBC ")
+    assert key != make_cache_key("en-US-GuyNeural", AUDIO_CONFIG, "Welcome to HSBC")
+    assert key != make_cache_key(
+        "en-US-AriaNeural", ("linear16", 48000, 0, 15), "Welcome to HSBC"
+    )
+
+
+def test_memory_and_disk_tiers(tmp_path):
+    """Audio persisted to disk is found by a new cache instance, e.g. another worker."""
+    key = make_cache_key("voice", AUDIO_CONFIG, "Welcome to HSBC")
+    cache = TTSAudioCache(cache_dir=str(tmp_path))
+    assert cache.get(key) is None
+    cache.put(key, b"audio")
+    assert cache.get(key) == b"audio"
+    assert os.path.exists(os.path.join(tmp_path, f"{key}.bytes"))
+
+    other_worker_cache = TTSAudioCache(cache_dir=str(tmp_path))
+    assert other_worker_cache.get(key) == b"audio"
+    assert other_worker_cache.stats()["disk_hits"] == 1
+
+
+def test_memory_tier_is_bounded():
+    """Least recently used phrases are evicted from memory."""
+    cache = TTSAudioCache(max_memory_bytes=10)
+    cache.put("a", b"12345", persist=False)
+    cache.put("b", b"12345", persist=False)
+    assert cache.get("a") == b"12345"
+    cache.put("c", b"12345", persist=False)
+    assert cache.get("b") is None
+    assert cache.get("a") == b"12345"
+    assert cache.stats()["memory_bytes"] == 10
+
+
+def test_count_request():
+    """Requests for uncached phrases are counted across conversations."""
+    cache = TTSAudioCache()
+    assert cache.count_request("a") == 1
+    assert cache.count_request("a") == 2
+    assert cache.count_request("b") == 1
@@ -0,0 +1,92 @@
+import re
+
+from src.tts_chunker import SpeechChunker, chunk_stream, chunk_text
+
+# typical banking phrasing returned by the agent
+BANKING_CORPUS = [
+    "The HSBC Premier account requires a total relationship balance of HK$1,000,000. "
+    "If the balance falls below that, a monthly fee of HK$380 applies.",
+    "Our 3-month time deposit rate is currently 3.5% p.a. for new funds. "
+    "The minimum deposit amount is HK$10,000.",
+    "You can apply online at www.hsbc.com.hk/accounts, or visit any branch, e.g. the "
+    "one in Central. Please bring your HKID and proof of address.",
+    "Mr. Chan can call our hotline at 2233 3000 between 9 a.m. and 5 p.m. on weekdays. "
+    "Our staff will help you with the application.",
+    "Yes. Sure. You can transfer up to US$50,000.50 per day via FPS, "
+    "and there is no fee for transfers in HKD.",
+]
+
+
+def stream_tokens(text: str) -> list[str]:
+    """Split text the way an LLM streams it: words, spaces and punctuation apart."""
+    return re.findall(r"\w+|\s+|[^\w\s]", text)
+
+
+def test_numbers_and_currency_are_not_split():
+    """Decimals, thousands separators and currency amounts stay in one chunk."""
+    chunks = chunk_text(BANKING_CORPUS[1])
+    assert chunks == [
+        "Our 3-month time deposit rate is currently 3.5% p.a. for new funds.",
+        "The minimum deposit amount is HK$10,000.",
+    ]
+    assert chunk_text(BANKING_CORPUS[0])[0].endswith("HK$1,000,000.")
+
+
+def test_abbreviations_and_urls_are_not_split():
+    """Abbreviations, times of day and URLs are not treated as sentence ends."""
+    chunks = chunk_text(BANKING_CORPUS[2])
+    assert chunks[0] == (
+        "You can apply online at www.hsbc.com.hk/accounts, or visit any branch, "
+        "e.g. the one in Central."
+    )
+    chunks = chunk_text(BANKING_CORPUS[3])
+    assert chunks[0] == (
+        "Mr. Chan can call our hotline at 2233 3000 between 9 a.m. and 5 p.m. on weekdays."
+    )
+
+
+def test_short_sentences_are_merged():
+    """Fragments below the minimum length are merged with the next sentence."""
+    chunks = chunk_text(BANKING_CORPUS[4])
+    assert chunks[0].startswith(
+        "Yes. Sure. You can transfer up to US$50,000.50 per day"
+    )
+    assert all(len(chunk) >= 40 for chunk in chunks)
+
+
+def test_long_sentences_split_at_clause_boundary():
+    """Sentences above the maximum length are split at a comma."""
+    text = (
+        "To open an account you will need your identity card, proof of address, "
+        "proof of income and your tax residency information, "
+        "and you can then complete the application in the HSBC HK App."
+    )
+    chunks = chunk_text(text, min_length=20, max_length=100)
+    assert chunks[0] == (
+        "To open an account you will need your identity card, proof of address,"
+    )
+    assert all(len(chunk) <= 100 for chunk in chunks)
+
+
+def test_streaming_matches_full_text():
+    """Feeding tokens one by one gives the same chunks as the complete text."""
+    for text in BANKING_CORPUS:
+        assert chunk_stream(stream_tokens(text)) == chunk_text(text)
+
+
+def test_chunks_are_emitted_before_the_stream_ends():
+    """The first sentence is available as soon as the next token arrives."""
+    chunker = SpeechChunker()
+    emitted = []
+    for token in stream_tokens(BANKING_CORPUS[0]):
+        emitted.extend(chunker.feed(token))
+    assert len(emitted) == 1
+    assert chunker.flush() == [
+        "If the balance falls below that, a monthly fee of HK$380 applies."
+    ]
+
+
+def test_no_text_is_lost():
+    """All words of the response are synthesized exactly once."""
+    for text in BANKING_CORPUS:
+        assert " ".join(chunk_text(text)).split() == text.split()
@@ -0,0 +1,97 @@
+import pytest
+from langchain.chat_models.fake import FakeListChatModel
+from langchain.schema import HumanMessage
+
+from src.llm_gateway import Deployment, GatewayChatModel, LLMGateway
+from src.session_store import InMemorySessionStore
+from src.usage import (
+    BudgetGuard,
+    UsageLedger,
+    ledger,
+    model_price,
+    record_llm_output,
+    usage_feature,
+    usage_owner,
+)
+
+
+def test_usage_is_accounted_by_owner_feature_and_model():
+    usage_ledger = UsageLedger(max_owners=2)
+    with usage_owner("conversation-1"):
+        with usage_feature("agent"):
+            usage_ledger.record("gpt-35-turbo-0613", 1000, 200)
+            usage_ledger.record("gpt-35-turbo-0613", 500, 100)
+        with usage_feature("knowledge_search"):
+            usage_ledger.record("text-embedding-ada-002", 10)
+
+    report = usage_ledger.report("conversation-1")
+    assert report["total"]["total_tokens"] == 1810
+    assert report["total"]["cost_usd"] == pytest.approx(0.002851)
+    assert [(row["feature"], row["calls"]) for row in report["by_feature"]] == [
+        ("agent", 2),
+        ("knowledge_search", 1),
+    ]
+
+    # calls without owner are only counted in the metrics, the oldest owners are dropped
+    usage_ledger.record("gpt-4", 100)
+    usage_ledger.record("gpt-4", 100, owner="conversation-2")
+    usage_ledger.record("gpt-4", 100, owner="conversation-3")
+    assert set(usage_ledger.owners) == {"conversation-2", "conversation-3"}
+
+
+def test_model_prices_and_reported_usage():
+    assert model_price("gpt-3.5-turbo") == model_price("gpt-35-turbo")
+    assert model_price("gpt-4-32k-0613") == (0.06, 0.12)
+    assert model_price("unknown-model") == (0.0, 0.0)
+
+    llm_output = {
+        "token_usage": {"prompt_tokens": 30, "completion_tokens": 5},
+        "model_name": "gpt-4",
+    }
+    usage = record_llm_output(
+        llm_output, "unknown", lambda: (0, 0), owner="conversation-4"
+    )
+    assert (usage.prompt_tokens, usage.completion_tokens) == (30, 5)
+    estimated = record_llm_output(
+        None, "gpt-4", lambda: (12, 3), owner="conversation-4"
+    )
+    assert (estimated.prompt_tokens, estimated.completion_tokens) == (12, 3)
+
+
+def test_gateway_calls_are_accounted_to_the_conversation():
+    gateway = LLMGateway(
+        [Deployment("fake", FakeListChatModel(responses=["Hello from HSBC"]))],
+        max_hedges=0,
+    )
+    llm = GatewayChatModel(gateway=gateway)
+    budget = BudgetGuard(ledger, max_tokens=5)
+
+    with usage_owner("conversation-5"):
+        assert not budget.exceeded()
+        with usage_feature("knowledge_answer"):
+            llm.predict_messages(
+                [HumanMessage(content="What are the time deposit rates?")]
+            )
+        assert budget.exceeded()
+
+    (row,) = ledger.report("conversation-5")["by_feature"]
+    assert row["feature"] == "knowledge_answer"
+    assert row["calls"] == 1
+    assert row["prompt_tokens"] > 0 and row["completion_tokens"] > 0
+    assert not BudgetGuard(ledger).exceeded("conversation-5")
+
+
+def test_usage_is_shared_by_the_workers_through_the_session_store():
+    store = InMemorySessionStore()
+    first_worker, second_worker = UsageLedger(), UsageLedger()
+    first_worker.share(store)
+    second_worker.share(store)
+
+    first_worker.record("gpt-4", 100, 10, feature="agent", owner="conversation-6")
+    assert second_worker.report("conversation-6")["total"]["total_tokens"] == 110
+
+    # the client reconnects to the second worker, which continues from the shared usage
+    second_worker.record("gpt-4", 50, 5, feature="agent", owner="conversation-6")
+    assert second_worker.total("conversation-6").total_tokens == 165
+    (row,) = first_worker.report("conversation-6")["by_feature"]
+    assert (row["calls"], row["total_tokens"]) == (2, 165)